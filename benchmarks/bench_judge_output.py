@@ -0,0 +1,136 @@
+# heartflow/benchmarks/bench_judge_output.py
+# (v11.24) 判断模型输出格式基准
+# 用法: python benchmarks/bench_judge_output.py [每种格式的调用次数，默认 10000] [偏差率，默认 0.03]
+# 对比 (使用模拟提供商，不调用真实模型)：
+#   json+reasoning - v11.23 及之前的默认输出 (JSON + reasoning)
+#   json           - JSON，关闭 reasoning
+#   compact        - v11.24 紧凑单行输出 ("7,5,6,p")
+# 模拟提供商按“偏差率”输出常见的格式偏差 (代码块包裹、前后多余文字、截断、全角逗号等)，
+# 统计每种格式的输出 token 数 (近似：每个汉字 / 英文单词 / 数字 / 标点计 1 个) 与解析失败率
+# 解码耗时按 token 数 × 每 token 毫秒数估算 (HEARTFLOW_BENCH_MS_PER_TOKEN，默认 20)
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import importlib.util
+
+# 直接按文件加载 judge_format (不依赖 astrbot 运行环境)
+_JUDGE_FORMAT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils", "judge_format.py")
+_spec = importlib.util.spec_from_file_location("heartflow_judge_format", _JUDGE_FORMAT_PATH)
+judge_format = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(judge_format)
+
+MS_PER_TOKEN = float(os.environ.get("HEARTFLOW_BENCH_MS_PER_TOKEN", "20"))
+# 按开启 judge_local_features (v11.23) 的情况测试：timing / continuity 本地计算，模型只输出这三项
+FIELDS = judge_format.JUDGE_LLM_SCORE_FIELDS
+MOODS = ("positive", "negative", "neutral")
+MOOD_TO_CODE = {mood: code for code, mood in judge_format.MOOD_CODES.items()}
+REASONINGS = (
+    "这条消息在讨论我刚才提到的话题，内容比较有趣，群里气氛也不错，适合顺着接一句。",
+    "对方只是在和别人闲聊，与我关系不大，而且我刚刚已经说过话了，暂时不插话比较自然。",
+    "消息里有明确的问题，和我的人设相关，心情也还可以，回复的意愿比较高。",
+    "群里正在刷屏，消息本身没有太多信息量，贸然插话可能显得突兀，倾向于不回复。",
+)
+_TOKEN_PATTERN = re.compile(r"[一-鿿]|[A-Za-z]+|\d+|[^\sA-Za-z\d一-鿿]")
+
+
+class StubResponse:
+    def __init__(self, completion_text: str):
+        self.completion_text = completion_text
+
+
+class StubJudgeProvider:
+    """模拟判断模型：按格式生成评分输出，并以 deviation 概率产生常见的格式偏差"""
+
+    def __init__(self, output_format: str, deviation: float, seed: int = 42):
+        self.output_format = output_format
+        self.deviation = deviation
+        self.rng = random.Random(seed)
+
+    async def text_chat(self, prompt: str = "", contexts: list = None, **kwargs) -> StubResponse:
+        scores = {field: self.rng.randint(0, 10) for field in FIELDS}
+        mood = self.rng.choice(MOODS)
+        if self.output_format == "compact":
+            text = ",".join(str(scores[field]) for field in FIELDS) + "," + MOOD_TO_CODE[mood]
+            return StubResponse(self._deviate_compact(text))
+        data = dict(scores, inferred_mood=mood)
+        if self.output_format == "json+reasoning":
+            data["reasoning"] = self.rng.choice(REASONINGS)
+        text = json.dumps(data, ensure_ascii=False, indent=4)
+        return StubResponse(self._deviate_json(text))
+
+    def _deviate_json(self, text: str) -> str:
+        if self.rng.random() >= self.deviation:
+            return text
+        return self.rng.choice((
+            lambda t: f"```json\n{t}\n```",              # 可解析
+            lambda t: f"好的，以下是评估结果：\n{t}",      # 失败
+            lambda t: f"{t}\n以上是我的判断。",            # 失败
+            lambda t: t[:len(t) // 2],                    # 截断，失败
+        ))(text)
+
+    def _deviate_compact(self, text: str) -> str:
+        if self.rng.random() >= self.deviation:
+            return text
+        return self.rng.choice((
+            lambda t: t.replace(",", ", "),               # 可解析
+            lambda t: t.replace(",", "，"),               # 可解析
+            lambda t: f"`{t}`",                           # 失败
+            lambda t: f"评分：{t}",                        # 失败
+            lambda t: t.rsplit(",", 1)[0],                # 缺少心情，失败
+        ))(text)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+async def run_format(output_format: str, calls: int, deviation: float) -> dict:
+    provider = StubJudgeProvider(output_format, deviation)
+    tokens = []
+    failures = 0
+    parse_seconds = 0.0
+    for _ in range(calls):
+        response = await provider.text_chat(prompt="(stub)")
+        content = response.completion_text.strip()
+        tokens.append(estimate_tokens(content))
+        start = time.perf_counter()
+        try:
+            if output_format == "compact":
+                judge_format.parse_compact_judge(content, FIELDS)
+            else:
+                judge_format.parse_json_judge(content)
+        except ValueError:
+            failures += 1
+        parse_seconds += time.perf_counter() - start
+    tokens.sort()
+    mean_tokens = sum(tokens) / calls
+    return {
+        "mean_tokens": mean_tokens,
+        "p95_tokens": tokens[int(calls * 0.95) - 1],
+        "failure_rate": failures / calls,
+        "parse_us": parse_seconds / calls * 1e6,
+        "decode_ms": mean_tokens * MS_PER_TOKEN,
+    }
+
+
+async def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    deviation = float(sys.argv[2]) if len(sys.argv) > 2 else 0.03
+    print(f"判断输出格式基准: 每种格式 {calls} 次调用 | 偏差率 {deviation:.1%} | 维度 {', '.join(FIELDS)}")
+    print(f"{'格式':<16}{'平均 token':>12}{'P95 token':>12}{'解析失败率':>12}{'解析耗时(us)':>14}{'估算解码(ms)':>14}")
+    results = {}
+    for output_format in ("json+reasoning", "json", "compact"):
+        r = results[output_format] = await run_format(output_format, calls, deviation)
+        print(f"{output_format:<16}{r['mean_tokens']:>12.1f}{r['p95_tokens']:>12}{r['failure_rate']:>12.2%}"
+              f"{r['parse_us']:>14.2f}{r['decode_ms']:>14.1f}")
+    baseline = results["json+reasoning"]["mean_tokens"]
+    print(f"紧凑格式输出 token 相对 json+reasoning 减少 {1 - results['compact']['mean_tokens'] / baseline:.1%}，"
+          f"相对 json 减少 {1 - results['compact']['mean_tokens'] / results['json']['mean_tokens']:.1%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+# heartflow/benchmarks/bench_profile_memory.py
+# (v11.10) 用户画像内存占用基准
+# 用法: python benchmarks/bench_profile_memory.py [数量，默认 1000000]
+#       (tracemalloc 开启时加载较慢，100 万条约需 1~2 分钟)
+# 对比：
+#   before - v11.9 及之前的布局 (普通 dataclass + __dict__，层级为字符串，键未驻留)
+#   after  - 当前 datamodels.UserProfile (__slots__ + tier_code 小整数，键驻留)
+# 两种布局都模拟"从存储行加载"：每个 user_id 在字典键和 profile.user_id 中各出现一次
+import gc
+import os
+import sys
+import time
+import random
+import tracemalloc
+import importlib.util
+from dataclasses import dataclass
+
+# 直接按文件加载 datamodels (不依赖 astrbot 运行环境)
+_DATAMODELS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "datamodels.py")
+_spec = importlib.util.spec_from_file_location("heartflow_datamodels", _DATAMODELS_PATH)
+datamodels = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(datamodels)
+
+
+@dataclass
+class LegacyUserProfile:
+    """v11.9 及之前的 UserProfile 布局"""
+    user_id: str
+    name: str
+    social_score: float = 0.0
+    relationship_tier: str = "stranger"
+    last_seen: float = 0.0
+    last_decay_check_time: float = 0.0
+
+
+def synthetic_rows(count: int, seed: int = 42):
+    """生成与存储后端返回格式一致的画像行 (每行的字符串都是新对象，与 json.loads 一致)"""
+    rng = random.Random(seed)
+    tiers = datamodels.RELATIONSHIP_TIERS
+    now = time.time()
+    for i in range(count):
+        user_id = str(100000000 + i)
+        yield user_id, {
+            "user_id": str(100000000 + i),
+            "name": f"用户{i}",
+            "social_score": round(rng.uniform(-100, 100), 2),
+            "relationship_tier": tiers[rng.randrange(len(tiers))].encode().decode(), # 新字符串对象
+            "last_seen": now - rng.uniform(0, 86400 * 30),
+            "last_decay_check_time": now - rng.uniform(0, 86400),
+        }
+
+
+def load_before(rows):
+    return {user_id: LegacyUserProfile(**row) for user_id, row in rows}
+
+
+def load_after(rows):
+    profiles = {}
+    for _, row in rows:
+        profile = datamodels.UserProfile.from_dict(row)
+        profiles[profile.user_id] = profile
+    return profiles
+
+
+def measure(loader, count: int):
+    """返回 (总字节数, 每画像字节数, 耗时秒)；只统计加载后仍存活的内存"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    profiles = loader(synthetic_rows(count))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(profiles) == count
+    del profiles
+    return current, current / count, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"合成画像数量: {count:,}")
+    results = {}
+    for label, loader in (("before", load_before), ("after", load_after)):
+        total, per_profile, elapsed = measure(loader, count)
+        results[label] = per_profile
+        print(f"{label:>6}: 总计 {total / 1024 / 1024:8.1f} MiB | 每画像 {per_profile:6.1f} B | 加载 {elapsed:.2f}s")
+    saved = 1 - results["after"] / results["before"]
+    print(f"每画像节省 {results['before'] - results['after']:.1f} B ({saved:.1%})")
+
+
+if __name__ == "__main__":
+    main()
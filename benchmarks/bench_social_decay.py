@@ -0,0 +1,112 @@
+# heartflow/benchmarks/bench_social_decay.py
+# (v11.11) 社交衰减基准 (v11.12 改为闭式结算)：逐个画像的 decay_social_score vs NumPy 列存储
+# 用法: python benchmarks/bench_social_decay.py [数量1 数量2 ...，默认 10000 100000 1000000]
+# 每个规模测两种轮次：
+#   idle  - 所有画像今天已检查过 (批量结算的绝大多数轮次)，只重算层级
+#   daily - 所有画像都错过了若干次每日检查，补齐衰减 + 重算层级 + 写回
+# 逐个结算复现 StateManager._materialize_profile (不含日志与脏标记)，并校验两者结果逐行一致
+import os
+import sys
+import time
+import types
+import random
+import importlib
+
+# 把仓库根目录注册为 heartflow 包，直接导入 core 模块 (不依赖 astrbot 运行环境)
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_package = types.ModuleType("heartflow")
+_package.__path__ = [_ROOT]
+sys.modules.setdefault("heartflow", _package)
+
+datamodels = importlib.import_module("heartflow.datamodels")
+decay = importlib.import_module("heartflow.core.decay")
+profile_columns = importlib.import_module("heartflow.core.profile_columns")
+
+# 与 HeartflowConfig 默认值一致
+GRACE_SEC = 3 * 86400
+STEP = 0.5
+AVOID, FRIEND, ACQ = -20.0, 50.0, 10.0
+
+
+def make_profiles(count: int, now: float, due: bool, seed: int = 42):
+    rng = random.Random(seed)
+    profiles = []
+    for i in range(count):
+        missed_days = rng.randint(1, 10) if due else 0
+        profiles.append(datamodels.UserProfile(
+            user_id=str(100000000 + i),
+            name=f"用户{i}",
+            social_score=round(rng.uniform(-60, 60), 1),
+            last_seen=now - rng.uniform(0, 86400 * 10),
+            last_decay_check_time=now - missed_days * 86400 - rng.uniform(0, 86000),
+        ))
+    return profiles
+
+
+def scalar_loop(profiles, now: float) -> int:
+    changed = 0
+    for profile in profiles:
+        original = profile.social_score
+        profile.social_score, profile.last_decay_check_time = decay.decay_social_score(
+            profile.social_score, profile.last_seen, profile.last_decay_check_time, now, GRACE_SEC, STEP
+        )
+        if profile.social_score != original:
+            changed += 1
+        score = profile.social_score
+        if score <= AVOID:
+            profile.relationship_tier = "avoiding"
+        elif score >= FRIEND:
+            profile.relationship_tier = "friend"
+        elif score >= ACQ:
+            profile.relationship_tier = "acquaintance"
+        else:
+            profile.relationship_tier = "stranger"
+    return changed
+
+
+def vectorized(store, now: float) -> int:
+    _, changed = store.settle(now, GRACE_SEC, STEP, AVOID, FRIEND, ACQ)
+    return changed
+
+
+def state_of(profiles):
+    return [(p.social_score, p.tier_code, p.last_decay_check_time) for p in profiles]
+
+
+def bench(count: int, due: bool):
+    now = time.time()
+    loop_profiles = make_profiles(count, now, due)
+    vec_profiles = make_profiles(count, now, due)
+    store = profile_columns.ProfileColumnStore()
+    store.extend(vec_profiles)
+    if not due:
+        # 先结算一轮，使层级与分数一致 (模拟运行中的稳定状态)
+        scalar_loop(loop_profiles, now - 1)
+        vectorized(store, now - 1)
+
+    start = time.perf_counter()
+    loop_changed = scalar_loop(loop_profiles, now)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vec_changed = vectorized(store, now)
+    vec_time = time.perf_counter() - start
+
+    assert loop_changed == vec_changed, (loop_changed, vec_changed)
+    assert state_of(loop_profiles) == state_of(vec_profiles), "列存储结果与逐个结算不一致"
+    return loop_time, vec_time, vec_changed
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print(f"{'用户数':>10} | {'轮次':<5} | {'逐个结算':>12} | {'NumPy 列存储':>12} | {'加速':>7} | 衰减数")
+    for count in sizes:
+        for due in (False, True):
+            loop_time, vec_time, changed = bench(count, due)
+            label = "daily" if due else "idle"
+            print(f"{count:>10,} | {label:<5} | {loop_time * 1000:>10.1f}ms | {vec_time * 1000:>10.1f}ms | "
+                  f"{loop_time / vec_time:>6.1f}x | {changed:,}")
+
+
+if __name__ == "__main__":
+    main()
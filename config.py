@@ -16,6 +16,11 @@ class HeartflowConfig:
     # --- 全局 ---
     general_pool: list = field(default_factory=list)
     enable_heartflow: bool = False
+    startup_ready_timeout_seconds: float = 30.0
+    storage_backend: str = "json"
+    storage_flush_interval_seconds: int = 60
+    profile_store_lazy: bool = False
+    profile_store_idle_seconds: int = 1800
 
     # --- 判断 ---
     judge_provider_names: list = field(default_factory=list)
@@ -24,7 +29,16 @@ class HeartflowConfig:
     humanization_word_count: int = 30 
     judge_include_reasoning: bool = True
     judge_max_retries: int = 3
+    judge_multimodal: bool = False
     overload_cooldown_seconds: int = 60
+    short_circuit_rules: list = field(default_factory=list)
+    short_circuit_keywords: list = field(default_factory=list)
+    short_circuit_cooldown_seconds: float = 10.0
+    short_circuit_min_energy: float = 0.2
+    judge_escalation_provider_names: list = field(default_factory=list)
+    judge_escalation_margin: float = 0.1
+    judge_local_features: bool = False
+    judge_compact_output: bool = False
 
     # --- API 优化 (v3.0) ---
     summary_judgment_count: int = 10
@@ -42,6 +56,7 @@ class HeartflowConfig:
     
     # --- v4.2 情绪 (F3) ---
     emotion_decay_interval_hours: float = 1.0
+    energy_passive_recovery_per_hour: float = 0.6
 
     # --- 上下文 ---
     context_messages_count: int = 5
@@ -63,6 +78,7 @@ class HeartflowConfig:
     score_negative_interaction: float = -1.5
     score_decay_rate_per_day: float = -0.5
     social_memory_decay_days: int = 3
+    social_decay_vectorized: bool = False
 
     # --- 感知 & 多模态 (v3.0) ---
     enable_user_profiles: bool = False
@@ -70,6 +86,21 @@ class HeartflowConfig:
     image_recognition_provider_name: str = ""
     image_recognition_prompt: str = ""
     enable_poke_response: bool = False
+    poke_reply_pool_size: int = 8
+    poke_active_window_seconds: int = 300
+    poke_coalesce_window_seconds: float = 2.0
+    poke_rate_limit_count: int = 3
+    poke_rate_limit_window_seconds: int = 60
+    enable_vl_cache: bool = True
+    vl_cache_max_entries: int = 2000
+    vl_cache_hash_content: bool = False
+    vl_cache_phash_enabled: bool = False
+    vl_cache_phash_max_distance: int = 5
+    vl_cache_phash_max_entries: int = 4096
+    enrichment_timeout_seconds: float = 10.0
+    enrichment_vl_timeout_seconds: float = 30.0
+    main_llm_image_policy: str = "no_description"
+    main_llm_image_token_estimate: int = 765
 
     # --- 主动话题 (v2.0) ---
     proactive_enabled: bool = False
@@ -77,6 +108,10 @@ class HeartflowConfig:
     proactive_energy_threshold: float = 0.9
     proactive_silence_threshold_minutes: int = 120
     proactive_global_cooldown_seconds: int = 60
+    proactive_max_concurrency: int = 3
+    proactive_single_call: bool = True
+    proactive_topic_pool_size: int = 5
+    proactive_topic_pool_idle_rate: float = 10.0
 
     # --- 表情 (v2.1) ---
     enable_emotion_sending: bool = False
@@ -94,6 +129,16 @@ class HeartflowConfig:
         # --- 全局 ---
         self.general_pool = config.get("general_small_model_pool", [])
         self.enable_heartflow = config.get("enable_heartflow", False)
+        self.startup_ready_timeout_seconds = config.get("startup_ready_timeout_seconds", 30.0) # (v11.0) 异步启动
+        # (v11.6) 状态存储后端
+        self.storage_backend = config.get("storage_backend", "json")
+        if self.storage_backend not in ("json", "sqlite"):
+            logger.warning(f"Config: 未知的 storage_backend '{self.storage_backend}'，回退为 'json'。")
+            self.storage_backend = "json"
+        self.storage_flush_interval_seconds = config.get("storage_flush_interval_seconds", 60)
+        # (v11.9) 懒加载画像库 (需要 sqlite 后端)
+        self.profile_store_lazy = config.get("profile_store_lazy", False)
+        self.profile_store_idle_seconds = config.get("profile_store_idle_seconds", 1800)
 
         # --- 判断 ---
         self.judge_provider_names = config.get("judge_provider_names", [])
@@ -102,8 +147,27 @@ class HeartflowConfig:
         self.humanization_word_count = config.get("humanization_word_count", 30)
         self.judge_include_reasoning = config.get("judge_include_reasoning", True)
         self.judge_max_retries = max(0, config.get("judge_max_retries", 3))
+        self.judge_multimodal = config.get("judge_multimodal", False) # (v11.4) 判断模型兼任 VL
         self.force_reply_bonus_score = config.get("force_reply_bonus_score", 0.5)
         self.overload_cooldown_seconds = config.get("overload_cooldown_seconds", 60)
+        # (v11.21) 判断前规则短路
+        self.short_circuit_rules = []
+        for rule in config.get("short_circuit_rules", []):
+            if rule in ("nickname", "reply_to_bot", "keyword", "poke"):
+                self.short_circuit_rules.append(rule)
+            else:
+                logger.warning(f"Config: 未知的 short_circuit_rules 规则 '{rule}'，已忽略。")
+        self.short_circuit_keywords = [k for k in config.get("short_circuit_keywords", []) if k]
+        self.short_circuit_cooldown_seconds = config.get("short_circuit_cooldown_seconds", 10.0)
+        self.short_circuit_min_energy = config.get("short_circuit_min_energy", 0.2)
+        # (v11.22) 两级判断 (强模型列表为空时关闭)
+        self.judge_escalation_provider_names = config.get("judge_escalation_provider_names", [])
+        self.judge_escalation_margin = max(0.0, config.get("judge_escalation_margin", 0.1))
+        self.judge_local_features = config.get("judge_local_features", False) # (v11.23) timing / continuity 本地计算 (默认关闭)
+        # (v11.24) 紧凑判断输出：不输出 reasoning
+        self.judge_compact_output = config.get("judge_compact_output", False)
+        if self.judge_compact_output:
+            self.judge_include_reasoning = False
 
         # --- API 优化 (v3.0) ---
         self.summary_judgment_count = config.get("summary_judgment_count", 10)
@@ -121,6 +185,7 @@ class HeartflowConfig:
         
         # --- v4.2 情绪 (F3) ---
         self.emotion_decay_interval_hours = config.get("emotion_decay_interval_hours", 1.0) #
+        self.energy_passive_recovery_per_hour = config.get("energy_passive_recovery_per_hour", 0.6) # (v11.12)
         
         # --- 上下文 ---
         self.context_messages_count = config.get("context_messages_count", 5)
@@ -144,6 +209,7 @@ class HeartflowConfig:
         self.score_decay_rate_per_day = config.get("score_decay_rate_per_day", -0.5)
         
         self.social_memory_decay_days = config.get("social_memory_decay_days", 3) #
+        self.social_decay_vectorized = config.get("social_decay_vectorized", False) # (v11.11) 需要 numpy
 
         # --- 感知 & 多模态 (v3.0) ---
         self.enable_user_profiles = config.get("enable_user_profiles", False)
@@ -151,6 +217,33 @@ class HeartflowConfig:
         self.image_recognition_provider_name = config.get("image_recognition_provider_name", "")
         self.image_recognition_prompt = config.get("image_recognition_prompt", "这是一张图。请用5-10个词简要描述这张图的核心内容。如果是表情包，请描述情绪。")
         self.enable_poke_response = config.get("enable_poke_response", False)
+        # (v11.19) 戳一戳回复池
+        self.poke_reply_pool_size = config.get("poke_reply_pool_size", 8)
+        self.poke_active_window_seconds = config.get("poke_active_window_seconds", 300)
+        # (v11.20) 戳一戳合并 & 限流
+        self.poke_coalesce_window_seconds = config.get("poke_coalesce_window_seconds", 2.0)
+        self.poke_rate_limit_count = config.get("poke_rate_limit_count", 3)
+        self.poke_rate_limit_window_seconds = config.get("poke_rate_limit_window_seconds", 60)
+        
+        # --- v11.1 VL 描述缓存 ---
+        self.enable_vl_cache = config.get("enable_vl_cache", True)
+        self.vl_cache_max_entries = config.get("vl_cache_max_entries", 2000)
+        self.vl_cache_hash_content = config.get("vl_cache_hash_content", False)
+        # (v11.2) 感知哈希去重 (需要 Pillow)
+        self.vl_cache_phash_enabled = config.get("vl_cache_phash_enabled", False)
+        self.vl_cache_phash_max_distance = config.get("vl_cache_phash_max_distance", 5)
+        self.vl_cache_phash_max_entries = config.get("vl_cache_phash_max_entries", 4096)
+        
+        # --- v11.3 并发富化阶段 ---
+        self.enrichment_timeout_seconds = config.get("enrichment_timeout_seconds", 10.0)
+        self.enrichment_vl_timeout_seconds = config.get("enrichment_vl_timeout_seconds", 30.0)
+
+        # --- v11.5 主 LLM 视觉去重 ---
+        self.main_llm_image_policy = config.get("main_llm_image_policy", "no_description")
+        if self.main_llm_image_policy not in ("always", "no_description", "never"):
+            logger.warning(f"Config: 未知的 main_llm_image_policy '{self.main_llm_image_policy}'，回退为 'no_description'。")
+            self.main_llm_image_policy = "no_description"
+        self.main_llm_image_token_estimate = config.get("main_llm_image_token_estimate", 765)
 
         # --- 主动话题 (v2.0) ---
         self.proactive_enabled = config.get("proactive_enabled", False)
@@ -158,6 +251,11 @@ class HeartflowConfig:
         self.proactive_energy_threshold = config.get("proactive_energy_threshold", 0.9)
         self.proactive_silence_threshold_minutes = config.get("proactive_silence_threshold_minutes", 120)
         self.proactive_global_cooldown_seconds = config.get("proactive_global_cooldown_seconds", 60)
+        self.proactive_max_concurrency = config.get("proactive_max_concurrency", 3) # (v11.15)
+        self.proactive_single_call = config.get("proactive_single_call", True) # (v11.16)
+        # (v11.18) 主动话题预生成池
+        self.proactive_topic_pool_size = config.get("proactive_topic_pool_size", 5)
+        self.proactive_topic_pool_idle_rate = config.get("proactive_topic_pool_idle_rate", 10.0)
 
         # --- 表情 (v2.1) ---
         self.enable_emotion_sending = config.get("enable_emotion_sending", False)
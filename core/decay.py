@@ -0,0 +1,75 @@
+# heartflow/core/decay.py
+# (新) v11.12 闭式衰减
+# 职责：根据上次结算的时间戳，一次性算出“如果后台任务一直在跑”此刻应有的心情 / 精力 / 社交分
+#       (纯函数，不修改对象，由 StateManager 在读取时调用)
+from typing import Tuple
+
+DAY_SECONDS = 86400
+
+# (R1) 被动精力恢复：沉默多久后开始恢复、最多恢复到多少
+PASSIVE_ENERGY_SILENCE_SECONDS = 3600
+PASSIVE_ENERGY_CAP = 0.8
+
+
+def _toward_zero(value: float, amount: float) -> float:
+    """向 0 移动 amount，越过 0 时停在 0"""
+    if value > amount:
+        return value - amount
+    if value < -amount:
+        return value + amount
+    return 0.0
+
+
+def decay_mood(mood: float, last_decay_time: float, now: float, interval_sec: float, step: float) -> Tuple[float, float]:
+    """
+    (F3) 情绪衰减：每经过 interval_sec，心情向 0 平复 step
+    返回 (心情, 新的结算时间)；结算时间按整周期推进，保留不足一个周期的余量
+    interval_sec <= 0 视为关闭衰减：心情保持不变
+    """
+    if interval_sec <= 0:
+        return mood, now
+    periods = int((now - last_decay_time) // interval_sec)
+    if periods <= 0:
+        return mood, last_decay_time
+    return _toward_zero(mood, periods * step), last_decay_time + periods * interval_sec
+
+
+def recover_energy(energy: float, last_reply_time: float, last_update_time: float, now: float,
+                   rate_per_sec: float, cap: float = PASSIVE_ENERGY_CAP,
+                   silence_sec: float = PASSIVE_ENERGY_SILENCE_SECONDS) -> float:
+    """
+    (R1) 被动精力恢复：沉默超过 silence_sec 后，精力按 rate_per_sec 线性恢复，最多到 cap
+    - 从未回复过的群聊 (last_reply_time == 0) 不恢复
+    - 已高于 cap 的精力保持不变
+    - 只计算 [max(上次结算, 沉默开始), now] 区间内的恢复量
+    """
+    if last_reply_time == 0 or energy >= cap:
+        return energy
+    start = max(last_update_time, last_reply_time + silence_sec)
+    if now <= start:
+        return energy
+    return min(cap, energy + (now - start) * rate_per_sec)
+
+
+def decay_social_score(score: float, last_seen: float, last_check: float, now: float,
+                       grace_sec: float, step: float) -> Tuple[float, float]:
+    """
+    (F1+M2, BUG 10) 社交分每日衰减：每天检查一次，若此时距最后发言已超过宽限期，则向 0 衰减 step
+    返回 (社交分, 新的检查时间)
+    - 从未检查过 (last_check <= 0)：视为此刻进行第一次检查
+    - 否则补齐 last_check 之后错过的每一次每日检查，检查时间按整天推进
+    """
+    if last_check <= 0:
+        return (_toward_zero(score, step) if now - last_seen > grace_sec else score), now
+
+    days = int((now - last_check) // DAY_SECONDS)
+    if days <= 0:
+        return score, last_check
+    new_check = last_check + days * DAY_SECONDS
+
+    # 第 i 次检查 (时间 last_check + i 天) 满足宽限期条件 <=> i > (last_seen + grace - last_check) / 1 天
+    first_decay_day = max(1, int((last_seen + grace_sec - last_check) // DAY_SECONDS) + 1)
+    decay_days = days - first_decay_day + 1
+    if decay_days <= 0:
+        return score, new_check
+    return _toward_zero(score, decay_days * step), new_check
@@ -1,7 +1,12 @@
 # heartflow/core/decision_engine.py
 # (v4.1.3 修复 - 移除不兼容的导入)
 # (BUG 8/13 统一重构 - 导入 api_utils)
-import json
+# (v11.4 性能 - 多模态判断：一次调用同时完成图片识别与评分)
+# (v11.13 性能 - 过载冷却到期由后台调度器清理)
+# (v11.21 性能 - 判断前规则短路：命中规则时跳过判断模型)
+# (v11.22 性能 - 两级判断：小模型先判，阈值附近的结果才交给强模型复判)
+# (v11.23 性能 - timing / continuity 改为本地计算，判断模型只评其余维度)
+# (v11.24 性能 - 紧凑判断输出 "7,5,6,p" 与严格解析)
 import time
 from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent
@@ -13,8 +18,12 @@ from ..datamodels import JudgeResult, ChatState, UserProfile
 from ..config import HeartflowConfig
 from ..utils.prompt_builder import PromptBuilder
 from ..core.state_manager import StateManager
+from ..utils.scheduler import HousekeepingScheduler
+from .short_circuit import ShortCircuitRules
+from .judge_features import LocalJudgeFeatures
 # --- (BUG 8/13 重构) ---
 from ..utils.api_utils import elastic_simple_text_chat
+from ..utils.judge_format import parse_json_judge, parse_compact_judge, score_fields
 
 class DecisionEngine:
     """
@@ -38,6 +47,49 @@ class DecisionEngine:
         self.judge_provider_index: int = 0
         self.overload_cooldown_until: dict[str, float] = {}
         self.needs_overload_summary: set = set()
+        self.scheduler: HousekeepingScheduler = None # (v11.13) 由 main.py 注入
+        self.short_circuit = ShortCircuitRules(config) # (v11.21)
+        self.local_features = LocalJudgeFeatures(config) # (v11.23)
+
+        # (v11.22) 两级判断统计
+        self.escalation_provider_index: int = 0
+        self.cascade_judged = 0
+        self.cascade_escalated = 0
+        self.cascade_flipped = 0
+        self.tier1_latency_total = 0.0
+        self.tier2_latency_total = 0.0
+        self.tier2_calls = 0
+
+    def set_scheduler(self, scheduler: HousekeepingScheduler):
+        """(v11.13) 注入后台调度器"""
+        self.scheduler = scheduler
+
+    def match_short_circuit(self, event: AstrMessageEvent) -> str | None:
+        """(v11.21) 返回命中的短路规则名 (MessageHandler 据此让消息绕过 summary 模式)"""
+        return self.short_circuit.match(event)
+
+    def get_dynamic_threshold(self, chat_state: ChatState) -> float:
+        """(v3.4) 动态阈值：心情越好阈值越低 (v11.22 抽取，供 MessageHandler 与两级判断共用)"""
+        mood_factor = 1.0 - (chat_state.mood * 0.5)
+        return max(0.2, min(0.9, self.config.reply_threshold * mood_factor))
+
+    def get_stats_str(self) -> str:
+        """(v11.21) 供 /heartcore 状态报告使用"""
+        lines = []
+        if self.config.short_circuit_rules:
+            lines.append(self.short_circuit.get_stats_str())
+        if self.config.judge_escalation_provider_names:
+            lines.append(self._get_cascade_stats_str()) # (v11.22)
+        return "\n".join(lines)
+
+    def _get_cascade_stats_str(self) -> str:
+        rate = self.cascade_escalated / self.cascade_judged if self.cascade_judged else 0.0
+        tier1_avg = self.tier1_latency_total / self.cascade_judged if self.cascade_judged else 0.0
+        tier2_avg = self.tier2_latency_total / self.tier2_calls if self.tier2_calls else 0.0
+        return (
+            f"- 两级判断: 小模型判断 {self.cascade_judged} 次 | 升级 {self.cascade_escalated} 次 ({rate:.1%}) | "
+            f"强模型翻转 {self.cascade_flipped} 次 | 平均耗时 {tier1_avg:.2f}s / {tier2_avg:.2f}s"
+        )
 
     async def judge_message(self, event: AstrMessageEvent, chat_state: ChatState) -> JudgeResult:
         """
@@ -51,17 +103,33 @@ class DecisionEngine:
                 user_profile = self.state_manager._get_user_profile(event.get_sender_id()) #
             # --- (Bug 修复结束) ---
 
+            # (v11.4) 多模态判断：MessageHandler 未单独调用 VL 时，图片随判断请求发送
+            image_urls = event.get_extra("heartflow_judge_image_urls") or []
+
+            # (v11.21) 规则短路：命中且通过冷却 / 精力检查时直接返回合成结果
+            # (图片需由判断模型顺带识别时不短路，否则用户消息会缺少图片描述)
+            if not image_urls:
+                short_circuit_result = self.short_circuit.evaluate(event, chat_state)
+                if short_circuit_result:
+                    return short_circuit_result
+
             # 1. 构建 Prompt (委托 v4.0 PromptBuilder)
             complete_prompt = await self.prompt_builder.build_judge_prompt(
                 event, 
                 chat_state, 
-                user_profile 
+                user_profile,
+                request_image_description=bool(image_urls) # (v11.4)
             ) #
             
             # ！！！ v8 修复：获取奖励分 ！！！
             bonus_score = event.get_extra("heartflow_bonus_score", 0.0)
             if bonus_score > 0:
                 logger.debug(f"心流：检测到 {bonus_score} 奖励分。")
+
+            # (v11.23) 本地计算 timing / continuity
+            local_scores = None
+            if self.config.judge_local_features:
+                local_scores = self.local_features.extract(event, chat_state, await self._get_history_before(event))
             
             # 2. 获取模型列表
             specific_list = self.config.judge_provider_names #
@@ -79,19 +147,23 @@ class DecisionEngine:
                  logger.debug(f"心流：“判断模型”未配置，自动使用 {len(general_list)} 个“全局池”模型...") #
 
             # 3. 调用 (v8 修复：传入 bonus_score)
+            tier1_started = time.monotonic() # (v11.22)
             result, success_index = await self._attempt_model_list( #
                 list_to_try_first, 
                 complete_prompt, 
                 [], 
                 chat_state,
                 self.judge_provider_index,
-                bonus_score # ！！！ v8 修复 ！！！
+                bonus_score, # ！！！ v8 修复 ！！！
+                image_urls, # (v11.4)
+                local_scores # (v11.23)
             )
             
             if result:
                 if list_to_try_first is specific_list: #
                     self.judge_provider_index = (success_index + 1) % len(specific_list) #
-                return result
+                return await self._maybe_escalate(result, complete_prompt, chat_state, bonus_score, image_urls,
+                                                  local_scores, time.monotonic() - tier1_started) # (v11.22)
 
             # 4. 备用 (v8 修复：传入 bonus_score)
             if specific_list and general_list: #
@@ -103,11 +175,14 @@ class DecisionEngine:
                     [], 
                     chat_state,
                     0, # 备用列表从 0 开始
-                    bonus_score # ！！！ v8 修复 ！！！
+                    bonus_score, # ！！！ v8 修复 ！！！
+                    image_urls, # (v11.4)
+                    local_scores # (v11.23)
                 )
                 
                 if result:
-                    return result # 备用成功
+                    return await self._maybe_escalate(result, complete_prompt, chat_state, bonus_score, image_urls,
+                                                      local_scores, time.monotonic() - tier1_started) # 备用成功 (v11.22)
             
             # 5. 过载 (v2.1 逻辑)
             logger.error(f"所有模型（包括专属和全局池）均尝试失败，触发过载静默: {event.unified_msg_origin}") #
@@ -115,6 +190,12 @@ class DecisionEngine:
             chat_id = event.unified_msg_origin
             self.overload_cooldown_until[chat_id] = time.time() + self.config.overload_cooldown_seconds #
             self.needs_overload_summary.add(chat_id) #
+            if self.scheduler:
+                # (v11.13) 冷却到期时移除条目 (needs_overload_summary 保留，由下一条消息触发恢复判断)
+                self.scheduler.schedule_once(
+                    f"overload_expire:{chat_id}", self.config.overload_cooldown_seconds,
+                    lambda: self._expire_overload(chat_id)
+                )
             
             return JudgeResult(should_reply=False, reasoning=f"所有模型均失败，进入过载冷却")
             
@@ -124,6 +205,71 @@ class DecisionEngine:
             logger.error(traceback.format_exc())
             return JudgeResult(should_reply=False, reasoning=f"判断引擎异常: {e}")
 
+    async def _maybe_escalate(self, result: JudgeResult, prompt: str, chat_state: ChatState,
+                              bonus_score: float, image_urls: list, local_scores: tuple,
+                              tier1_latency: float) -> JudgeResult:
+        """
+        (v11.22) 两级判断：小模型评分落在动态阈值 ± judge_escalation_margin 内时，交给强模型复判
+        - 精力已足以触发回复时不升级 (结果不影响决定)
+        - 强模型全部失败时沿用小模型结果
+        """
+        escalation_list = self.config.judge_escalation_provider_names
+        if not escalation_list:
+            return result
+
+        self.cascade_judged += 1
+        self.tier1_latency_total += tier1_latency
+
+        threshold = self.get_dynamic_threshold(chat_state)
+        if abs(result.overall_score - threshold) > self.config.judge_escalation_margin:
+            return result
+        if chat_state.energy >= self.config.energy_threshold:
+            return result
+
+        self.cascade_escalated += 1
+        logger.debug(f"心流判断：小模型评分 {result.overall_score:.2f} 接近阈值 {threshold:.2f}，升级到强模型复判...")
+        tier2_started = time.monotonic()
+        strong_result, success_index = await self._attempt_model_list(
+            escalation_list,
+            prompt,
+            [],
+            chat_state,
+            self.escalation_provider_index,
+            bonus_score,
+            image_urls,
+            local_scores
+        )
+        self.tier2_latency_total += time.monotonic() - tier2_started
+        self.tier2_calls += 1
+        if not strong_result:
+            logger.warning("心流判断：强模型复判失败，沿用小模型结果。")
+            return result
+        self.escalation_provider_index = (success_index + 1) % len(escalation_list)
+
+        if image_urls and not strong_result.image_description:
+            strong_result.image_description = result.image_description
+        if (strong_result.overall_score >= threshold) != (result.overall_score >= threshold):
+            self.cascade_flipped += 1
+            logger.info(f"心流判断：强模型翻转了决定 ({result.overall_score:.2f} -> {strong_result.overall_score:.2f}，阈值 {threshold:.2f})。")
+        return strong_result
+
+    async def _get_history_before(self, event: AstrMessageEvent) -> list:
+        """(v11.23) 保存当前消息之前的对话历史 (优先使用 v11.3 富化阶段预取的快照)"""
+        enrichment = event.get_extra("heartflow_enrichment")
+        if enrichment and enrichment.history is not None:
+            return enrichment.history
+        # 未预取时当前消息通常已保存，去掉末尾的用户消息
+        history = await self.prompt_builder.get_history_snapshot(event.unified_msg_origin)
+        if history and history[-1].get("role") == "user":
+            history = history[:-1]
+        return history
+
+    def _expire_overload(self, chat_id: str):
+        """(v11.13) 过载冷却到期 (调度器回调)"""
+        if self.overload_cooldown_until.get(chat_id, 0) <= time.time():
+            self.overload_cooldown_until.pop(chat_id, None)
+            logger.debug(f"[{chat_id[:10]}] (v11.13) 过载冷却已到期。")
+
     async def judge_summary(self, event: AstrMessageEvent, count: int) -> JudgeResult:
         """
         (BUG 8/13 重构) v3.0 总结判断
@@ -221,11 +367,19 @@ class DecisionEngine:
         contexts: list,
         chat_state: "ChatState",
         start_index: int = 0,
-        bonus_score: float = 0.0 # ！！！ v8 修复：添加 bonus_score 参数 ！！！
+        bonus_score: float = 0.0, # ！！！ v8 修复：添加 bonus_score 参数 ！！！
+        image_urls: list = None, # (v11.4) 多模态判断
+        local_scores: tuple = None # (v11.23) 本地计算的 (timing, continuity)
     ) -> (JudgeResult, int):
         """
         (v8 修复) 负责API轮询、故障切换、JSON解析、评分计算 (应用 bonus_score)
+        (v11.4) 传入 image_urls 时，图片随请求发送，并解析返回的 image_description
+        (v11.23) 传入 local_scores 时，timing / continuity 使用本地值而非模型输出
         """
+        chat_kwargs = {"image_urls": image_urls} if image_urls else {}
+        # (v11.24) 紧凑输出 (需要图片描述时仍使用 JSON)
+        compact = self.config.judge_compact_output and not image_urls
+        compact_fields = score_fields(self.config.judge_local_features)
         if not provider_names:
             return None, 0
             
@@ -256,20 +410,25 @@ class DecisionEngine:
                 try:
                     llm_response = await judge_provider.text_chat(
                         prompt=prompt,
-                        contexts=contexts
+                        contexts=contexts,
+                        **chat_kwargs # (v11.4)
                     ) #
                     content = llm_response.completion_text.strip()
                     
-                    if content.startswith("```json"): content = content[7:-3].strip()
-                    elif content.startswith("```"): content = content[3:-3].strip()
-                    
-                    judge_data = json.loads(content) #
+                    # (v11.24) 解析移至 judge_format (JSON 仍允许 ``` 包裹；紧凑格式严格校验)
+                    if compact:
+                        judge_data = parse_compact_judge(content, compact_fields)
+                    else:
+                        judge_data = parse_json_judge(content) #
 
                     relevance = judge_data.get("relevance", 0)
                     willingness = judge_data.get("willingness", 0)
                     social = judge_data.get("social", 0)
-                    timing = judge_data.get("timing", 0)
-                    continuity = judge_data.get("continuity", 0)
+                    if local_scores:
+                        timing, continuity = local_scores # (v11.23)
+                    else:
+                        timing = judge_data.get("timing", 0)
+                        continuity = judge_data.get("continuity", 0)
                     inferred_mood = judge_data.get("inferred_mood", "neutral")
                     
                     # ！！！ v8 修复：应用奖励分 ！！！
@@ -297,18 +456,20 @@ class DecisionEngine:
                        relevance=relevance, willingness=willingness,
                        social=social, timing=timing, continuity=continuity,
                        inferred_mood=inferred_mood, 
+                       image_description=str(judge_data.get("image_description") or "").strip() if image_urls else "", # (v11.4)
                        reasoning=judge_data.get("reasoning", "") if self.config.judge_include_reasoning else "", #
                        should_reply=should_reply_static, 
                        confidence=overall_score, # (v8) confidence 
                        overall_score=overall_score # (v8) 
                     ), success_index
                 
-                except json.JSONDecodeError as e:
-                    # (v4.1) JSON 格式错误，重试
-                    logger.warning(f"模型 {provider_name} JSON解析失败 (尝试 {attempt + 1}/{max_retries + 1}): {e}") #
-                    last_error = f"JSON解析失败: {e}"
+                except ValueError as e:
+                    # (v4.1) JSON 格式错误，重试 (v11.24: json.JSONDecodeError 与紧凑格式错误均为 ValueError)
+                    output_format = "紧凑" if compact else "JSON"
+                    logger.warning(f"模型 {provider_name} {output_format}解析失败 (尝试 {attempt + 1}/{max_retries + 1}): {e}") #
+                    last_error = f"{output_format}解析失败: {e}"
                     if attempt == max_retries:
-                        logger.error(f"模型 {provider_name} 重试多次JSON解析失败，放弃此模型") #
+                        logger.error(f"模型 {provider_name} 重试多次{output_format}解析失败，放弃此模型") #
                         break 
                 
                 # ！！！v4.1.3 修复：回退到通用的 Exception！！！
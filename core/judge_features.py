@@ -0,0 +1,93 @@
+# heartflow/core/judge_features.py
+# (新) v11.23 本地评分特征
+# 职责：在本地计算判断维度中的 timing (时机) 与 continuity (连贯性)，
+#       判断模型只需评估 relevance / willingness / social 与心情，Prompt 和输出都更短
+import time
+from typing import Dict, Tuple
+from astrbot.api.event import AstrMessageEvent
+
+# (使用相对路径导入 v4.0 模块)
+from ..datamodels import ChatState
+from ..config import HeartflowConfig
+from .short_circuit import is_reply_to_bot
+
+# 群聊消息间隔的指数滑动平均系数
+GAP_EWMA_ALPHA = 0.2
+# 尚无间隔记录时假定的平均间隔 (秒)
+DEFAULT_GAP_SECONDS = 60.0
+# 机器人上次发言后多久，再次发言的时机视为完全恰当 (秒)
+REPLY_SPACING_SECONDS = 120.0
+# 机器人回复后多少条消息 / 多少秒内的消息视为“接着机器人的话”
+FOLLOW_MESSAGE_WINDOW = 5
+FOLLOW_TIME_WINDOW_SECONDS = 600.0
+
+
+class LocalJudgeFeatures:
+    """
+    (v11.23) 本地特征提取器 (分数均为 0-10，与判断模型的打分口径一致)
+    - timing:     距机器人上次发言越久越恰当；本条消息打破了一段沉默 (间隔高于平均) 时加分
+    - continuity: 引用机器人的消息直接满分；否则看本条消息距机器人上次回复有多近，
+                  以及与上次回复的字词重合程度
+    """
+
+    def __init__(self, config: HeartflowConfig):
+        self.config = config
+        self._last_message_time: Dict[str, float] = {} # chat_id -> 上一条消息时间
+        self._gap_ewma: Dict[str, float] = {}          # chat_id -> 平均消息间隔
+        self._current_gap: Dict[str, float] = {}       # chat_id -> 最新一条消息与上一条的间隔
+
+    def note_message(self, chat_id: str, now: float = None):
+        """MessageHandler 收到群聊消息时调用，记录消息间隔"""
+        now = now or time.time()
+        last = self._last_message_time.get(chat_id)
+        self._last_message_time[chat_id] = now
+        if last is None:
+            return
+        gap = now - last
+        self._current_gap[chat_id] = gap
+        average = self._gap_ewma.get(chat_id)
+        self._gap_ewma[chat_id] = gap if average is None else average + GAP_EWMA_ALPHA * (gap - average)
+
+    def extract(self, event: AstrMessageEvent, chat_state: ChatState, history: list) -> Tuple[float, float]:
+        """
+        返回 (timing, continuity)
+        history 为保存当前消息 *之前* 的对话历史
+        """
+        now = time.time()
+        since_reply = now - chat_state.last_reply_time if chat_state.last_reply_time else float("inf")
+        return self._timing(event.unified_msg_origin, since_reply), self._continuity(event, history, since_reply)
+
+    def _timing(self, chat_id: str, since_reply: float) -> float:
+        spacing = min(1.0, since_reply / REPLY_SPACING_SECONDS)
+        gap = self._current_gap.get(chat_id)
+        average = self._gap_ewma.get(chat_id, DEFAULT_GAP_SECONDS)
+        # 间隔等于平均值时为 0.5，打破沉默时趋近 1，刷屏时趋近 0
+        pace = 0.5 if gap is None else gap / (gap + max(average, 1.0))
+        return round(10.0 * (0.7 * spacing + 0.3 * pace), 1)
+
+    def _continuity(self, event: AstrMessageEvent, history: list, since_reply: float) -> float:
+        if is_reply_to_bot(event):
+            return 10.0
+
+        last_reply, messages_since = None, 0
+        for msg in reversed(history or []):
+            if msg.get("role") == "assistant" and str(msg.get("content", "")).strip():
+                last_reply = msg["content"]
+                break
+            messages_since += 1
+        if last_reply is None:
+            return 0.0
+
+        follow = max(0.0, 1.0 - messages_since / FOLLOW_MESSAGE_WINDOW)
+        follow *= max(0.0, 1.0 - since_reply / FOLLOW_TIME_WINDOW_SECONDS)
+        overlap = self._overlap(event.message_str or "", last_reply)
+        return round(min(10.0, 7.0 * follow + 3.0 * overlap), 1)
+
+    @staticmethod
+    def _overlap(message: str, reply: str) -> float:
+        """字符二元组的重合比例 (相对于本条消息，中英文通用)"""
+        message_grams = {message[i:i + 2] for i in range(len(message) - 1) if message[i:i + 2].strip()}
+        if not message_grams:
+            return 0.0
+        reply_grams = {reply[i:i + 2] for i in range(len(reply) - 1)}
+        return len(message_grams & reply_grams) / len(message_grams)
@@ -1,18 +1,34 @@
 # heartflow/core/message_handler.py
 # (v8.2 修复 - 修复 v8 引入的 "summary" 模式 Bug)
+# (v11.1 性能 - VL 描述缓存)
+# (v11.2 性能 - 感知哈希去重)
+# (v11.3 性能 - 并发富化阶段)
+# (v11.4 性能 - 多模态判断：判断模型兼任 VL)
+# (v11.8 性能 - 跨 await 修改 ChatState 后显式标记，保证快照/持久化可见)
+# (v11.21 性能 - 命中规则短路的消息绕过 summary 模式，且不预取判断专用的富化数据)
+# (v11.22 重构 - 动态阈值改由 DecisionEngine 计算，与两级判断共用)
+# (v11.23 性能 - 记录消息间隔，供本地 timing 评分)
+# (v11.18 修复 - 每条消息向话题池登记一次群聊活动)
 import time
+import asyncio
+from typing import TYPE_CHECKING
 from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent
 import astrbot.api.message_components as Comp
 
 # (使用相对路径导入 v4.0 模块)
-from ..datamodels import JudgeResult, ChatState, UserProfile
+from ..datamodels import JudgeResult, ChatState, UserProfile, EnrichedContext
 from ..config import HeartflowConfig
 from ..persistence import PersistenceManager
 from .state_manager import StateManager
 from .decision_engine import DecisionEngine
 from .reply_engine import ReplyEngine
 from ..utils.prompt_builder import PromptBuilder
+from ..utils.image_cache import ImageDescriptionCache
+from ..utils.image_utils import fetch_image_bytes, content_hash, compute_dhash, is_phash_available
+
+if TYPE_CHECKING:
+    from ..features.topic_pool import ProactiveTopicPool
 
 class MessageHandler:
     """
@@ -26,13 +42,20 @@ class MessageHandler:
                  state_manager: StateManager, 
                  decision_engine: DecisionEngine, 
                  reply_engine: ReplyEngine,
-                 prompt_builder: PromptBuilder # (v4.0) VL 调度需要 PromptBuilder
+                 prompt_builder: PromptBuilder, # (v4.0) VL 调度需要 PromptBuilder
+                 image_cache: ImageDescriptionCache = None # (v11.1) VL 描述缓存 (未启用时为 None)
                  ):
         self.config = config
         self.state_manager = state_manager
         self.decision_engine = decision_engine
         self.reply_engine = reply_engine
         self.prompt_builder = prompt_builder # (v4.0)
+        self.image_cache = image_cache # (v11.1)
+        self.topic_pool: "ProactiveTopicPool" = None # (v11.18) 由 main.py 注入
+
+    def set_topic_pool(self, topic_pool: "ProactiveTopicPool"):
+        """(v11.18) 注入主动话题池 (按收到的消息数估算群聊活动频率)"""
+        self.topic_pool = topic_pool
 
 # 位于 message_handler.py
 
@@ -46,6 +69,9 @@ class MessageHandler:
             chat_id = event.unified_msg_origin
             chat_state = self.state_manager._get_chat_state(chat_id) #
             judge_result = None
+            self.decision_engine.local_features.note_message(chat_id) # (v11.23) 记录消息间隔
+            if self.topic_pool:
+                self.topic_pool.note_activity(chat_id) # (v11.18) 每条消息计一次群聊活动
             
             # (v8 修复) 检查是否为 Poke 或 昵称
             is_poke_event = event.get_extra("heartflow_is_poke_event")
@@ -55,55 +81,60 @@ class MessageHandler:
             # --- (v3.5) 核心逻辑：VL 调度与保存 ---
             # -----------------------------------------------
             
+            # --- (BUG 15 修复：上移 image_urls 定义) ---
+            image_components = []
+            vl_images = [] # (v11.3) 需要 VL 识别的图片 (交给富化阶段)
             if not is_poke_event: # (v8 修复：Poke 事件跳过 VL)
                 event.set_extra("image_description", None) #
                 
-                # --- (BUG 15 修复：上移 image_urls 定义) ---
-                image_urls = []
                 if event.message_obj and event.message_obj.message: #
                      for component in event.message_obj.message:
                         if isinstance(component, Comp.Image) and component.url: #
-                            image_urls.append(component.url) #
-                # --- (修复结束) ---
+                            image_components.append(component) #
 
-                if chat_state.judgment_mode == "single" and self.config.enable_image_recognition and image_urls: #
+                if chat_state.judgment_mode == "single" and self.config.enable_image_recognition and image_components: #
                     
-                    vl_provider_name = self.config.image_recognition_provider_name #
-                    if vl_provider_name:
-                        try:
-                            vl_provider = self.reply_engine.context.get_provider_by_id(vl_provider_name) #
-                            if vl_provider:
-                                logger.debug(f"[{chat_id[:10]}] (v3.5) 调用VL模型分析 {len(image_urls)} 张图片...") #
-                                vl_response = await vl_provider.text_chat(
-                                    prompt=self.config.image_recognition_prompt, #
-                                    image_urls=image_urls #
-                                )
-                                image_description_text = vl_response.completion_text.strip()
-                                logger.info(f"💖 图片识别(VL)成功 (模型: {vl_provider_name})：{image_description_text}") #
-                                event.set_extra("image_description", image_description_text) #
-                            
-                        except Exception as e:
-                            logger.error(f"图片识别(VL)在 MessageHandler 失败: {e}") #
+                    if self.config.image_recognition_provider_name: #
+                        vl_images = image_components
                     else:
                         logger.warning(f"图片识别(VL)功能已启用，但 'image_recognition_provider_name' 未配置。") #
+            image_urls = [component.url for component in image_components]
+            # --- (修复结束) ---
 
-            # --- (v3.5) 立即保存用户消息 (Bug 2 修复) ---
-            rich_content = await self.prompt_builder._build_rich_content_string(event) #
-            
-            if rich_content: 
-                sender_name = event.get_extra("heartflow_poke_sender_name") or event.get_sender_name()
-                await self.reply_engine.persistence.save_history_message(
-                    chat_id, "user", rich_content, 
-                    self.reply_engine.bot_name, sender_name
-                ) #
-                logger.debug(f"[{chat_id[:10]}] (v8) 已将 (含VL/Poke) 的用户消息保存到上下文") #
+            # (v11.21) 规则短路：命中规则的消息与奖励消息一样绕过 summary 模式，
+            # 且 (通常) 不调用判断模型，因此在决定富化内容之前匹配
+            short_circuit_rule = self.decision_engine.match_short_circuit(event)
+
+            # (v11.3) 预先判断本条消息是否会进入逐条判断 (决定是否需要预取人格/历史)
+            # (v11.21) 命中规则短路时不预取；若短路因冷却 / 精力未生效，判断 Prompt 回退到串行获取
+            is_pure_image = bool(not is_poke_event and
+                                 self.config.enable_image_recognition and
+                                 image_urls and
+                                 (not event.message_str or not event.message_str.strip()))
+            will_judge = (not is_pure_image and not short_circuit_rule and
+                          (chat_state.judgment_mode == "single" or is_poke_event or bonus_score > 0.0))
+
+            # (v11.4) 多模态判断：图片随判断请求发送，VL 仅查缓存不单独调用
+            judge_sees_images = bool(self.config.judge_multimodal and will_judge and vl_images)
+
+            # --- (v11.3) 富化阶段：并发执行 VL / 引用与@查询 / 人格 / 历史快照 ---
+            enrichment = await self._run_enrichment_stage(event, chat_id, vl_images, will_judge,
+                                                          allow_vl_call=not judge_sees_images)
+            if enrichment.image_description:
+                event.set_extra("image_description", enrichment.image_description) #
+            event.set_extra("heartflow_enrichment", enrichment)
+
+            # (v11.4) 缓存未命中：描述由判断模型顺带返回，用户消息推迟到判断后保存
+            defer_history_save = judge_sees_images and not enrichment.image_description
+            if defer_history_save:
+                event.set_extra("heartflow_judge_image_urls", [component.url for component in vl_images])
+            else:
+                # --- (v3.5) 立即保存用户消息 (Bug 2 修复) ---
+                await self._save_user_message(event, chat_id)
             
             # --- (v3.5) API 节省分支 ---
             # (BUG 15 修复) 此处的 'image_urls' 现在总是已定义的
-            if (not is_poke_event and #
-                self.config.enable_image_recognition and #
-                image_urls and #
-                (not event.message_str or not event.message_str.strip())):
+            if is_pure_image: # (v11.3) 条件已在富化阶段前计算
                 
                 logger.info(f"[{chat_id[:10]}] (v3.5) 纯图片消息，已保存VL转述，跳过“判断” API。") #
                 self.state_manager._update_passive_state(event, JudgeResult(reasoning="VL Save Only"), batch_size=1) #
@@ -113,9 +144,15 @@ class MessageHandler:
             # --- 状态机（v8.2 修复：确保 bonus_score/poke 绕过 summary） ---
             # -----------------------------------------------
 
+            # (v11.21) 引用消息的发送者可能要到富化阶段 (引用消息预取) 后才知道，未命中时再匹配一次
+            if not short_circuit_rule:
+                short_circuit_rule = self.decision_engine.match_short_circuit(event)
+
             # ！！！ v8.2 修复：summary 模式仅在 *没有* 奖励时运行 ！！！
-            if chat_state.judgment_mode == "summary" and not is_poke_event and bonus_score == 0.0:
+            if (chat_state.judgment_mode == "summary" and not is_poke_event and bonus_score == 0.0
+                    and not short_circuit_rule):
                 chat_state.message_counter += 1 #
+                self.state_manager.mark_state_dirty(chat_id) # (v11.8) chat_state 在 await 之前获取
                 if chat_state.message_counter >= self.config.summary_judgment_count: #
                     logger.debug(f"[{chat_id[:10]}] 达到总结计数，执行总结判断...") #
                     
@@ -127,23 +164,32 @@ class MessageHandler:
                     else:
                         self.state_manager._update_passive_state(event, judge_result, batch_size=chat_state.message_counter) #
                         chat_state.message_counter = 0 #
+                        self.state_manager.mark_state_dirty(chat_id) # (v11.8)
                         return
                 else:
                     return # (v8.2) 消息被“吃掉”并等待总结
 
             # ！！！ v8.2 修复：single 模式在 *或* 有奖励时运行 ！！！
-            elif chat_state.judgment_mode == "single" or is_poke_event or bonus_score > 0.0:
+            elif chat_state.judgment_mode == "single" or is_poke_event or bonus_score > 0.0 or short_circuit_rule:
                 
-                if is_poke_event or bonus_score > 0.0:
-                    logger.debug(f"[{chat_id[:10]}] (v8.2) 奖励消息/Poke，强制进入 'single' 模式判断...")
+                if is_poke_event or bonus_score > 0.0 or short_circuit_rule:
+                    logger.debug(f"[{chat_id[:10]}] (v8.2) 奖励消息/Poke/规则短路，强制进入 'single' 模式判断...")
                 else:
                     logger.debug(f"[{chat_id[:10]}] 'single' 模式，执行逐条判断...") #
                 
                 judge_result = await self.decision_engine.judge_message(event, chat_state) #
 
+                # (v11.4) 回填判断模型返回的图片描述，再保存用户消息
+                if defer_history_save:
+                    if judge_result.image_description:
+                        logger.info(f"💖 图片识别(多模态判断)成功：{judge_result.image_description}")
+                        event.set_extra("image_description", judge_result.image_description)
+                        self._cache_description(vl_images, judge_result.image_description)
+                    await self._save_user_message(event, chat_id)
+                    defer_history_save = False
+
                 # (v3.4) 动态阈值 (v8 修复：bonus_score 已在 decision_engine 中应用)
-                mood_factor = 1.0 - (chat_state.mood * 0.5) #
-                dynamic_threshold = max(0.2, min(0.9, self.config.reply_threshold * mood_factor)) #
+                dynamic_threshold = self.decision_engine.get_dynamic_threshold(chat_state) # (v11.22 抽取到 DecisionEngine)
                 
                 score_triggers = judge_result.overall_score >= dynamic_threshold #
                 energy_triggers = chat_state.energy >= self.config.energy_threshold #
@@ -169,7 +215,12 @@ class MessageHandler:
                         logger.info(f"[{chat_id[:10]}] 'single' 窗口结束，切回 'summary' 模式。") #
                         chat_state.judgment_mode = "summary" #
                         chat_state.message_counter = 0 #
+                    self.state_manager.mark_state_dirty(chat_id) # (v11.8)
             
+            # (v11.4) 兜底：推迟保存的消息未进入判断分支时也要落盘
+            if defer_history_save:
+                await self._save_user_message(event, chat_id)
+
             # --- 6. 统一回复/不回复执行点 (v8 逻辑不变) ---
             if judge_result and judge_result.should_reply:
                 # (v8 修复：Poke/Nickname 必定会耗费精力，但 reasoning 不同)
@@ -186,6 +237,154 @@ class MessageHandler:
             import traceback
             logger.error(traceback.format_exc()) #
 
+    async def _save_user_message(self, event: AstrMessageEvent, chat_id: str):
+        """(v3.5) 将 (含VL/Poke) 的用户消息保存到上下文 (v11.4 抽取为方法，多模态判断时推迟调用)"""
+        rich_content = await self.prompt_builder._build_rich_content_string(event) #
+        
+        if rich_content: 
+            sender_name = event.get_extra("heartflow_poke_sender_name") or event.get_sender_name()
+            await self.reply_engine.persistence.save_history_message(
+                chat_id, "user", rich_content, 
+                self.reply_engine.bot_name, sender_name
+            ) #
+            logger.debug(f"[{chat_id[:10]}] (v8) 已将 (含VL/Poke) 的用户消息保存到上下文") #
+
+    async def _run_enrichment_stage(self, event: AstrMessageEvent, chat_id: str, vl_images: list, will_judge: bool,
+                                    allow_vl_call: bool = True) -> EnrichedContext:
+        """
+        (v11.3) 消息富化阶段
+        并发执行互不依赖的部分，每部分独立超时，
+        端到端耗时约等于最慢的单个依赖，而非各部分之和。
+        - vl: 图片识别 (仅 single 模式且有图片时)
+        - lookups: 引用消息 / @ 昵称查询 (OneBot API)
+        - persona / history: 判断 Prompt 所需的人格摘要与历史快照 (仅会进入判断时)
+        (v11.4) allow_vl_call=False 时 vl 部分只查缓存 (多模态判断模式)
+        """
+        enrichment = EnrichedContext()
+        timeout = self.config.enrichment_timeout_seconds
+
+        parts = {}
+        if vl_images:
+            parts["vl"] = (self._describe_images(chat_id, vl_images, allow_vl_call), self.config.enrichment_vl_timeout_seconds)
+        parts["lookups"] = (self.prompt_builder.prefetch_rich_lookups(event), timeout)
+        if will_judge:
+            parts["persona"] = (self.prompt_builder._get_persona_key_and_summary(chat_id), timeout)
+            parts["history"] = (self.prompt_builder.get_history_snapshot(chat_id), timeout)
+
+        results = await asyncio.gather(*(
+            self._run_enrichment_part(enrichment, name, coro, part_timeout)
+            for name, (coro, part_timeout) in parts.items()
+        ))
+        results = dict(zip(parts.keys(), results))
+
+        enrichment.image_description = results.get("vl")
+        if results.get("persona"):
+            enrichment.persona_key, enrichment.persona_prompt = results["persona"]
+        enrichment.history = results.get("history") # None = 未预取/超时，PromptBuilder 将回退到串行获取
+
+        # 画像为内存读取，无需并发
+        if will_judge and self.config.enable_user_profiles:
+            enrichment.user_profile = self.state_manager._get_user_profile(event.get_sender_id())
+
+        timings = " | ".join(f"{name}: {ms:.0f}ms" for name, ms in enrichment.timings.items())
+        logger.debug(f"[{chat_id[:10]}] (v11.3) 富化阶段完成。{timings}")
+        return enrichment
+
+    async def _run_enrichment_part(self, enrichment: EnrichedContext, name: str, coro, timeout: float):
+        """(v11.3) 执行富化阶段的单个部分：独立超时、记录耗时，失败时返回 None"""
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(coro, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"(v11.3) 富化阶段 '{name}' 超时 ({timeout}s)，已跳过。")
+        except Exception as e:
+            logger.warning(f"(v11.3) 富化阶段 '{name}' 失败: {e}")
+        finally:
+            enrichment.timings[name] = (time.perf_counter() - start) * 1000
+        return None
+
+    async def _describe_images(self, chat_id: str, image_components: list, allow_vl_call: bool = True) -> str | None:
+        """
+        (v11.1) 获取图片描述：先查 VL 缓存 (Ref -> 内容哈希)，未命中才调用 VL 模型
+        (v11.2) 单图消息额外查询感知哈希索引，复用相似图片 (重新编码的表情包) 的描述
+        (v11.4) allow_vl_call=False 时仅查缓存，未命中返回 None (由判断模型识别)
+        """
+        ref_key = None
+        content_key = None
+        phash = None
+
+        if self.image_cache:
+            # 1. (v11.1) 按图片 Ref 查询缓存
+            ref_key = "|".join(self.prompt_builder._get_image_ref(c, length=32) for c in image_components)
+            cached = self.image_cache.get(ref_key)
+
+            use_phash = (self.config.vl_cache_phash_enabled and
+                         len(image_components) == 1 and
+                         is_phash_available())
+
+            # 2. 未命中时下载图片 (内容哈希与感知哈希共用同一份字节)
+            if cached is None and (self.config.vl_cache_hash_content or use_phash):
+                images_data = []
+                for component in image_components:
+                    data = await fetch_image_bytes(component.url)
+                    if not data:
+                        break
+                    images_data.append(data)
+                else:
+                    # 2a. 按内容哈希查询
+                    if self.config.vl_cache_hash_content:
+                        content_key = "|".join("sha1_" + content_hash(data) for data in images_data)
+                        cached = self.image_cache.get(content_key)
+
+                    # 2b. (v11.2) 按感知哈希查询 (在工作线程中计算)
+                    if cached is None and use_phash:
+                        phash = await asyncio.to_thread(compute_dhash, images_data[0])
+                        if phash is not None:
+                            cached = self.image_cache.find_similar(phash, self.config.vl_cache_phash_max_distance)
+
+                if cached is not None:
+                    self.image_cache.put(cached, ref_key, content_key) # 为新 Ref 建立别名
+
+            self.image_cache.record(cached is not None)
+            if cached is not None:
+                logger.info(f"💖 图片识别(VL)缓存命中，跳过 VL 调用：{cached}")
+                return cached
+
+        if not allow_vl_call:
+            return None
+
+        # 3. 调用 VL 模型
+        vl_provider_name = self.config.image_recognition_provider_name #
+        try:
+            vl_provider = self.reply_engine.context.get_provider_by_id(vl_provider_name) #
+            if not vl_provider:
+                return None
+
+            image_urls = [component.url for component in image_components]
+            logger.debug(f"[{chat_id[:10]}] (v3.5) 调用VL模型分析 {len(image_urls)} 张图片...") #
+            vl_response = await vl_provider.text_chat(
+                prompt=self.config.image_recognition_prompt, #
+                image_urls=image_urls #
+            )
+            image_description_text = vl_response.completion_text.strip()
+            logger.info(f"💖 图片识别(VL)成功 (模型: {vl_provider_name})：{image_description_text}") #
+
+            if self.image_cache and image_description_text:
+                self.image_cache.put(image_description_text, ref_key, content_key)
+                self.image_cache.put_phash(phash, image_description_text) # (v11.2)
+            return image_description_text
+
+        except Exception as e:
+            logger.error(f"图片识别(VL)在 MessageHandler 失败: {e}") #
+            return None
+
+    def _cache_description(self, image_components: list, description: str):
+        """(v11.4) 将多模态判断返回的描述按图片 Ref 写入 VL 缓存"""
+        if not self.image_cache or not description:
+            return
+        ref_key = "|".join(self.prompt_builder._get_image_ref(c, length=32) for c in image_components)
+        self.image_cache.put(description, ref_key)
+
     def get_overload_status(self, chat_id: str) -> (bool, float):
         """
         (新) 供 main.py 检查过载状态
@@ -0,0 +1,173 @@
+# heartflow/core/profile_columns.py
+# (新) v11.11 用户画像列存储 (NumPy，可选)
+# 职责：把每日社交衰减需要的字段镜像为列数组，用掩码向量运算一次处理所有用户，
+#       只把实际变化的行写回 UserProfile 对象
+# (v11.12 - 改为闭式衰减 decay_social_score 的列式版本，批量结算驻留画像，与读取时结算的结果逐行一致)
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple
+
+# NumPy 为可选依赖，未安装时 StateManager 回退到逐个画像结算
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ..datamodels import TIER_CODES
+from .decay import DAY_SECONDS
+
+if TYPE_CHECKING:
+    from ..datamodels import UserProfile
+
+INITIAL_CAPACITY = 1024
+
+
+def decay_social_score_columns(score, last_seen, last_check, now: float, grace_sec: float, step: float):
+    """
+    decay_social_score 的列式版本 (参数为等长 float64 数组)，逐行语义完全一致：
+    - 从未检查过 (last_check <= 0)：视为此刻进行第一次检查
+    - 否则补齐 last_check 之后错过的每一次每日检查，检查时间按整天推进
+    返回 (社交分数组, 新的检查时间数组)
+    """
+    first = last_check <= 0
+
+    days = np.where(first, 0, np.floor_divide(now - last_check, DAY_SECONDS)).astype(np.int64)
+    first_decay_day = np.maximum(1, np.floor_divide(last_seen + grace_sec - last_check, DAY_SECONDS).astype(np.int64) + 1)
+    decay_days = np.where(days > 0, np.maximum(days - first_decay_day + 1, 0), 0)
+    # 第一次检查时至多衰减一步
+    steps = np.where(first, (now - last_seen > grace_sec).astype(np.int64), decay_days)
+
+    amount = steps * step
+    new_score = np.where(
+        steps > 0,
+        np.where(score > amount, score - amount, np.where(score < -amount, score + amount, 0.0)),
+        score
+    )
+    new_check = np.where(first, now, np.where(days > 0, last_check + days * DAY_SECONDS, last_check))
+    return new_score, new_check
+
+
+def tier_codes_for(score, avoid_threshold: float, friend_threshold: float, acq_threshold: float):
+    """与 StateManager._recalculate_tier 相同的阈值判断 (列式)"""
+    return np.select(
+        [score <= avoid_threshold, score >= friend_threshold, score >= acq_threshold],
+        [TIER_CODES["avoiding"], TIER_CODES["friend"], TIER_CODES["acquaintance"]],
+        TIER_CODES["stranger"]
+    ).astype(np.int8)
+
+
+class ProfileColumnStore:
+    """
+    (v11.11) UserProfile 的列式镜像 (struct-of-arrays)
+    - 列: social_score / last_seen / last_decay_check_time (float64)、tier_code (int8)
+    - UserProfile 对象仍是唯一数据源：调用方通过 upsert() 同步被修改过的行，
+      结算结果由 settle() 写回对象
+    - 删除行时用最后一行填补空位，数组保持紧凑
+    """
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError("numpy 未安装")
+        self._ids: List[str] = []
+        self._profiles: List["UserProfile"] = []
+        self._rows: Dict[str, int] = {}
+        self._size = 0
+        self._allocate(INITIAL_CAPACITY)
+
+    def _allocate(self, capacity: int):
+        old_size = self._size
+        score = np.zeros(capacity, dtype=np.float64)
+        last_seen = np.zeros(capacity, dtype=np.float64)
+        last_check = np.zeros(capacity, dtype=np.float64)
+        tier = np.zeros(capacity, dtype=np.int8)
+        if old_size:
+            score[:old_size] = self.score[:old_size]
+            last_seen[:old_size] = self.last_seen[:old_size]
+            last_check[:old_size] = self.last_check[:old_size]
+            tier[:old_size] = self.tier[:old_size]
+        self.score, self.last_seen, self.last_check, self.tier = score, last_seen, last_check, tier
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._rows
+
+    # --- 行同步 ---
+
+    def upsert(self, profile: "UserProfile"):
+        """从对象同步一行 (新画像追加到末尾)"""
+        row = self._rows.get(profile.user_id)
+        if row is None:
+            if self._size == len(self.score):
+                self._allocate(len(self.score) * 2)
+            row = self._size
+            self._size += 1
+            self._rows[profile.user_id] = row
+            self._ids.append(profile.user_id)
+            self._profiles.append(profile)
+        else:
+            self._profiles[row] = profile
+        self.score[row] = profile.social_score
+        self.last_seen[row] = profile.last_seen
+        self.last_check[row] = profile.last_decay_check_time
+        self.tier[row] = profile.tier_code
+
+    def extend(self, profiles: Iterable["UserProfile"]):
+        for profile in profiles:
+            self.upsert(profile)
+
+    def remove(self, user_id: str):
+        """删除一行 (用最后一行填补)"""
+        row = self._rows.pop(user_id, None)
+        if row is None:
+            return
+        last = self._size - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._ids[row] = moved_id
+            self._profiles[row] = self._profiles[last]
+            self._rows[moved_id] = row
+            for column in (self.score, self.last_seen, self.last_check, self.tier):
+                column[row] = column[last]
+        self._ids.pop()
+        self._profiles.pop()
+        self._size = last
+
+    # --- 批量结算 ---
+
+    def settle(self, now: float, grace_sec: float, step: float,
+               avoid_threshold: float, friend_threshold: float, acq_threshold: float) -> Tuple[List["UserProfile"], int]:
+        """
+        对所有行做一次 StateManager._materialize_profile 的结算 (衰减 + 层级)
+        返回 (被写回的画像列表, 分数发生变化的数量)
+        """
+        n = self._size
+        if n == 0:
+            return [], 0
+        score = self.score[:n]
+        last_check = self.last_check[:n]
+        tier = self.tier[:n]
+
+        new_score, new_check = decay_social_score_columns(score, self.last_seen[:n], last_check, now, grace_sec, step)
+        new_tier = tier_codes_for(new_score, avoid_threshold, friend_threshold, acq_threshold)
+
+        score_changed = new_score != score
+        changed_rows = np.flatnonzero(score_changed | (new_check != last_check) | (new_tier != tier))
+        if changed_rows.size == 0:
+            return [], 0
+
+        score[:] = new_score
+        last_check[:] = new_check
+        tier[:] = new_tier
+
+        # 只写回变化的行
+        # (先整体 tolist()，比逐个元素从 ndarray 取标量快得多)
+        written = []
+        profiles = self._profiles
+        for row, value, checked, code in zip(changed_rows.tolist(), score[changed_rows].tolist(),
+                                             last_check[changed_rows].tolist(), tier[changed_rows].tolist()):
+            profile = profiles[row]
+            profile.social_score = value
+            profile.last_decay_check_time = checked
+            profile.tier_code = code
+            written.append(profile)
+        return written, int(score_changed.sum())
@@ -0,0 +1,115 @@
+# heartflow/core/profile_store.py
+# (新) v11.9 懒加载用户画像库
+# 职责：内存中只保留全部 user_id 的索引，UserProfile 在首次访问时从存储后端加载，
+#       空闲超时后移出内存 (数据仍在磁盘上)
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Iterable, List
+
+from ..datamodels import UserProfile
+
+
+class LazyProfileStore(MutableMapping):
+    """
+    (v11.9) 对 StateManager 表现为普通的 Dict[str, UserProfile]
+    - 索引：所有已知 user_id (in / len / 遍历键 均不触发磁盘读取)
+    - 驻留集：按最近访问排序的 OrderedDict，移出时从最久未访问的一端扫描
+    - loader: user_id -> UserProfile | None (同步读取单行，由 PersistenceManager 提供)
+    注意：values() / items() 会逐个加载所有画像，内部遍历请使用 resident_items()
+    """
+
+    def __init__(self, loader: Callable[[str], "UserProfile | None"], user_ids: Iterable[str], idle_seconds: float):
+        self._loader = loader
+        self._index = {sys.intern(user_id) for user_id in user_ids}
+        self._resident: "OrderedDict[str, UserProfile]" = OrderedDict()
+        self._last_access: dict = {}
+        self.idle_seconds = idle_seconds
+        self.on_load: Callable[[UserProfile], None] = None # 由 StateManager 注入
+
+        # 统计
+        self.loads = 0
+        self.evictions = 0
+
+    # --- Mapping 接口 ---
+
+    def __getitem__(self, user_id: str) -> UserProfile:
+        profile = self._resident.get(user_id)
+        if profile is None:
+            if user_id not in self._index:
+                raise KeyError(user_id)
+            profile = self._loader(user_id)
+            if profile is None:
+                # 索引与磁盘不一致 (例如行已被外部删除)
+                self._index.discard(user_id)
+                raise KeyError(user_id)
+            self.loads += 1
+            self._resident[user_id] = profile
+            if self.on_load:
+                self.on_load(profile)
+        self._touch(user_id)
+        return profile
+
+    def __setitem__(self, user_id: str, profile: UserProfile):
+        user_id = sys.intern(user_id)
+        self._index.add(user_id)
+        self._resident[user_id] = profile
+        self._touch(user_id)
+
+    def __delitem__(self, user_id: str):
+        self._index.remove(user_id)
+        self._resident.pop(user_id, None)
+        self._last_access.pop(user_id, None)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._index
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    # --- 驻留集管理 ---
+
+    def _touch(self, user_id: str):
+        self._resident.move_to_end(user_id)
+        self._last_access[user_id] = time.monotonic()
+
+    def peek(self, user_id: str) -> "UserProfile | None":
+        """(v11.11) 读取驻留内存的画像 (不触发加载，不更新访问时间)"""
+        return self._resident.get(user_id)
+
+    def resident_items(self):
+        """遍历驻留内存的画像 (不触发加载)"""
+        return list(self._resident.items())
+
+    @property
+    def resident_count(self) -> int:
+        return len(self._resident)
+
+    def evict_idle(self, protected: set = frozenset()) -> List[str]:
+        """
+        移出空闲超过 idle_seconds 的画像，返回被移出的 user_id
+        protected 中的画像 (尚未持久化) 即使空闲也保留
+        """
+        deadline = time.monotonic() - self.idle_seconds
+        evicted = []
+        for user_id in list(self._resident):
+            if self._last_access.get(user_id, 0) > deadline:
+                break # 之后的条目都更近被访问过
+            if user_id in protected:
+                continue
+            del self._resident[user_id]
+            self._last_access.pop(user_id, None)
+            evicted.append(user_id)
+        self.evictions += len(evicted)
+        return evicted
+
+    def get_stats_str(self) -> str:
+        """供 /heartcore 状态报告使用"""
+        return (
+            f"- 用户画像 (懒加载): 驻留 {self.resident_count}/{len(self._index)} | "
+            f"按需加载 {self.loads} 次 | 移出 {self.evictions} 次"
+        )
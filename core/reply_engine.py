@@ -1,5 +1,6 @@
 # heartflow/core/reply_engine.py
 # (v10.13 修复 - 确保主 LLM 严格遵守 context_messages_count)
+# (v11.5 性能 - 主 LLM 视觉去重：已有 VL 描述的图片不再重复发送)
 import json
 from astrbot.api import logger
 from astrbot.api.star import Context
@@ -39,6 +40,10 @@ class ReplyEngine:
         self.persistence = persistence
         self.bot_name: str = None # 将由 main.py 注入
 
+        # (v11.5) 视觉去重统计
+        self.images_sent = 0
+        self.images_skipped = 0
+
     async def fetch_bot_name(self):
         """(新) 供 main.py 调用的异步初始化"""
         # (v4.0) 确保 PromptBuilder 中的 bot_name 也被设置
@@ -66,7 +71,8 @@ class ReplyEngine:
         
         if is_poke_event:
             sender_name = event.get_extra("heartflow_poke_sender_name") or "用户"
-            prompt_override = f"用户 {sender_name} 刚刚戳了你一下，请你用符合人设的、元气的、简短的（1-2句话）方式回应他/她。" #
+            poke_action = self.prompt_builder.format_poke_action(event.get_extra("heartflow_poke_count") or 1) # (v11.20)
+            prompt_override = f"用户 {sender_name} 刚刚{poke_action}，请你用符合人设的、元气的、简短的（1-2句话）方式回应他/她。" #
         
         # ！！！ (v9.2) 调用 LLM 并检查 None ！！！
         llm_response, _ = await self._get_main_llm_reply(
@@ -219,12 +225,8 @@ class ReplyEngine:
             # (v9.1) 将 场景/风格 注入 System Prompt
             final_system_prompt = f"{base_system_prompt}\n\n{enhancements}"
             
-            # 6. (v3.3 修复) 组装「视觉信息」
-            image_urls_to_send = []
-            if event.message_obj and event.message_obj.message: #
-                for component in event.message_obj.message:
-                    if isinstance(component, Comp.Image) and component.url: #
-                        image_urls_to_send.append(component.url)
+            # 6. (v3.3 修复) 组装「视觉信息」 (v11.5 按视觉去重策略筛选)
+            image_urls_to_send = await self._collect_main_llm_images(event)
             
             if image_urls_to_send:
                 logger.debug(f"MainLLM: 正在向主回复模型传递 {len(image_urls_to_send)} 张图片。") #
@@ -246,6 +248,58 @@ class ReplyEngine:
             # ！！！ v9.2 修复：返回 None 以触发“静默降级” ！！！
             return None, []
 
+    async def _collect_main_llm_images(self, event: AstrMessageEvent) -> list:
+        """
+        (v11.5) 按 main_llm_image_policy 决定随主 LLM 请求发送的图片
+        - always: 总是发送 (含引用消息中的图片)
+        - no_description: 仅发送尚无 VL 描述的图片 (描述已写入 Prompt)
+        - never: 从不发送
+        """
+        policy = self.config.main_llm_image_policy
+
+        # 1. 当前消息中的图片 (描述由 VL / 多模态判断写入 image_description)
+        current_urls = []
+        if event.message_obj and event.message_obj.message: #
+            for component in event.message_obj.message:
+                if isinstance(component, Comp.Image) and component.url: #
+                    current_urls.append(component.url)
+
+        # 2. 引用消息中的图片 (描述来自 VL 缓存)
+        quoted_images = [c for c in await self.prompt_builder.get_quoted_images(event) if c.url]
+
+        urls_to_send = []
+        skipped = 0
+        if policy == "never":
+            skipped = len(current_urls) + len(quoted_images)
+        elif policy == "no_description":
+            if event.get_extra("image_description"):
+                skipped += len(current_urls)
+            else:
+                urls_to_send.extend(current_urls)
+            for component in quoted_images:
+                if self.prompt_builder.get_cached_image_description(component):
+                    skipped += 1
+                else:
+                    urls_to_send.append(component.url)
+        else: # always
+            urls_to_send = current_urls + [c.url for c in quoted_images]
+
+        urls_to_send = list(dict.fromkeys(urls_to_send))
+        self.images_sent += len(urls_to_send)
+        self.images_skipped += skipped
+        if skipped:
+            logger.debug(f"MainLLM: (v11.5) 视觉去重 ({policy})，跳过 {skipped} 张图片。")
+        return urls_to_send
+
+    def get_vision_stats_str(self) -> str:
+        """(v11.5) 供 /heartcore 状态报告使用"""
+        tokens_avoided = self.images_skipped * self.config.main_llm_image_token_estimate
+        return (
+            f"- 主LLM视觉去重 ({self.config.main_llm_image_policy}): "
+            f"已发送 {self.images_sent} 张 | 已跳过 {self.images_skipped} 张 | "
+            f"约节省图片 Token: {tokens_avoided}"
+        )
+
     # --- 3. 辅助功能 (表情) ---
 
     async def _send_meme(self, event: AstrMessageEvent, reply_text: str, probability: int):
@@ -0,0 +1,131 @@
+# heartflow/core/short_circuit.py
+# (新) v11.21 判断前规则短路
+# 职责：在调用判断模型之前按配置的规则检查消息，命中时直接给出“应回复”的合成 JudgeResult，
+#       省去一次判断 LLM 调用 (仍受每群冷却和精力下限约束，未通过时回到正常判断)
+import time
+from typing import Dict
+from astrbot.api import logger
+from astrbot.api.event import AstrMessageEvent
+import astrbot.api.message_components as Comp
+
+# (使用相对路径导入 v4.0 模块)
+from ..datamodels import JudgeResult, ChatState
+from ..config import HeartflowConfig
+
+# 可用规则 (按配置顺序检查，命中第一条即停止)
+SHORT_CIRCUIT_RULES = ("nickname", "reply_to_bot", "keyword", "poke")
+# 命中的规则名暂存于 event extra 的键
+RULE_EXTRA_KEY = "heartflow_short_circuit_rule"
+
+
+def is_reply_to_bot(event: AstrMessageEvent) -> bool:
+    """
+    引用消息的发送者为机器人 (优先使用消息组件自带的 sender_id，其次使用 v11.3 预取的引用消息)
+    (v11.23 提取为模块函数，供本地评分特征复用)
+    """
+    if not event.message_obj or not event.message_obj.message:
+        return False
+    self_id = str(event.get_self_id())
+    prefetch = event.get_extra("heartflow_rich_prefetch") or {}
+    replies = prefetch.get("replies", {})
+    for component in event.message_obj.message:
+        if not isinstance(component, Comp.Reply):
+            continue
+        sender_id = getattr(component, "sender_id", None)
+        if sender_id is None:
+            replied_msg_data = replies.get(str(getattr(component, "id", "")))
+            if replied_msg_data:
+                sender_id = replied_msg_data.get("sender", {}).get("user_id")
+        if sender_id is not None and str(sender_id) == self_id:
+            return True
+    return False
+
+
+class ShortCircuitRules:
+    """
+    (v11.21) 规则短路引擎
+    - nickname:     消息以机器人昵称开头或结尾
+    - reply_to_bot: 消息引用了机器人的消息
+    - keyword:      消息包含 short_circuit_keywords 中的任一关键词
+    - poke:         戳一戳 (文本回复分支)
+    """
+
+    def __init__(self, config: HeartflowConfig):
+        self.config = config
+        self._last_fire: Dict[str, float] = {} # chat_id -> 上次短路回复时间
+
+        # 统计
+        self.rule_hits: Dict[str, int] = {rule: 0 for rule in SHORT_CIRCUIT_RULES}
+        self.blocked_cooldown = 0
+        self.blocked_energy = 0
+
+    def evaluate(self, event: AstrMessageEvent, chat_state: ChatState) -> JudgeResult | None:
+        """命中规则且通过冷却 / 精力检查时返回合成 JudgeResult，否则返回 None (继续正常判断)"""
+        rule = event.get_extra(RULE_EXTRA_KEY) or self.match(event)
+        if rule is None:
+            return None
+
+        chat_id = event.unified_msg_origin
+        now = time.time()
+        if now - self._last_fire.get(chat_id, 0.0) < self.config.short_circuit_cooldown_seconds:
+            self.blocked_cooldown += 1
+            logger.debug(f"[{chat_id[:10]}] 规则短路 {rule} 命中，但处于冷却中，转交判断模型。")
+            return None
+        if chat_state.energy < self.config.short_circuit_min_energy:
+            self.blocked_energy += 1
+            logger.debug(f"[{chat_id[:10]}] 规则短路 {rule} 命中，但精力不足 ({chat_state.energy:.2f})，转交判断模型。")
+            return None
+
+        self._last_fire[chat_id] = now
+        self.rule_hits[rule] += 1
+        logger.info(f"心流判断：规则短路命中 ({rule})，跳过判断模型。")
+        return JudgeResult(
+            should_reply=True,
+            confidence=1.0,
+            overall_score=1.0,
+            reasoning=f"Short Circuit: {rule}"
+        )
+
+    def match(self, event: AstrMessageEvent) -> str | None:
+        """返回命中的规则名 (并记入 event extra 供 evaluate 复用)，未命中返回 None"""
+        rule = self._match_rules(event)
+        if rule:
+            event.set_extra(RULE_EXTRA_KEY, rule)
+        return rule
+
+    def _match_rules(self, event: AstrMessageEvent) -> str | None:
+        for rule in self.config.short_circuit_rules:
+            if rule == "nickname" and self._match_nickname(event):
+                return rule
+            if rule == "reply_to_bot" and is_reply_to_bot(event):
+                return rule
+            if rule == "keyword" and self._match_keyword(event):
+                return rule
+            if rule == "poke" and event.get_extra("heartflow_is_poke_event"):
+                return rule
+        return None
+
+    # --- 规则 ---
+
+    def _match_nickname(self, event: AstrMessageEvent) -> bool:
+        message = (event.message_str or "").strip()
+        if not message:
+            return False
+        return any(
+            nickname and (message.startswith(nickname) or message.endswith(nickname))
+            for nickname in self.config.bot_nicknames
+        )
+
+    def _match_keyword(self, event: AstrMessageEvent) -> bool:
+        message = event.message_str or ""
+        return bool(message) and any(keyword and keyword in message for keyword in self.config.short_circuit_keywords)
+
+    # --- 统计 ---
+
+    def get_stats_str(self) -> str:
+        """供 /heartcore 状态报告使用"""
+        hits = " / ".join(f"{rule} {self.rule_hits[rule]}" for rule in self.config.short_circuit_rules)
+        return (
+            f"- 规则短路: {hits or '(未启用)'} | "
+            f"冷却拦截 {self.blocked_cooldown} | 精力拦截 {self.blocked_energy}"
+        )
@@ -1,15 +1,32 @@
 # heartflow/core/state_manager.py
 # (v4.0 重构 - 迁移)
 # (BUG 16 修复 - 实时关系层级)
+# (v11.6 性能 - 脏行跟踪，供持久化任务增量写入)
+# (v11.7 性能 - 收集变更时只做浅拷贝快照，序列化移至工作线程)
+# (v11.8 性能 - 版本化写时复制快照，供持久化/主动任务/状态命令读取)
+# (v11.9 性能 - 支持懒加载画像库 (LazyProfileStore)：冷画像按需加载、空闲移出)
+# (v11.10 性能 - 新建状态/画像时驻留键字符串)
+# (v11.11 性能 - 可选的 NumPy 列存储，每日社交衰减改为向量化计算)
+# (v11.12 性能 - 衰减改为读取时闭式补齐 (拉模式)，移除后台全量扫描)
+# (v11.12 修复 - 列存储改为批量闭式结算驻留画像，与读取时结算结果一致)
+# (v11.14) 群聊状态变化监听 (供主动话题调度堆增量更新)
+import copy
+import sys
 import time
 import datetime
 from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent
-from typing import Dict
+from types import MappingProxyType
+from typing import Callable, Dict, List
 
 # (使用相对路径导入 v4.0 模块)
-from ..datamodels import ChatState, JudgeResult, UserProfile
+from ..datamodels import ChatState, JudgeResult, UserProfile, StateSnapshot
 from ..config import HeartflowConfig
+from ..storage.base import StorageChanges
+from .profile_store import LazyProfileStore
+from .decay import decay_mood, recover_energy, decay_social_score
+from . import profile_columns
+from .profile_columns import ProfileColumnStore
 
 class StateManager:
     """
@@ -24,6 +41,62 @@ class StateManager:
         self.chat_states: Dict[str, ChatState] = initial_states
         self.user_profiles: Dict[str, UserProfile] = initial_profiles
 
+        # (v11.6) 脏行跟踪 (主键集合)，由 PersistenceTask 定期收集并写入存储后端
+        self._dirty_states: set = set()
+        self._deleted_states: set = set()
+        self._dirty_profiles: set = set()
+
+        # (v11.8) 版本号 & 写时复制快照
+        self._version = 0
+        self._state_versions: Dict[str, int] = {}
+        self._profile_versions: Dict[str, int] = {}
+        self._snap_changed_states: set = set()
+        self._snap_deleted_states: set = set()
+        self._snap_changed_profiles: set = set()
+        self._last_snapshot: StateSnapshot = None
+        self._snap_evicted_profiles: set = set() # (v11.9) 已移出内存的画像，需从下一个快照中去除
+
+        if isinstance(self.user_profiles, LazyProfileStore):
+            self.user_profiles.on_load = self._on_profile_loaded # (v11.9)
+
+        # (v11.11) 社交衰减列存储 (首次批量结算时全量建立，之后只同步被修改过的画像)
+        self._use_profile_columns = config.social_decay_vectorized
+        if self._use_profile_columns and profile_columns.np is None:
+            logger.warning("💖 心流：未安装 numpy，批量社交衰减将逐个画像结算。")
+            self._use_profile_columns = False
+        self._profile_columns: ProfileColumnStore = None
+        self._column_dirty_profiles: set = set()
+
+        # (v11.14) 群聊状态变化监听器 (chat_id) -> None，在标记脏数据 / 删除时调用
+        self._state_listeners: List[Callable[[str], None]] = []
+
+    def add_state_listener(self, listener: Callable[[str], None]):
+        """(v11.14) 注册群聊状态变化监听器 (回调中不应修改状态)"""
+        self._state_listeners.append(listener)
+
+    def _notify_state_listeners(self, chat_id: str):
+        for listener in self._state_listeners:
+            try:
+                listener(chat_id)
+            except Exception as e:
+                logger.error(f"状态监听器异常: {e}")
+
+    def load_initial_data(self, states: Dict[str, ChatState], profiles: Dict[str, UserProfile]):
+        """
+        (v11.0) 异步启动完成后注入从磁盘加载的状态
+        (启动期间若已有新建的条目，以内存中的为准)
+        """
+        states.update(self.chat_states)
+        profiles.update(self.user_profiles)
+        self.chat_states = states
+        self.user_profiles = profiles
+        if isinstance(profiles, LazyProfileStore):
+            profiles.on_load = self._on_profile_loaded # (v11.9)
+        self._last_snapshot = None # (v11.8) 数据已整体替换，下一个快照重新全量复制
+        self._version += 1
+        self._profile_columns = None # (v11.11) 下次批量结算时重建列存储
+        self._column_dirty_profiles.clear()
+
     # --- 1. ChatState (群聊状态) ---
 
     def _get_chat_state(self, chat_id: str) -> ChatState:
@@ -32,18 +105,29 @@ class StateManager:
         来源: v3.5 state_manager.py
         """
         if chat_id not in self.chat_states:
+            chat_id = sys.intern(chat_id) # (v11.10) 键驻留，与各处缓存共享同一字符串
             self.chat_states[chat_id] = ChatState(energy=self.config.energy_initial) #
             logger.info(f"创建新 ChatState (精力: {self.config.energy_initial:.2f}) for {chat_id[:20]}...")
+            created = True
+        else:
+            created = False
 
         today = datetime.date.today().isoformat()
         state = self.chat_states[chat_id]
+        # (v11.12) 补齐上次读取以来的情绪衰减 / 精力恢复
+        changed = self._materialize_chat_state(state, time.time()) or created
 
         if state.last_reset_date != today:
             state.last_reset_date = today
             state.energy = min(1.0, state.energy + 0.2) # (保留 v2.1 逻辑)
             state.mood = 0.0 # (v3.0) 每日重置心情
             logger.debug(f"执行每日状态重置: {chat_id[:20]}... | 精力: {state.energy:.2f} | 心情: {state.mood:.2f}")
+            changed = True
 
+        # (v11.6) 仅在新建 / 结算或重置改变了状态时标记脏数据；
+        # 读取后再修改状态的调用方须自行调用 mark_state_dirty
+        if changed:
+            self.mark_state_dirty(chat_id)
         return state
 
     def get_all_states(self) -> Dict[str, ChatState]:
@@ -54,6 +138,7 @@ class StateManager:
         """(新) 供 command_handler.py 调用"""
         if chat_id in self.chat_states:
             del self.chat_states[chat_id]
+            self._mark_state_deleted(chat_id) # (v11.6)
             logger.info(f"心流状态已重置: {chat_id}")
             return True
         return False
@@ -77,50 +162,37 @@ class StateManager:
         """(新) 供后台任务调用，只读，不存在时返回 None"""
         return self.chat_states.get(chat_id)
 
-    def _apply_passive_decay(self, chat_id: str):
-        """(v4.3.4 修复 Bug 2) v4.2 (F3) 情绪衰减 & (R1) 被动精力恢复"""
-        
-        # (BUG 3 修复) 
-        # chat_state = self._get_chat_state(chat_id) # <- 这是 Bug 3 的根源
-        chat_state = self.get_chat_state_readonly(chat_id) #
-        
-        # 如果状态不存在（例如，刚被 /重载心流 删除），则安全退出
-        if not chat_state: #
-            return #
-        # (修复结束)
+    def _materialize_chat_state(self, chat_state: ChatState, now: float) -> bool:
+        """
+        (v11.12) 取代 v4.2 的 _apply_passive_decay (后台逐群扫描)：
+        读取时按经过的时间一次性结算 (F3) 情绪衰减与 (R1) 被动精力恢复
+        返回是否发生变化 (调用方负责标记脏数据)
+        """
+        original = (chat_state.mood, chat_state.energy, chat_state.last_passive_decay_time)
 
-        now = time.time()
-        
         # 1. (F3) 情绪衰减
-        decay_interval_sec = self.config.emotion_decay_interval_hours * 3600 #
-        if now - chat_state.last_passive_decay_time > decay_interval_sec: #
-            chat_state.last_passive_decay_time = now #
-            
-            if chat_state.mood > 0: #
-                chat_state.mood = max(0.0, chat_state.mood - self.config.mood_decay) #
-                logger.debug(f"[{chat_id[:10]}] (F3) 情绪平复，心情 -> {chat_state.mood:.2f}")
-            elif chat_state.mood < 0: #
-                chat_state.mood = min(0.0, chat_state.mood + self.config.mood_decay) #
-                logger.debug(f"[{chat_id[:10]}] (F3) 情绪平复，心情 -> {chat_state.mood:.2f}")
-        
-        # 2. (R1) 被动精力恢复 (如果太久没说话)
-        
-        # (BUG 3 修复) 
-        # 不再调用 _get_minutes_since_last_reply (因为它会创建状态)
-        # 而是直接从已安全获取的 chat_state 计算
-        minutes_silent = 999
-        if chat_state.last_reply_time != 0:
-            minutes_silent = (time.time() - chat_state.last_reply_time) / 60
-        # (修复结束)
-        
-        if isinstance(minutes_silent, (int, float)):
-            # ！！！ v4.3.4 修复：必须排除 "999" (从未回复) 的情况 ！！！
-            if 60 < minutes_silent < 999: # (在 1 小时到“从未回复”之间)
-                 if chat_state.energy < 0.8: # (只恢复到 80%)
-                    chat_state.energy = min(0.8, chat_state.energy + 0.1) # (缓慢恢复)
-        else:
-            # (v4.3.2 修复)
-            logger.warning(f"[{chat_id[:10]}] _get_minutes_since_last_reply 返回了 NoneType，跳过被动精力恢复。")
+        chat_state.mood, chat_state.last_passive_decay_time = decay_mood(
+            chat_state.mood, chat_state.last_passive_decay_time, now,
+            self.config.emotion_decay_interval_hours * 3600, self.config.mood_decay
+        )
+
+        # 2. (R1) 被动精力恢复 (沉默 1 小时后缓慢恢复，只恢复到 80%)
+        chat_state.energy = recover_energy(
+            chat_state.energy, chat_state.last_reply_time, chat_state.last_energy_update_time, now,
+            self.config.energy_passive_recovery_per_hour / 3600
+        )
+        chat_state.last_energy_update_time = now
+
+        return (chat_state.mood, chat_state.energy, chat_state.last_passive_decay_time) != original
+
+    def project_chat_state(self, chat_state: ChatState, now: float = None) -> ChatState:
+        """
+        (v11.12) 返回补齐衰减后的 *副本*，不修改原对象、不标记脏数据
+        供后台任务读取快照中的状态 (快照中的对象只在被访问时才结算)
+        """
+        projected = copy.copy(chat_state)
+        self._materialize_chat_state(projected, now or time.time())
+        return projected
 
     def _update_mood_with_inertia(self, chat_state: ChatState, inferred_mood: str):
         """
@@ -159,6 +231,7 @@ class StateManager:
             
             # ！！！v4.3.4 修复：使用新配置名！！！
             profile.social_score += self.config.score_positive_interaction #
+            self.mark_profile_dirty(profile.user_id) # (v11.6)
             logger.debug(f"用户 {profile.user_id} 社交评分 +{self.config.score_positive_interaction:.1f}，总分 {profile.social_score:.1f}")
             
             # --- (BUG 16 修复) ---
@@ -180,6 +253,7 @@ class StateManager:
             logger.info(f"[{chat_id[:10]}] 回复成功，已从 'summary' 切换到 'single' 模式。") #
         chat_state.judgment_mode = "single" #
         chat_state.message_counter = 0 #
+        self.mark_state_dirty(chat_id) # (v11.6)
 
         logger.debug(f"更新主动状态: {chat_id[:20]}... | 精力: {chat_state.energy:.2f} | 心情: {chat_state.mood:.2f} | 连回: {chat_state.consecutive_reply_count}") # (v4.2 日志)
 
@@ -205,6 +279,7 @@ class StateManager:
                 
                 # ！！！v4.3.4 修复：使用新配置名！！！
                 profile.social_score += self.config.score_negative_interaction #
+                self.mark_profile_dirty(profile.user_id) # (v11.6)
                 logger.debug(f"用户 {profile.user_id} 社交评分 {self.config.score_negative_interaction:.1f}，总分 {profile.social_score:.1f}")
                 
                 # --- (BUG 16 修复) ---
@@ -213,6 +288,7 @@ class StateManager:
 
         if batch_size == 1 and judge_result.inferred_mood: #
             self._update_mood_with_inertia(chat_state, judge_result.inferred_mood)
+        self.mark_state_dirty(chat_id) # (v11.6)
 
         logger.debug(f"更新被动状态 (批量: {batch_size}): {chat_id[:20]}... | 精力: {chat_state.energy:.2f}") #
 
@@ -236,6 +312,7 @@ class StateManager:
             logger.info(f"[{chat_id[:10]}] 主动话题回复成功，已从 'summary' 切换到 'single' 模式。") #
         chat_state.judgment_mode = "single" #
         chat_state.message_counter = 0 #
+        self.mark_state_dirty(chat_id) # (v11.6)
 
         logger.debug(f"更新Proactive状态: {chat_id[:20]}... | 精力: {chat_state.energy:.2f}") #
 
@@ -247,6 +324,7 @@ class StateManager:
         (BUG 7 修复：根据用户需求，移除黑名单惩罚逻辑)
         """
         if user_id not in self.user_profiles:
+            user_id = sys.intern(user_id) # (v11.10) 字典键与 profile.user_id 共享同一字符串
             # (v4.3) 新增：新用户检查黑名单惩罚
             new_profile = UserProfile(
                 user_id=user_id,
@@ -256,8 +334,17 @@ class StateManager:
             ) #
               
             self.user_profiles[user_id] = new_profile
-            
-        return self.user_profiles[user_id]
+            created = True
+        else:
+            created = False
+
+        profile = self.user_profiles[user_id]
+        changed = created
+        if self.config.enable_user_profiles:
+            changed = self._materialize_profile(profile, time.time()) or changed # (v11.12)
+        if changed:
+            self.mark_profile_dirty(profile.user_id) # (v11.6) 同 _get_chat_state：只读访问不标记
+        return profile
 
     def update_user_profile(self, event: AstrMessageEvent):
         """
@@ -272,6 +359,7 @@ class StateManager:
             user_profile = self._get_user_profile(sender_id)
             user_profile.name = event.get_sender_name()
             user_profile.last_seen = time.time() #
+            self.mark_profile_dirty(user_profile.user_id) # (v11.6)
         except Exception as e:
             logger.warning(f"更新用户画像失败: {e}") #
     
@@ -304,59 +392,247 @@ class StateManager:
         if original_tier != profile.relationship_tier:
             logger.debug(f"(F1) 用户 {profile.user_id} 关系变更 (实时): {original_tier} -> {profile.relationship_tier}")
 
-    # --- (BUG 16 修复) 修改：后台任务 ---
-    def _update_relationship_tiers(self):
+    # --- (v11.12) 社交衰减：读取时闭式补齐 ---
+    def _materialize_profile(self, profile: UserProfile, now: float) -> bool:
+        """
+        (v11.12) 取代 v4.2 的 _update_relationship_tiers (后台逐用户扫描)：
+        (BUG 10) 每日衰减检查按天补齐，(M2) 宽限期内不衰减，(BUG 16) 随后重新计算层级
+        返回是否发生变化 (调用方负责标记脏数据)
+        """
+        original = (profile.social_score, profile.tier_code, profile.last_decay_check_time)
+        profile.social_score, profile.last_decay_check_time = decay_social_score(
+            profile.social_score, profile.last_seen, profile.last_decay_check_time, now,
+            self.config.social_memory_decay_days * 86400, #
+            abs(self.config.score_decay_rate_per_day) # ！！！v4.3.4 修复：使用新配置名！！！
+        )
+        if profile.social_score != original[0]:
+            logger.debug(f"用户 {profile.user_id} 关系衰减: {original[0]:.1f} -> {profile.social_score:.1f}")
+        self._recalculate_tier(profile)
+        return (profile.social_score, profile.tier_code, profile.last_decay_check_time) != original
+
+    def _on_profile_loaded(self, profile: UserProfile):
         """
-        (BUG 10 修复) v4.2 (F1+M2) 社交记忆和关系衰减
-        (BUG 10 修复: 衰减逻辑现在每天只对每个用户运行一次)
-        (BUG 16 修复: 仅负责“衰减”，并调用 _recalculate_tier)
+        (v11.9) 懒加载画像库回调：冷画像被重新加载到内存时，
+        补齐驻留磁盘期间错过的每日衰减检查
+        """
+        if self._use_profile_columns:
+            self._column_dirty_profiles.add(profile.user_id) # (v11.11) 重新进入列存储
+        if self.config.enable_user_profiles and self._materialize_profile(profile, time.time()):
+            self.mark_profile_dirty(profile.user_id)
+
+    def settle_resident_profiles(self) -> int:
+        """
+        (v11.12) 批量结算所有驻留内存画像的社交衰减与层级 (v11.13 起由调度器定期调用)
+        结果与逐个读取时的 _materialize_profile 完全一致；启用列存储时以向量运算完成，
+        否则逐个结算。返回写回 (标记脏数据) 的画像数
         """
         if not self.config.enable_user_profiles:
-            return
-            
+            return 0
         now = time.time()
-        decay_days_sec = self.config.social_memory_decay_days * 86400 #
-        
-        # ！！！v4.3.4 修复：使用新配置名！！！
-        decay_score_abs = abs(self.config.score_decay_rate_per_day) #
-        
-        changed_count = 0
-        for profile in self.user_profiles.values():
-            
-            # --- (BUG 10 修复：每日衰减检查) ---
-            # 86400 seconds = 24 hours
-            if now - profile.last_decay_check_time > 86400: #
-                # 1. 标记“今天”已检查
-                profile.last_decay_check_time = now #
-                
-                # 2. (v4.3.1 M2 修复) 检查是否满足“宽限期”
-                if now - profile.last_seen > decay_days_sec: #
-                    
-                    original_score = profile.social_score
-                    # 3. (BUG 10 修复) 仅在此时应用衰减
-                    if profile.social_score > decay_score_abs: #
-                        # 积极分，向 0 衰减
-                        profile.social_score -= decay_score_abs #
-                    elif profile.social_score < -decay_score_abs: #
-                        # 消极分，向 0 衰减 (治愈)
-                        profile.social_score += decay_score_abs #
-                    else:
-                        # 分数已经接近 0，直接归零
-                        profile.social_score = 0.0 #
-                    
-                    if original_score != profile.social_score:
-                         logger.debug(f"用户 {profile.user_id} 关系衰减: {original_score:.1f} -> {profile.social_score:.1f}")
-                         changed_count += 1
-            # --- (BUG 10 修复结束) ---
-
-            
-            # --- (BUG 16 修复) ---
-            # (此逻辑 *必须* 位于 24 小时检查 *之外*，
-            # 以便在用户积极/消极互动后，立即更新其层级)
-            #
-            # (在 BUG 16 修复后，此处的调用仅用于捕获“衰减”导致的分数变化)
-            self._recalculate_tier(profile)
-            # --- (修复结束) ---
-
-        if changed_count > 0:
-            logger.info(f"(F1) {changed_count} 个用户的关系因“衰减”而更新。")
\ No newline at end of file
+        if self._use_profile_columns:
+            written, _ = self._settle_profile_columns(now)
+        else:
+            written = [profile for _, profile in self._iter_live_profiles() if self._materialize_profile(profile, now)]
+        for profile in written:
+            self.mark_profile_dirty(profile.user_id)
+        if self._use_profile_columns:
+            # 写回的值与列一致，无需再次同步
+            self._column_dirty_profiles.difference_update(profile.user_id for profile in written)
+        if written:
+            logger.info(f"(F1) 批量结算社交衰减：{len(written)} 个用户画像已更新。")
+        return len(written)
+
+    def _settle_profile_columns(self, now: float):
+        """(v11.12) settle_resident_profiles 的列存储版本：先同步被修改过的画像，再整体向量结算"""
+        if self._profile_columns is None:
+            self._profile_columns = ProfileColumnStore()
+            self._profile_columns.extend(profile for _, profile in self._iter_live_profiles())
+            self._column_dirty_profiles.clear()
+        else:
+            self._sync_profile_columns()
+        return self._profile_columns.settle(
+            now,
+            self.config.social_memory_decay_days * 86400, #
+            abs(self.config.score_decay_rate_per_day), #
+            self.config.tier_avoiding_score, self.config.tier_friend_score, self.config.tier_acquaintance_score
+        )
+
+    def _sync_profile_columns(self):
+        """(v11.11) 把被修改过 / 新加载的画像同步到列存储，已移出内存的画像从列中删除"""
+        is_lazy = isinstance(self.user_profiles, LazyProfileStore)
+        for user_id in self._column_dirty_profiles:
+            profile = self.user_profiles.peek(user_id) if is_lazy else self.user_profiles.get(user_id)
+            if profile is None:
+                self._profile_columns.remove(user_id)
+            else:
+                self._profile_columns.upsert(profile)
+        self._column_dirty_profiles.clear()
+
+    def _iter_live_profiles(self):
+        """(v11.9) 遍历内存中的画像 (懒加载时只包含驻留的画像，不触发磁盘读取)"""
+        if isinstance(self.user_profiles, LazyProfileStore):
+            return self.user_profiles.resident_items()
+        return self.user_profiles.items()
+
+    def evict_idle_profiles(self) -> int:
+        """
+        (v11.9) 将空闲超时的画像移出内存 (仅懒加载模式)
+        尚未写入存储或尚未进入快照的画像不会被移出
+        由 PersistenceTask 在刷写成功后调用
+        """
+        if not isinstance(self.user_profiles, LazyProfileStore):
+            return 0
+        evicted = self.user_profiles.evict_idle(
+            protected=self._dirty_profiles | self._snap_changed_profiles
+        )
+        for user_id in evicted:
+            self._profile_versions.pop(user_id, None)
+            if self._use_profile_columns:
+                self._column_dirty_profiles.add(user_id) # (v11.11) 同步时从列存储删除
+        self._snap_evicted_profiles.update(evicted)
+        if evicted:
+            self._version += 1 # 使下一个快照去除被移出的画像
+            logger.debug(f"(v11.9) 已将 {len(evicted)} 个空闲用户画像移出内存。")
+        return len(evicted)
+
+    # --- 3. (v11.6) 脏行跟踪 / (v11.8) 版本号 ---
+
+    def mark_state_dirty(self, chat_id: str):
+        """
+        (v11.6) 标记群聊状态需要写入存储
+        (v11.8) 同时递增该条目的版本号，并记入下一个快照的变更集
+        """
+        self._dirty_states.add(chat_id)
+        self._deleted_states.discard(chat_id)
+        self._version += 1
+        self._state_versions[chat_id] = self._version
+        self._snap_changed_states.add(chat_id)
+        self._snap_deleted_states.discard(chat_id)
+        self._notify_state_listeners(chat_id) # (v11.14)
+
+    def mark_profile_dirty(self, user_id: str):
+        """(v11.6) 标记用户画像需要写入存储 (v11.8 同 mark_state_dirty)"""
+        self._dirty_profiles.add(user_id)
+        self._version += 1
+        self._profile_versions[user_id] = self._version
+        self._snap_changed_profiles.add(user_id)
+        if self._use_profile_columns:
+            self._column_dirty_profiles.add(user_id) # (v11.11)
+
+    def _mark_state_deleted(self, chat_id: str):
+        """(v11.6) 记录群聊状态的删除 (v11.8 同步到快照变更集)"""
+        self._dirty_states.discard(chat_id)
+        self._deleted_states.add(chat_id)
+        self._version += 1
+        self._state_versions.pop(chat_id, None)
+        self._snap_changed_states.discard(chat_id)
+        self._snap_deleted_states.add(chat_id)
+        self._notify_state_listeners(chat_id) # (v11.14)
+
+    def get_state_version(self, chat_id: str) -> int:
+        """(v11.8) 群聊状态的版本号 (从未修改过为 0)"""
+        return self._state_versions.get(chat_id, 0)
+
+    def get_profile_version(self, user_id: str) -> int:
+        """(v11.8) 用户画像的版本号 (从未修改过为 0)"""
+        return self._profile_versions.get(user_id, 0)
+
+    def has_pending_changes(self) -> bool:
+        return bool(self._dirty_states or self._deleted_states or self._dirty_profiles)
+
+    def snapshot(self) -> StateSnapshot:
+        """
+        (v11.8) 获取一致性的只读快照 (写时复制)
+        - 只复制自上一个快照以来被标记过的条目，其余条目与上一个快照共享
+        - 版本号未变时直接复用上一个快照
+        - 必须在事件循环线程中调用；返回的快照可交给工作线程读取
+        """
+        previous = self._last_snapshot
+        if previous is not None and previous.version == self._version:
+            return previous
+
+        if previous is None:
+            # 首个快照：全量复制一次
+            states = {chat_id: copy.copy(state) for chat_id, state in self.chat_states.items()}
+            profiles = {user_id: copy.copy(profile) for user_id, profile in self._iter_live_profiles()}
+            changed_states = frozenset(states)
+            changed_profiles = frozenset(profiles)
+            deleted_states = frozenset()
+        else:
+            states = dict(previous.states) # 仅复制引用
+            profiles = dict(previous.profiles)
+            changed_states = frozenset(self._snap_changed_states)
+            changed_profiles = frozenset(self._snap_changed_profiles)
+            deleted_states = frozenset(self._snap_deleted_states)
+            for chat_id in changed_states:
+                state = self.chat_states.get(chat_id)
+                if state is not None:
+                    states[chat_id] = copy.copy(state)
+            for chat_id in deleted_states:
+                states.pop(chat_id, None)
+            for user_id in self._snap_evicted_profiles: # (v11.9)
+                profiles.pop(user_id, None)
+            for user_id in changed_profiles:
+                profile = self.user_profiles.get(user_id)
+                if profile is not None:
+                    profiles[user_id] = copy.copy(profile)
+
+        self._snap_changed_states.clear()
+        self._snap_deleted_states.clear()
+        self._snap_changed_profiles.clear()
+        self._snap_evicted_profiles.clear()
+
+        self._last_snapshot = StateSnapshot(
+            version=self._version,
+            states=MappingProxyType(states),
+            profiles=MappingProxyType(profiles),
+            changed_states=changed_states,
+            deleted_states=deleted_states,
+            changed_profiles=changed_profiles,
+        )
+        return self._last_snapshot
+
+    def collect_changes(self, full: bool = False) -> StorageChanges | None:
+        """
+        (v11.6) 取出自上次收集以来的变更 (同时清空脏标记)，无变更时返回 None
+        - full=False: 只包含脏行 (SQLite)
+        - full=True: 有变更的实体返回全量行 (JSON 整文件重写)
+        (v11.8) 行取自写时复制快照：不再复制未变化的条目，写入期间消息处理可继续修改实时状态
+        """
+        if not self.has_pending_changes():
+            return None
+
+        include_profiles = self.config.enable_user_profiles
+        dirty_states, self._dirty_states = self._dirty_states, set()
+        deleted_states, self._deleted_states = self._deleted_states, set()
+        dirty_profiles, self._dirty_profiles = self._dirty_profiles, set()
+        snapshot = self.snapshot()
+
+        changes = StorageChanges(full=full)
+        if full:
+            if dirty_states or deleted_states:
+                changes.states = dict(snapshot.states)
+            if dirty_profiles and include_profiles:
+                changes.profiles = dict(snapshot.profiles)
+        else:
+            changes.states = {
+                chat_id: snapshot.states[chat_id]
+                for chat_id in dirty_states if chat_id in snapshot.states
+            }
+            changes.deleted_states = deleted_states
+            if include_profiles:
+                changes.profiles = {
+                    user_id: snapshot.profiles[user_id]
+                    for user_id in dirty_profiles if user_id in snapshot.profiles
+                }
+        return changes
+
+    def restore_changes(self, changes: StorageChanges):
+        """(v11.6) 写入失败时重新标记，等待下一次写入"""
+        for chat_id in (changes.states or {}):
+            if chat_id in self.chat_states:
+                self._dirty_states.add(chat_id)
+        # 写入期间被重新创建的群聊不再恢复删除 (与 mark_state_dirty 中的 discard 对应)
+        self._deleted_states.update(chat_id for chat_id in changes.deleted_states if chat_id not in self.chat_states)
+        for user_id in (changes.profiles or {}):
+            self._dirty_profiles.add(user_id)
@@ -1,8 +1,16 @@
 # heartflow/datamodels.py
 # (v4.2 更新 - 扩展 F1, F3, F4)
-from dataclasses import dataclass, field
+# (v11.10 性能 - 高频对象改用 __slots__，关系层级以小整数存储)
+import sys
+from dataclasses import dataclass, field, fields
+from typing import Mapping
 
-@dataclass
+# (v11.10) 关系层级 <-> 小整数编码 (磁盘上仍保存字符串，兼容旧数据)
+RELATIONSHIP_TIERS = ("stranger", "acquaintance", "friend", "avoiding")
+TIER_CODES = {tier: code for code, tier in enumerate(RELATIONSHIP_TIERS)}
+
+
+@dataclass(slots=True)
 class JudgeResult:
     """判断结果数据类"""
     relevance: float = 0.0           # 内容相关度评分
@@ -16,6 +24,7 @@ class JudgeResult:
     overall_score: float = 0.0       # 综合加权评分
     related_messages: list = None    # (已弃用，保留兼容性)
     inferred_mood: str = "neutral"   # 推断的群聊氛围
+    image_description: str = ""      # (v11.4) 多模态判断模式下顺带返回的图片描述
 
     def __post_init__(self):
         # 确保 related_messages 默认为空列表
@@ -23,7 +32,7 @@ class JudgeResult:
             self.related_messages = []
 
 
-@dataclass
+@dataclass(slots=True)
 class ChatState:
     """群聊状态数据类"""
     energy: float = 1.0              # 当前精力值 (0.1 - 1.0)
@@ -40,11 +49,26 @@ class ChatState:
     # --- v4.2 新增 (F3, F4) ---
     consecutive_reply_count: int = 0      # (F4) 社交冷却：连续回复计数
     last_passive_decay_time: float = 0.0  # (F3) 情绪衰减：上次平复的时间戳
+    last_energy_update_time: float = 0.0  # (v11.12) 被动精力恢复：上次结算的时间戳
 
+    def to_dict(self) -> dict:
+        """(v11.10) 转换为可序列化的字典 (slots 对象上比 asdict 快，且不做深拷贝)"""
+        return {name: getattr(self, name) for name in _field_names(type(self))}
 
-@dataclass
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChatState":
+        """(v11.10) 从存储行重建，忽略旧版本遗留的未知字段"""
+        known = _field_names(cls)
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+@dataclass(slots=True)
 class UserProfile:
-    """(v4.3 修改) v3.0 用户画像数据类 (Feature 3)"""
+    """
+    (v4.3 修改) v3.0 用户画像数据类 (Feature 3)
+    (v11.10) 百万级画像常驻内存，使用 __slots__；
+             relationship_tier 以 tier_code 小整数存储，通过同名属性保持字符串读写接口
+    """
     user_id: str                 #
     name: str                 # 最近一次的昵称
     
@@ -55,9 +79,78 @@ class UserProfile:
     # --- ！！！v4.3 新增！！！ ---
     social_score: float = 0.0   # 综合社交评分
     
-    relationship_tier: str = "stranger" # 关系层级 (由 social_score 派生)
+    tier_code: int = 0          # (v11.10) 关系层级编码 (由 social_score 派生，见 RELATIONSHIP_TIERS)
     last_seen: float = 0.0      # (v3.0) 最后发言时间戳
 
     # --- (BUG 10 修复) ---
     # 新增一个字段来跟踪上次执行衰减检查的时间戳
-    last_decay_check_time: float = 0.0
\ No newline at end of file
+    last_decay_check_time: float = 0.0
+
+    @property
+    def relationship_tier(self) -> str:
+        """关系层级字符串 ('stranger' / 'acquaintance' / 'friend' / 'avoiding')"""
+        return RELATIONSHIP_TIERS[self.tier_code]
+
+    @relationship_tier.setter
+    def relationship_tier(self, tier: str):
+        self.tier_code = TIER_CODES[tier]
+
+    def to_dict(self) -> dict:
+        """(v11.10) 转换为可序列化的字典，层级写回字符串 (与旧版 JSON / SQLite 行格式一致)"""
+        return {
+            "user_id": self.user_id,
+            "name": self.name,
+            "social_score": self.social_score,
+            "relationship_tier": self.relationship_tier,
+            "last_seen": self.last_seen,
+            "last_decay_check_time": self.last_decay_check_time,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserProfile":
+        """(v11.10) 从存储行重建：user_id 驻留 (与字典键共享同一字符串)，层级字符串转为编码"""
+        known = _field_names(cls)
+        kwargs = {k: v for k, v in data.items() if k in known}
+        kwargs["user_id"] = sys.intern(kwargs["user_id"])
+        tier = data.get("relationship_tier")
+        if tier is not None:
+            kwargs["tier_code"] = TIER_CODES.get(tier, 0)
+        return cls(**kwargs)
+
+
+def _field_names(cls) -> tuple:
+    """(v11.10) dataclass 字段名 (按声明顺序，按类缓存)"""
+    names = _FIELD_NAMES_CACHE.get(cls)
+    if names is None:
+        names = _FIELD_NAMES_CACHE[cls] = tuple(f.name for f in fields(cls))
+    return names
+
+
+_FIELD_NAMES_CACHE: dict = {}
+
+
+@dataclass
+class EnrichedContext:
+    """(v11.3) 消息富化阶段的并发预取结果 (供判断 Prompt 组装使用)"""
+    image_description: str = None    # VL 描述 (未识别时为 None)
+    persona_key: str = ""            # 人格缓存 Key
+    persona_prompt: str = ""         # 人格摘要
+    history: list = None             # 保存当前消息 *之前* 的历史快照 (None = 未预取)
+    user_profile: UserProfile = None # 发言者画像 (未启用时为 None)
+    timings: dict = field(default_factory=dict) # 各部分耗时 (ms)
+
+
+@dataclass(frozen=True)
+class StateSnapshot:
+    """
+    (v11.8) StateManager 的只读一致性快照 (写时复制)
+    - states / profiles 为只读映射，其中的对象是快照时刻的副本，读者不得修改
+    - (v11.9) 懒加载画像库下 profiles 只包含驻留内存的画像
+    - changed_* / deleted_states: 相对上一个快照发生变化的主键
+    """
+    version: int
+    states: Mapping[str, ChatState]
+    profiles: Mapping[str, UserProfile]
+    changed_states: frozenset = frozenset()
+    deleted_states: frozenset = frozenset()
+    changed_profiles: frozenset = frozenset()
@@ -8,6 +8,8 @@ from astrbot.api.event import AstrMessageEvent, filter as event_filter
 from ..config import HeartflowConfig
 from ..core.state_manager import StateManager
 from ..features.persona_summarizer import PersonaSummarizer
+from ..utils.image_cache import ImageDescriptionCache
+from ..core.profile_store import LazyProfileStore
 
 class CommandHandler:
     """
@@ -21,13 +23,25 @@ class CommandHandler:
                  config: HeartflowConfig, 
                  state_manager: StateManager,
                  persona_summarizer: PersonaSummarizer,
-                 decision_engine: "DecisionEngine" # (v4.0) 依赖决策引擎获取模型信息
+                 decision_engine: "DecisionEngine", # (v4.0) 依赖决策引擎获取模型信息
+                 image_cache: ImageDescriptionCache = None, # (v11.1) 用于显示 VL 缓存统计
+                 reply_engine: "ReplyEngine" = None, # (v11.5) 用于显示视觉去重统计
+                 persistence_task: "PersistenceTask" = None, # (v11.6) 状态刷写
+                 scheduler: "HousekeepingScheduler" = None, # (v11.13) 后台任务统计
+                 proactive_task: "ProactiveTask" = None, # (v11.15) 主动话题统计
+                 poke_handler: "PokeHandler" = None # (v11.19) 戳一戳统计
                  ):
         self.context = context
         self.config = config
         self.state_manager = state_manager
         self.persona_summarizer = persona_summarizer
         self.decision_engine = decision_engine
+        self.image_cache = image_cache
+        self.reply_engine = reply_engine
+        self.persistence_task = persistence_task
+        self.scheduler = scheduler
+        self.proactive_task = proactive_task
+        self.poke_handler = poke_handler
 
     @event_filter.command("heartcore", "心芯状态", "查看心芯")
     async def heartflow_status(self, event: AstrMessageEvent):
@@ -36,7 +50,11 @@ class CommandHandler:
         来源: main.py -> heartflow_status
         """
         chat_id = event.unified_msg_origin
-        chat_state = self.state_manager._get_chat_state(chat_id)
+        self.state_manager._get_chat_state(chat_id) # 确保状态存在 (并执行每日重置 / v11.12 衰减结算)
+        if self.config.enable_user_profiles:
+            self.state_manager._get_user_profile(event.get_sender_id()) # (v11.12) 结算社交衰减后再取快照
+        snapshot = self.state_manager.snapshot() # (v11.8) 状态报告读取只读快照
+        chat_state = snapshot.states[chat_id]
 
         # --- (v4.0) 更新显示逻辑 ---
         
@@ -78,13 +96,37 @@ class CommandHandler:
         image_status = '✅ 已启用' if self.config.enable_image_recognition else '❌ 已禁用'
         if self.config.enable_image_recognition and image_model_str == "未配置":
             image_status = "⚠️ 启用但未配置模型"
+
+        # --- v11.1 性能统计 ---
+        perf_lines = []
+        if self.image_cache:
+            perf_lines.append(self.image_cache.get_stats_str())
+        if self.reply_engine:
+            perf_lines.append(self.reply_engine.get_vision_stats_str())
+        if self.persistence_task:
+            perf_lines.append(self.persistence_task.get_stats_str())
+        if isinstance(self.state_manager.user_profiles, LazyProfileStore):
+            perf_lines.append(self.state_manager.user_profiles.get_stats_str()) # (v11.9)
+        judge_stats = self.decision_engine.get_stats_str() # (v11.21 / v11.22)
+        if judge_stats:
+            perf_lines.append(judge_stats)
+        if self.scheduler:
+            perf_lines.append(self.scheduler.get_stats_str()) # (v11.13)
+        if self.proactive_task and self.config.proactive_enabled:
+            perf_lines.append(self.proactive_task.get_stats_str()) # (v11.15)
+        if self.poke_handler and self.config.enable_poke_response:
+            poke_stats = self.poke_handler.get_stats_str() # (v11.19)
+            if poke_stats:
+                perf_lines.append(poke_stats)
+        perf_info = "\n".join(perf_lines) if perf_lines else "- (无)"
             
         # --- ！！！ v4.3 新增：获取个人社交状态 ！！！ ---
         user_profile_info = "❌ (用户画像未启用)"
         if self.config.enable_user_profiles: #
             try:
                 # 获取 *发送命令者* 的画像
-                user_profile = self.state_manager._get_user_profile(event.get_sender_id()) #
+                sender_id = event.get_sender_id()
+                user_profile = snapshot.profiles.get(sender_id) or self.state_manager._get_user_profile(sender_id) # (v11.8)
                 user_profile_info = (
                     f"- 关系层级: {user_profile.relationship_tier}\n" #
                     f"- 社交综合评分: {user_profile.social_score:.1f}" #
@@ -120,6 +162,9 @@ class CommandHandler:
 - 表情功能: {emotion_status}
 - (标准)表情概率: {self.config.emotions_probability}%
 
+⚡ **性能统计 (v11)**
+{perf_info}
+
 🎯 **插件状态**: {'✅ 已启用' if self.config.enable_heartflow else '❌ 已禁用'}
 """
         await event.send(event.plain_result(status_info)) #
@@ -135,8 +180,9 @@ class CommandHandler:
         success = self.state_manager.reset_chat_state(chat_id) #
         
         if success:
-            # (v4.0) 调用 Persistence
-            self.persistence.save_states(self.state_manager.get_all_states()) #
+            # (v11.6) 删除已由 StateManager 记录，立即刷写 (原 self.persistence 从未注入)
+            if self.persistence_task:
+                await self.persistence_task.flush()
             await event.send(event.plain_result("✅ 心流状态已重置")) #
         else:
             await event.send(event.plain_result("ℹ️ 当前群聊无心流状态，无需重置")) #
@@ -0,0 +1,91 @@
+# heartflow/features/persistence_task.py
+# (新) v11.6 持久化任务
+# 职责：定期收集 StateManager 的脏行，在工作线程中批量写入存储后端
+# (v11.7) 检查点：事件循环中只取浅拷贝快照，序列化/写入/统计大小均在工作线程中完成
+# (v11.13) 由 HousekeepingScheduler 周期调度
+import asyncio
+import time
+import datetime
+from astrbot.api import logger
+
+# (使用相对路径导入 v4.0 模块)
+from ..config import HeartflowConfig
+from ..core.state_manager import StateManager
+from ..persistence import PersistenceManager
+from ..utils.scheduler import HousekeepingScheduler
+
+class PersistenceTask:
+    """
+    (v11.6) 定期刷写任务
+    - SQLite 后端：只 upsert 脏行，单事务
+    - JSON 后端：有变更的实体整文件重写 (无变更时不写)
+    """
+
+    def __init__(self, config: HeartflowConfig, state_manager: StateManager, persistence: PersistenceManager):
+        self.config = config
+        self.state_manager = state_manager
+        self.persistence = persistence
+        self._flush_lock = asyncio.Lock()
+
+        # (v11.6) 统计
+        self.flush_count = 0
+        self.rows_written = 0
+        self.last_flush_time = 0.0
+        self.last_flush_ms = 0.0
+        self.last_size_bytes = 0 # (v11.7)
+
+    def register(self, scheduler: HousekeepingScheduler):
+        """(v11.13) 注册为调度器的周期任务 (取代 v11.6 的独立 sleep 循环)"""
+        interval = max(5, self.config.storage_flush_interval_seconds)
+        scheduler.schedule_every("state_checkpoint", interval, self.checkpoint, jitter=interval * 0.1)
+        logger.info(f"💖 心流：持久化任务已启动 (后端: {self.persistence.storage.name})。")
+
+    async def checkpoint(self):
+        """(v11.13) 一次周期检查点"""
+        await self.flush()
+        # (v11.9) 刷写之后再移出空闲画像 (未写入的画像受保护)
+        self.state_manager.evict_idle_profiles()
+
+    async def flush(self) -> int:
+        """
+        (v11.6) 立即写入所有脏行，返回写入的行数
+        写入失败时重新标记脏数据，等待下一次刷写
+        """
+        async with self._flush_lock:
+            changes = self.state_manager.collect_changes(
+                full=not self.persistence.storage.supports_partial_writes
+            )
+            if changes is None or changes.is_empty():
+                return 0
+
+            start = time.perf_counter()
+            try:
+                self.last_size_bytes = await asyncio.to_thread(self._write_checkpoint, changes)
+            except Exception as e:
+                self.state_manager.restore_changes(changes)
+                logger.error(f"💖 心流：刷写状态失败，将在下次重试: {e}")
+                return 0
+
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            self.last_flush_time = time.time()
+            self.flush_count += 1
+            self.rows_written += changes.row_count
+            logger.debug(f"💖 心流：(v11.6) 已刷写 {changes.row_count} 行 ({self.last_flush_ms:.0f}ms)。")
+            return changes.row_count
+
+    def _write_checkpoint(self, changes) -> int:
+        """(v11.7) 工作线程：序列化并写入，返回写入后的存储大小"""
+        self.persistence.write_changes(changes)
+        return self.persistence.storage.get_size_bytes()
+
+    def get_stats_str(self) -> str:
+        """供 /heartcore 状态报告使用"""
+        last = "尚未刷写"
+        if self.last_flush_time:
+            last_time = datetime.datetime.fromtimestamp(self.last_flush_time).strftime('%H:%M:%S')
+            last = (f"{last_time} ({int(time.time() - self.last_flush_time)} 秒前) | "
+                    f"耗时 {self.last_flush_ms:.0f}ms | 大小 {self.last_size_bytes / 1024:.1f} KB")
+        return (
+            f"- 状态存储 ({self.persistence.storage.name}): 已刷写 {self.flush_count} 次 / {self.rows_written} 行 | "
+            f"上次检查点: {last}"
+        )
@@ -1,5 +1,6 @@
 # heartflow/features/persona_summarizer.py
 # (v10.12 修复 - 根据用户请求，从 dynamic_style_guide 中移除 energy 和 tier)
+# (v11.13 性能 - 缓存保存改为经后台调度器延迟合并，在工作线程中写盘)
 import json
 import asyncio # <--- 导入 asyncio
 from astrbot.api import logger
@@ -16,7 +17,11 @@ from ..utils.api_utils import elastic_json_chat
 
 # (v10.0) 循环依赖
 if TYPE_CHECKING:
-    from ..utils.prompt_builder import PromptBuilder 
+    from ..utils.prompt_builder import PromptBuilder
+    from ..utils.scheduler import HousekeepingScheduler
+
+# (v11.13) 缓存变更后延迟保存的秒数 (期间的多次变更合并为一次写盘)
+CACHE_SAVE_DELAY_SECONDS = 10 
 
 class PersonaSummarizer:
     """
@@ -34,7 +39,8 @@ class PersonaSummarizer:
         self.context = context
         self.config = config
         self.persistence = persistence
-        self.cache = self.persistence.load_persona_cache() #
+        # (v11.0) 缓存改为由 main.py 在后台线程中调用 load_cache 异步加载
+        self.cache: Dict[str, Any] = {}
         
         # --- (v10.3 修复) ---
         # 字典：用于存储正在进行的摘要任务
@@ -43,6 +49,11 @@ class PersonaSummarizer:
         # 锁：用于保护对 pending_summaries 字典的并发访问
         self._lock = asyncio.Lock()
         # --- (修复结束) ---
+        self.scheduler: "HousekeepingScheduler" = None # (v11.13) 由 main.py 注入
+
+    def set_scheduler(self, scheduler: "HousekeepingScheduler"):
+        """(v11.13) 注入后台调度器"""
+        self.scheduler = scheduler
 
     async def _internal_create_summary(self, umo: str, persona_key_for_cache: str, original_prompt: str) -> str:
         """
@@ -58,7 +69,7 @@ class PersonaSummarizer:
                     "summarized": original_prompt, # 摘要=原始
                     "dynamic_style_guide": ""    # v10.0: 存一个空字符串
                 }
-                self.save_cache() # (v5) 立即保存
+                self._request_save() # (v5) 保存 (v11.13 延迟合并)
                 return original_prompt
             
             # --- ！！！ v10.9 修复：优化日志 ！！！ ---
@@ -80,7 +91,7 @@ class PersonaSummarizer:
                 "dynamic_style_guide": dynamic_style_guide
             }
             
-            self.save_cache() # (v5) 立即保存
+            self._request_save() # (v5) 保存 (v11.13 延迟合并)
             
             logger.info(f"创建新的精简系统提示词 (Persona Key: {persona_key_for_cache}) | 原长度:{len(original_prompt)} -> 新长度:{len(summarized_prompt)}")
             
@@ -151,7 +162,8 @@ class PersonaSummarizer:
             
             # --- 3. (v10.3) 等待任务完成 ---
             # (无论我们是“找到”了任务还是“创建”了任务，都在 *锁外* 等待它)
-            summarized_result = await pending_task
+            # (v11.3) shield：调用方超时取消时不应连带取消共享的摘要任务
+            summarized_result = await asyncio.shield(pending_task)
             return summarized_result
 
         except Exception as e:
@@ -172,6 +184,17 @@ class PersonaSummarizer:
             return cached_data.get("dynamic_style_guide") # 可能返回 None 或空字符串
         return None
 
+    def get_cached_summary(self, persona_key: str) -> str:
+        """
+        (v11.18) 从缓存中获取人格摘要 (不触发生成，供后台任务使用)
+        """
+        if not persona_key:
+            return None
+        cached_data = self.cache.get(persona_key)
+        if cached_data:
+            return cached_data.get("summarized")
+        return None
+
     async def _summarize_system_prompt(self, original_prompt: str) -> (str, str):
         """
         (v10.12 修复) 使用小模型对系统提示词进行总结
@@ -251,10 +274,31 @@ class PersonaSummarizer:
             logger.error(traceback.format_exc())
             return original_prompt, "" # (v10.1)
 
+    def load_cache(self):
+        """(v11.0) 从磁盘加载人格缓存 (阻塞 I/O，应在线程池中调用)"""
+        loaded = self.persistence.load_persona_cache()
+        loaded.update(self.cache) # 启动期间生成的摘要优先
+        self.cache = loaded
+
     def save_cache(self):
         """(新) 供外部调用，在 terminate 时保存"""
         self.persistence.save_persona_cache(self.cache) #
 
+    def _request_save(self):
+        """
+        (v11.13) 请求保存缓存：已有待执行的保存任务时不重复排队
+        未注入调度器时 (例如启动早期) 退化为立即保存
+        """
+        if self.scheduler is None:
+            self.save_cache()
+            return
+        self.scheduler.schedule_once("persona_cache_save", CACHE_SAVE_DELAY_SECONDS, self._save_cache_async, replace=False)
+
+    async def _save_cache_async(self):
+        """(v11.13) 调度器回调：在事件循环中复制，在工作线程中写盘"""
+        snapshot = dict(self.cache)
+        await asyncio.to_thread(self.persistence.save_persona_cache, snapshot)
+
     def get_all_cache_info(self) -> str:
         """
         (v10.2 修复) 获取缓存状态字符串
@@ -301,5 +345,5 @@ class PersonaSummarizer:
             self.cache.clear()
         
         # 3. 保存到磁盘
-        self.save_cache() # 清除后立即保存空状态
+        self._request_save() # 清除后保存空状态 (v11.13 延迟合并)
         logger.info("心流缓存已异步清除。")
\ No newline at end of file
@@ -1,8 +1,11 @@
 # heartflow/features/poke_handler.py
 # (v4.0 重构 - 新文件)
+# (v11.19 性能 - 文本回复分支优先从戳一戳回复池直接回复，对话进行中才走完整流程)
+# (v11.20 性能 - 按 (群聊, 用户) 合并连续戳一戳并限流，在任何 API / LLM 调用之前丢弃)
 import time
 import json
 import random
+from typing import TYPE_CHECKING
 from astrbot.api import logger
 from astrbot.api.star import Context
 from astrbot.api.event import AstrMessageEvent, filter as event_filter
@@ -13,6 +16,11 @@ from ..datamodels import JudgeResult, ChatState, UserProfile
 from ..core.state_manager import StateManager
 from ..core.reply_engine import ReplyEngine
 from ..persistence import PersistenceManager
+from ..utils.prompt_builder import PromptBuilder
+from .poke_limiter import PokeLimiter
+
+if TYPE_CHECKING:
+    from .poke_pool import PokeReplyPool
 
 class PokeHandler:
     """
@@ -33,6 +41,67 @@ class PokeHandler:
         self.state_manager = state_manager
         self.reply_engine = reply_engine
         self.persistence = persistence
+        self.poke_pool: "PokeReplyPool" = None # (v11.19) 由 main.py 注入
+        self.limiter = PokeLimiter(config) # (v11.20)
+
+        # (v11.19) 统计
+        self.full_path_active = 0
+
+    def set_poke_pool(self, poke_pool: "PokeReplyPool"):
+        """(v11.19) 注入戳一戳回复池"""
+        self.poke_pool = poke_pool
+
+    def _in_active_conversation(self, chat_id: str, sender_id: str) -> bool:
+        """
+        (v11.19) 是否正在与该用户对话：
+        机器人在窗口期内在该群回复过，且 (启用画像时) 该用户在窗口期内发过言
+        """
+        window = self.config.poke_active_window_seconds
+        now = time.time()
+        chat_state = self.state_manager.chat_states.get(chat_id)
+        if not chat_state or now - chat_state.last_reply_time > window:
+            return False
+        if self.config.enable_user_profiles:
+            user_id = str(sender_id)
+            if user_id not in self.state_manager.user_profiles:
+                return False
+            return now - self.state_manager.user_profiles[user_id].last_seen <= window
+        return True
+
+    async def _reply_from_pool(self, event: AstrMessageEvent, chat_id: str, sender_name: str, poke_count: int) -> bool:
+        """
+        (v11.19) 从回复池直接回复 (不经过判断 / 主 LLM)
+        画像 / 状态更新与历史记录与完整流程一致；返回是否已回复
+        """
+        reply_text = await self.poke_pool.pick(chat_id, sender_name)
+        if not reply_text:
+            return False
+
+        logger.info(f"🔥 [群聊] 心流触发回复 (Poke：回复池)")
+        await event.send(event.plain_result(reply_text))
+
+        # 与完整流程 (main.on_poke 3.4) 一致：先更新发送者画像 (昵称 / last_seen)，再更新互动状态
+        if self.config.enable_user_profiles:
+            self.state_manager.update_user_profile(event)
+        poke_judge_result = JudgeResult(should_reply=True, reasoning="Poke Event")
+        self.state_manager._update_active_state(event, poke_judge_result)
+
+        await self.persistence.save_history_message(
+            chat_id, "user", f"[{sender_name} {PromptBuilder.format_poke_action(poke_count)}]",
+            self.reply_engine.bot_name, sender_name=sender_name
+        )
+        await self.persistence.save_history_message(
+            chat_id, "assistant", reply_text, self.reply_engine.bot_name
+        )
+        await self.reply_engine._send_meme(event, reply_text, 100) # 与完整流程一致：Poke 必发表情
+        return True
+
+    def get_stats_str(self) -> str:
+        """(v11.19) 供 /heartcore 状态报告使用"""
+        lines = [self.limiter.get_stats_str()]
+        if self.poke_pool:
+            lines.append(f"{self.poke_pool.get_stats_str()} | 对话中走完整流程 {self.full_path_active} 次")
+        return "\n".join(lines)
 
     @event_filter.event_message_type(event_filter.EventMessageType.ALL)
     async def on_poke(self, event: AstrMessageEvent):
@@ -68,6 +137,15 @@ class PokeHandler:
             logger.debug(f"戳一戳来自黑名单 {sender_id}，忽略。")
             return
         
+        # (v11.20) 合并 / 限流：被合并或超出频率的戳一戳在此直接返回 (安静时的戳一戳立即处理，连续戳一戳等待合并窗口)
+        poke_count = await self.limiter.admit(chat_id, str(sender_id))
+        if poke_count == 0:
+            logger.debug(f"戳一戳来自 {sender_id}，已合并或限流丢弃。")
+            return
+        if poke_count > 1:
+            logger.info(f"🔥 [群聊] 合并了 {sender_id} 的 {poke_count} 次戳一戳。")
+        event.set_extra("heartflow_poke_count", poke_count)
+
         # 4. 获取发送者名称
         sender_name = event.get_sender_name() or sender_id
         
@@ -91,7 +169,7 @@ class PokeHandler:
                 reply_placeholder = "[反戳失败]"
 
             poke_judge_result = JudgeResult(should_reply=True, reasoning="Poke Event") #
-            user_poke_text = f"[{sender_name} 戳了你一下]"
+            user_poke_text = f"[{sender_name} {PromptBuilder.format_poke_action(poke_count)}]"
             
             self.state_manager._update_active_state(event, poke_judge_result) #
             
@@ -108,6 +186,15 @@ class PokeHandler:
             
         else:
             # --- 分支 A (50%)：文本回复 (v8 修复) ---
+
+            # (v11.19) 未在对话中：优先从回复池直接回复
+            if self.poke_pool and self.poke_pool.enabled:
+                if self._in_active_conversation(chat_id, sender_id):
+                    self.full_path_active += 1
+                elif await self._reply_from_pool(event, chat_id, sender_name, poke_count):
+                    event.stop_event()
+                    return
+
             logger.info(f"🔥 [群聊] 心流触发回复 (Poke：转交标准流，添加奖励分)") #
             
             # ！！！ v8 修复：设置奖励分和标记 ！！！
@@ -0,0 +1,102 @@
+# heartflow/features/poke_limiter.py
+# (新) v11.20 戳一戳风暴合并 & 限流
+# 职责：按 (群聊, 用户) 合并短时间内的连续戳一戳，并以滑动窗口限制处理频率
+#       被合并 / 丢弃的戳一戳在任何 API / LLM 调用之前返回
+# (v11.20 修复 - 安静时的第一次戳一戳立即处理，只合并紧随其后的连续戳一戳)
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from ..config import HeartflowConfig
+
+# 滑动窗口 / 最近戳一戳记录超过此数量时，顺带清理已过期的 (群聊, 用户)
+WINDOW_SWEEP_THRESHOLD = 1024
+
+
+class PokeLimiter:
+    """
+    (v11.20) 戳一戳合并器 + 滑动窗口限流器
+    - 合并：安静时 (距该用户上一次戳一戳超过 poke_coalesce_window_seconds) 的戳一戳立即处理；
+            窗口内紧接着到来的戳一戳开启合并，等待一个窗口，期间的后续戳一戳只累加次数，
+            最后作为一次“戳了你N下”处理
+    - 限流：每 (群聊, 用户) 在 poke_rate_limit_window_seconds 内最多处理
+            poke_rate_limit_count 次 (合并后的次数)，超出的直接丢弃
+    """
+
+    def __init__(self, config: HeartflowConfig):
+        self.config = config
+        self._windows: Dict[Tuple[str, str], Deque[float]] = {}
+        self._pending: Dict[Tuple[str, str], List[int]] = {} # 合并中的 (群聊, 用户) -> [累计次数]
+        self._last_poke: Dict[Tuple[str, str], float] = {}   # (群聊, 用户) -> 上一次 (未被合并的) 戳一戳时间
+
+        # 统计
+        self.admitted = 0
+        self.merged = 0
+        self.dropped = 0
+
+    async def admit(self, chat_id: str, user_id: str) -> int:
+        """
+        返回本次应处理的戳一戳次数；0 表示已被合并或限流丢弃，调用方直接返回即可
+        (安静时的戳一戳立即返回 1；紧随其后的戳一戳会在此等待合并窗口结束)
+        """
+        key = (chat_id, user_id)
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending[0] += 1
+            self.merged += 1
+            return 0
+
+        now = time.monotonic()
+        window = self.config.poke_coalesce_window_seconds
+        last = self._last_poke.get(key)
+        if len(self._last_poke) >= WINDOW_SWEEP_THRESHOLD:
+            self._sweep_last_poke(now - max(window, 0.0))
+        self._last_poke[key] = now
+
+        if not self._allow(key, now):
+            self.dropped += 1
+            return 0
+
+        if window <= 0 or last is None or now - last > window:
+            self.admitted += 1
+            return 1
+
+        holder = [1]
+        self._pending[key] = holder
+        try:
+            await asyncio.sleep(window)
+        finally:
+            self._pending.pop(key, None)
+            self._last_poke[key] = time.monotonic() # 合并期间的连续戳一戳视为同一阵，窗口从合并结束时重新计算
+        self.admitted += 1
+        return holder[0]
+
+    def _allow(self, key: Tuple[str, str], now: float) -> bool:
+        limit = self.config.poke_rate_limit_count
+        if limit <= 0:
+            return True
+        horizon = now - self.config.poke_rate_limit_window_seconds
+        times = self._windows.get(key)
+        if times is None:
+            if len(self._windows) >= WINDOW_SWEEP_THRESHOLD:
+                self._sweep(horizon)
+            times = self._windows[key] = deque()
+        while times and times[0] <= horizon:
+            times.popleft()
+        if len(times) >= limit:
+            return False
+        times.append(now)
+        return True
+
+    def _sweep(self, horizon: float):
+        for key in [k for k, times in self._windows.items() if not times or times[-1] <= horizon]:
+            del self._windows[key]
+
+    def _sweep_last_poke(self, horizon: float):
+        for key in [k for k, last in self._last_poke.items() if last < horizon and k not in self._pending]:
+            del self._last_poke[key]
+
+    def get_stats_str(self) -> str:
+        """供 /heartcore 状态报告使用"""
+        return f"- 戳一戳限流: 处理 {self.admitted} 次 | 合并 {self.merged} 次 | 限流丢弃 {self.dropped} 次"
@@ -0,0 +1,194 @@
+# heartflow/features/poke_pool.py
+# (新) v11.19 戳一戳回复池
+# 职责：按人格 (persona key) 在后台预先生成 K 条戳一戳回复
+#       - 被戳时直接随机取用 (不移除)，无需判断模型和主 LLM
+#       - 后台逐步替换被使用过的回复，保持新鲜感
+#       - 池内容持久化到 data/heartflow_poke_pool.json，重启后继续使用
+import asyncio
+import random
+from typing import TYPE_CHECKING, Any, Dict, List
+from astrbot.api import logger
+from astrbot.api.star import Context
+
+# (使用相对路径导入 v4.0 模块)
+from ..config import HeartflowConfig
+from ..persistence import PersistenceManager
+from ..utils.api_utils import elastic_json_chat
+
+if TYPE_CHECKING:
+    from ..utils.prompt_builder import PromptBuilder
+    from ..utils.scheduler import HousekeepingScheduler
+    from .persona_summarizer import PersonaSummarizer
+
+# 后台补充 / 替换的间隔 (每次每个人格最多替换一条用过的回复)
+POKE_POOL_REFRESH_INTERVAL_SECONDS = 600
+# 池变更后延迟保存的秒数
+POKE_POOL_SAVE_DELAY_SECONDS = 30
+# 回复中指代戳人者的占位符
+NAME_PLACEHOLDER = "{name}"
+
+
+class PokeReplyPool:
+    """
+    (v11.19) 戳一戳回复池
+    结构：persona_key -> [{"text": 回复, "uses": 使用次数}, ...]
+    """
+
+    def __init__(self,
+                 context: Context,
+                 config: HeartflowConfig,
+                 persistence: PersistenceManager,
+                 prompt_builder: "PromptBuilder",
+                 persona_summarizer: "PersonaSummarizer"
+                 ):
+        self.context = context
+        self.config = config
+        self.persistence = persistence
+        self.prompt_builder = prompt_builder
+        self.persona_summarizer = persona_summarizer
+        self.pools: Dict[str, List[Dict[str, Any]]] = {}
+        self._last_served: Dict[str, str] = {} # persona_key -> 上一次发送的回复 (避免连续重复)
+        self.scheduler: "HousekeepingScheduler" = None
+        self._refreshing = False
+
+        # 统计
+        self.served = 0
+        self.misses = 0
+        self.generated = 0
+        self.replaced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.poke_reply_pool_size > 0
+
+    # --- 生命周期 ---
+
+    def load_dict(self, data: Dict[str, Any]):
+        """由 main.py 在启动时注入磁盘数据"""
+        for persona_key, entries in (data or {}).items():
+            if not isinstance(entries, list):
+                continue
+            self.pools[persona_key] = [
+                {"text": e["text"], "uses": int(e.get("uses", 0))}
+                for e in entries if isinstance(e, dict) and isinstance(e.get("text"), str) and e["text"]
+            ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: [dict(e) for e in entries] for key, entries in self.pools.items()}
+
+    def register(self, scheduler: "HousekeepingScheduler"):
+        """注册后台补充任务 (main.py 在启动完成后调用)；启动后尽快补充一次"""
+        self.scheduler = scheduler
+        if not self.enabled:
+            return
+        scheduler.schedule_every(
+            "poke_pool_refresh", POKE_POOL_REFRESH_INTERVAL_SECONDS, self.refresh,
+            jitter=POKE_POOL_REFRESH_INTERVAL_SECONDS * 0.1, first_delay=60
+        )
+
+    # --- 取用 ---
+
+    async def pick(self, chat_id: str, sender_name: str) -> str | None:
+        """
+        为群聊当前人格随机取一条回复 (不与上一条相同)，并替换 {name}
+        池为空时返回 None；同时登记该人格，后台补充时会为其生成
+        """
+        if not self.enabled:
+            return None
+        persona_key, _summary = await self.prompt_builder._get_persona_key_and_summary(chat_id)
+        if persona_key == "error":
+            return None
+        entries = self.pools.setdefault(persona_key, [])
+        last = self._last_served.get(persona_key)
+        candidates = [e for e in entries if e["text"] != last] or entries
+        if not candidates:
+            self.misses += 1
+            return None
+
+        entry = random.choice(candidates)
+        entry["uses"] += 1
+        self._last_served[persona_key] = entry["text"]
+        self.served += 1
+        self._request_save()
+        return entry["text"].replace(NAME_PLACEHOLDER, sender_name)
+
+    # --- 补充 / 替换 ---
+
+    async def refresh(self):
+        """
+        调度器回调：
+        - 回复数不足 K 的人格：一次补齐
+        - 已满的人格：替换使用次数最多的一条 (没有被用过的回复时不调用 LLM)
+        """
+        if self._refreshing or not self.config.general_pool:
+            return
+        self._refreshing = True
+        try:
+            for persona_key, entries in list(self.pools.items()):
+                summarized_prompt = self.persona_summarizer.get_cached_summary(persona_key)
+                if not summarized_prompt:
+                    continue # 人格摘要尚未生成
+                missing = self.config.poke_reply_pool_size - len(entries)
+                if missing > 0:
+                    await self._generate(persona_key, entries, summarized_prompt, missing)
+                    continue
+                most_used = max(entries, key=lambda e: e["uses"])
+                if most_used["uses"] > 0 and await self._generate(persona_key, entries, summarized_prompt, 1):
+                    entries.remove(most_used)
+                    self.replaced += 1
+        finally:
+            self._refreshing = False
+
+    async def _generate(self, persona_key: str, entries: List[Dict[str, Any]], summarized_prompt: str, count: int) -> int:
+        """生成 count 条新回复追加到 entries，返回实际追加的条数"""
+        pool_prompt = self.prompt_builder.build_poke_pool_prompt(count, [e["text"] for e in entries])
+        data = await elastic_json_chat(
+            self.context,
+            self.config.general_pool,
+            pool_prompt,
+            max_retries=1,
+            system_prompt=summarized_prompt # 将人格放入 system_prompt
+        )
+        replies = data.get("replies") if isinstance(data, dict) else None
+        if not isinstance(replies, list):
+            logger.warning(f"戳一戳回复池：人格 {persona_key} 补充失败 (未得到有效 JSON)。")
+            return 0
+
+        existing = {e["text"] for e in entries}
+        added = 0
+        for reply in replies:
+            if not isinstance(reply, str) or not reply.strip() or reply.strip() in existing:
+                continue
+            entries.append({"text": reply.strip(), "uses": 0})
+            existing.add(reply.strip())
+            added += 1
+            if added >= count:
+                break
+
+        if added:
+            self.generated += added
+            self._request_save()
+            logger.debug(f"戳一戳回复池：人格 {persona_key} 新增 {added} 条回复 (现有 {len(entries)} 条)。")
+        return added
+
+    # --- 保存 ---
+
+    def _request_save(self):
+        """延迟合并保存 (调度器未就绪时直接跳过，下次变更时再保存)"""
+        if self.scheduler is None:
+            return
+        self.scheduler.schedule_once("poke_pool_save", POKE_POOL_SAVE_DELAY_SECONDS, self._save_async, replace=False)
+
+    async def _save_async(self):
+        snapshot = self.to_dict()
+        await asyncio.to_thread(self.persistence.save_poke_pool, snapshot)
+
+    # --- 统计 ---
+
+    def get_stats_str(self) -> str:
+        """供 /heartcore 状态报告使用"""
+        ready = sum(len(entries) for entries in self.pools.values())
+        return (
+            f"- 戳一戳回复池: {len(self.pools)} 个人格 / {ready} 条 | 直接回复 {self.served} 次 (池空 {self.misses} 次) | "
+            f"已生成 {self.generated} / 替换 {self.replaced}"
+        )
@@ -1,8 +1,20 @@
 # heartflow/features/proactive_task.py
 # (v4.3.7 修复 - 添加缺失的 LLM 调用)
 # (BUG 12/13 统一重构 - 导入 api_utils)
+# (v11.8 性能 - 候选群聊扫描读取 StateManager 快照)
+# (v11.12 性能 - 衰减改为读取时结算，本任务不再逐群/逐用户执行衰减)
+# (v11.14 性能 - 按各群聊最早可触发时间排序的最小堆，精确休眠，不再定时全量扫描)
+# (v11.15 性能 - 多个群聊的话题生成有界并发，全局冷却改为发送限速)
+# (v11.15 修复 - 取得发送时机后重新确认触发条件，生成期间已有新消息 / 被删除的群聊放弃发送)
+# (v11.16 性能 - 恢复判断 + 思路 + 开场白合并为单次 JSON 调用，解析失败回退分步流程)
+# (v11.17 性能 - 恢复话题判断按历史哈希缓存，历史未变化时不再询问 LLM)
+# (v11.18 性能 - 优先从按人格预生成的话题池取用开场白)
 import asyncio
+import hashlib
+import heapq
+import time
 import json
+from typing import TYPE_CHECKING, Dict, List, Tuple
 from astrbot.api import logger
 from astrbot.api.star import Context
 from astrbot.api.event import MessageChain
@@ -11,10 +23,15 @@ from json.decoder import JSONDecodeError
 # (使用相对路径导入 v4.0 模块)
 from ..config import HeartflowConfig
 from ..core.state_manager import StateManager
+from ..core.decay import PASSIVE_ENERGY_CAP, PASSIVE_ENERGY_SILENCE_SECONDS
+from ..datamodels import ChatState
 from ..utils.prompt_builder import PromptBuilder
 from ..features.persona_summarizer import PersonaSummarizer
 # --- (BUG 12/13 重构) ---
-from ..utils.api_utils import elastic_simple_text_chat
+from ..utils.api_utils import elastic_simple_text_chat, elastic_json_chat
+
+if TYPE_CHECKING:
+    from .topic_pool import ProactiveTopicPool
 
 class ProactiveTask:
     """
@@ -34,186 +51,473 @@ class ProactiveTask:
         self.prompt_builder = prompt_builder
         self.persona_summarizer = persona_summarizer
 
+        # (v11.14) 按“最早可能触发时间”排序的最小堆 (惰性删除：以 _due 中的时间为准)
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}
+        self._pending: set = set() # 状态有变化、等待重新计算触发时间的群聊
+        self._wakeup = asyncio.Event()
+        self._retry_after: Dict[str, float] = {} # 生成失败的群聊，在此时间之前不再尝试
+        self.state_manager.add_state_listener(self.on_state_changed)
+
+        # (v11.15) 并发生成：进行中的群聊 -> Task；发送限速
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._send_lock = asyncio.Lock()
+        self._next_send_time = 0.0
+
+        # (v11.15) 统计 (一轮 = 从空闲开始处理到进行中的群聊全部完成)
+        self._cycle_started = 0
+        self._cycle_sent = 0
+        self.total_started = 0
+        self.total_sent = 0
+        self.single_call_fallbacks = 0 # (v11.16) 单次调用解析失败、回退分步流程的次数
+
+        # (v11.17) 恢复话题判断缓存：chat_id -> (历史哈希, 要接续的话题 或 None)
+        self._resume_memo: Dict[str, Tuple[str, str | None]] = {}
+        self.resume_memo_hits = 0
+        self.resume_llm_calls = 0
+
+        self.topic_pool: "ProactiveTopicPool" = None # (v11.18) 由 main.py 注入
+        self.pool_sends = 0
+
+    def set_topic_pool(self, topic_pool: "ProactiveTopicPool"):
+        """(v11.18) 注入主动话题预生成池"""
+        self.topic_pool = topic_pool
+
+    # --- (v11.14) 触发时间计算 & 堆维护 ---
+
+    def on_state_changed(self, chat_id: str):
+        """
+        (v11.14) StateManager 回调：群聊状态被修改 / 删除
+        只登记，由任务循环在下一次唤醒时统一重新计算 (此时修改已完成)
+        """
+        self._pending.add(chat_id)
+        self._wakeup.set()
+
+    def _next_eligible_time(self, chat_state: ChatState, now: float) -> float | None:
+        """
+        (v11.14) 该群聊最早满足主动冒泡条件的时间 (None = 仅凭时间流逝永远不会满足)
+        条件与 v4.1 一致：精力 > 阈值 且 沉默 > 阈值 且 曾经回复过 (BUG 4)
+        精力按 (R1) 被动恢复的闭式公式推算
+        """
+        if chat_state.last_reply_time == 0:
+            return None
+        silence_due = chat_state.last_reply_time + self.config.proactive_silence_threshold_minutes * 60
+
+        energy_threshold = self.config.proactive_energy_threshold
+        energy = self.state_manager.project_chat_state(chat_state, now).energy
+        if energy > energy_threshold:
+            energy_due = now
+        else:
+            rate = self.config.energy_passive_recovery_per_hour / 3600
+            if energy_threshold >= PASSIVE_ENERGY_CAP or rate <= 0:
+                return None # 被动恢复到不了阈值，只能等消息 (每日重置) 改变状态
+            recovery_start = max(now, chat_state.last_reply_time + PASSIVE_ENERGY_SILENCE_SECONDS)
+            energy_due = recovery_start + (energy_threshold - energy) / rate + 1 # +1s 保证严格大于阈值
+        return max(silence_due, energy_due)
+
+    def _reschedule(self, chat_id: str, now: float, not_before: float = 0.0):
+        """(v11.14) 重新计算单个群聊的触发时间并入堆 (O(log n))"""
+        if chat_id in self._inflight:
+            return # (v11.15) 进行中的群聊在完成后统一重新排期
+        chat_state = self.state_manager.get_chat_state_readonly(chat_id)
+        due = None
+        if chat_state and not (self.config.whitelist_enabled and chat_id not in self.config.chat_whitelist): #
+            due = self._next_eligible_time(chat_state, now)
+        if due is None:
+            self._due.pop(chat_id, None)
+            return
+        due = max(due, not_before, self._retry_after.get(chat_id, 0.0))
+        if self._due.get(chat_id) != due:
+            self._due[chat_id] = due
+            heapq.heappush(self._heap, (due, chat_id))
+
+    def _rebuild(self):
+        """(v11.14) 启动时全量建堆 (唯一一次 O(n) 扫描)"""
+        now = time.time()
+        self._heap.clear()
+        self._due.clear()
+        self._pending.clear()
+        for chat_id in list(self.state_manager.get_all_states().keys()):
+            self._reschedule(chat_id, now)
+        logger.debug(f"心流：主动话题调度堆已建立，候选群聊 {len(self._due)} 个。")
+
+    def _drain_pending(self, now: float):
+        pending, self._pending = self._pending, set()
+        for chat_id in pending:
+            self._reschedule(chat_id, now)
+
+    def _pop_due(self, now: float) -> str | None:
+        """弹出一个已到期的群聊 (跳过过期的堆条目)"""
+        while self._heap:
+            due, chat_id = self._heap[0]
+            if self._due.get(chat_id) != due:
+                heapq.heappop(self._heap) # 已被更新或移除
+                continue
+            if due > now:
+                return None
+            heapq.heappop(self._heap)
+            del self._due[chat_id]
+            self._retry_after.pop(chat_id, None)
+            return chat_id
+        return None
+
+    def _seconds_until_next(self, now: float) -> float | None:
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return max(0.0, self._heap[0][0] - now) if self._heap else None
+
+    async def _wait(self, timeout: float | None):
+        """休眠到下一个群聊到期，或有状态变化"""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
     async def run_task(self):
         """
         (v4.3.7 修复 Bug) v4.1 后台任务
         (BUG 3 & 4 修复)
         (BUG 12/13 重构: API 弹性)
+        (v11.14) 不再每隔 proactive_check_interval_seconds 扫描全部群聊：
+                 精确休眠到堆顶群聊的触发时间，状态变化时只重新计算该群聊
         """
         logger.info("💖 心流：主动话题任务已启动。")
+        self._rebuild()
         while True:
             try:
-                check_interval = self.config.proactive_check_interval_seconds #
-                await asyncio.sleep(max(30, check_interval))
-                
                 if not self.config.enable_heartflow or not self.config.proactive_enabled: #
+                    await self._wait(max(30, self.config.proactive_check_interval_seconds))
                     continue
 
-                energy_threshold = self.config.proactive_energy_threshold #
-                silence_threshold = self.config.proactive_silence_threshold_minutes #
-                global_cooldown = self.config.proactive_global_cooldown_seconds #
+                now = time.time()
+                self._drain_pending(now)
+                # (v11.15) 并发已满时等待任一群聊完成 (完成时会唤醒)
+                if len(self._inflight) >= max(1, self.config.proactive_max_concurrency):
+                    await self._wait(None)
+                    continue
+                chat_id = self._pop_due(now)
+                if chat_id is None:
+                    await self._wait(self._seconds_until_next(now))
+                    continue
+
+                # (BUG 3 修复) 
+                # 必须使用只读 getter，防止 /重载心流 竞争
+                chat_state = self.state_manager.get_chat_state_readonly(chat_id) #
+                if not chat_state: #
+                    continue #
+                # (v11.12) 按当前时间结算精力恢复后再判断 (副本，不修改实时状态)
+                chat_state = self.state_manager.project_chat_state(chat_state, now)
                 
-                # (v4.0) 从 StateManager 获取状态
-                chat_ids = list(self.state_manager.get_all_states().keys()) #
+                # (BUG 3 & 4 修复) 
+                # 不再调用 _get_minutes_since_last_reply (因为它会创建状态)
+                # 而是从已安全获取的 chat_state 手动计算
+                minutes_silent = (now - chat_state.last_reply_time) / 60
                 
-                # (v4.2) 仅在有群聊时才记录
-                if chat_ids:
-                    logger.debug(f"心流：执行后台任务检查，目标群聊 {len(chat_ids)} 个。") #
-
-                for chat_id in chat_ids:
-                    # --- ！！！ v4.2 (F3) 新增：情绪衰减 ！！！ ---
-                    # (BUG 3 修复) _apply_passive_decay 已被修改为只读，此调用是安全的
-                    self.state_manager._apply_passive_decay(chat_id) #
-                    
-                    # (v4.1 逻辑) 检查是否需要 *主动发起话题*
-                    if not self.config.proactive_enabled: #
-                        continue
-                        
-                    if self.config.whitelist_enabled and chat_id not in self.config.chat_whitelist: #
-                        continue
-                    
-                    # (BUG 3 修复) 
-                    # 必须使用只读 getter，防止 /重载心流 竞争
-                    chat_state = self.state_manager.get_chat_state_readonly(chat_id) #
-                    
-                    # 如果状态不存在（刚被 /重载心流 删除），则跳过
-                    if not chat_state: #
-                        continue #
-                    
-                    # (BUG 3 & 4 修复) 
-                    # 不再调用 _get_minutes_since_last_reply (因为它会创建状态)
-                    # 而是从已安全获取的 chat_state 手动计算
-                    minutes_silent = 999
-                    if chat_state.last_reply_time != 0:
-                        minutes_silent = (time.time() - chat_state.last_reply_time) / 60
-                    # (修复结束)
-                    
-                    # (BUG 4 修复) 
-                    # 增加 `and minutes_silent != 999`
-                    # 防止在新群聊 (返回 999) 且初始精力高时立即触发
-                    if (chat_state.energy > energy_threshold and 
-                        minutes_silent > silence_threshold and 
-                        minutes_silent != 999): #
-                        
-                        logger.info(f"[群聊] 心流：{chat_id[:20]}... 满足主动冒泡条件。") #
-                        
-                        original_prompt = await self.prompt_builder._get_persona_system_prompt_by_umo(chat_id) #
-                        summarized_prompt = await self.persona_summarizer.get_or_create_summary(chat_id, original_prompt) #
-                        
-                        topic_idea_text = None #
-
-                        # --- (v3.0) 尝试恢复旧话题 (Feature 5) ---
-                        try:
-                            resume_prompt = await self.prompt_builder.build_resume_topic_prompt(chat_id) #
-                            
-                            if resume_prompt:
-                                # (v4.1.1 修复) 获取 Provider
-                                provider_name = self.config.summarize_provider_name or \
-                                                (self.config.general_pool[0] if self.config.general_pool else \
-                                                (self.config.judge_provider_names[0] if self.config.judge_provider_names else None)) #
-                                
-                                if not provider_name:
-                                    raise Exception("未配置任何可用于恢复话题的模型 (Specific/General/Judge)") #
-                                
-                                provider = self.context.get_provider_by_id(provider_name) #
-                                if not provider:
-                                    raise Exception(f"未找到模型: {provider_name}") #
-                                
-                                # (v4.1.1 修复) JSON 重试
-                                max_retries = 2
-                                for attempt in range(max_retries + 1):
-                                    try:
-                                        # ！！！ v4.3.8 修复：恢复话题不需要 system_prompt ！！！
-                                        llm_resp = await provider.text_chat(prompt=resume_prompt, contexts=[], system_prompt="") #
-                                        content = llm_resp.completion_text.strip()
-                                        if content.startswith("```json"): content = content[7:-3].strip()
-                                        elif content.startswith("```"): content = content[3:-3].strip()
-                                        
-                                        data = json.loads(content) #
-                                        
-                                        if data.get("is_interesting") and data.get("was_interrupted") and data.get("topic_summary"):
-                                            topic_idea_text = f"继续我们之前聊到的 “{data.get('topic_summary')}”" #
-                                        
-                                        break # 成功，跳出重试
-                                    
-                                    except (json.JSONDecodeError, JSONDecodeError) as e: #
-                                        logger.warning(f"恢复话题 JSON 解析失败 (尝试 {attempt + 1}/{max_retries + 1}): {e}") #
-                                        if attempt == max_retries:
-                                            raise # 重试失败，抛出异常
-                        except Exception as e:
-                            logger.warning(f"心流：尝试恢复旧话题失败: {e}，将生成新话题。") #
-                        # --- 恢复旧话题结束 ---
-                        
-                        opening_line_text = None #
-
-                        # --- (BUG 12/13 重构：弹性生成新话题) ---
-                        
-                        # 1. (BUG 12) 构建弹性模型列表 (Summarize -> General -> Judge)
-                        providers_to_try = []
-                        if self.config.summarize_provider_name: #
-                            providers_to_try.append(self.config.summarize_provider_name)
-                        if self.config.general_pool: #
-                            providers_to_try.extend(self.config.general_pool)
-                        if self.config.judge_provider_names: #
-                            providers_to_try.extend(self.config.judge_provider_names)
-                        
-                        if not providers_to_try:
-                             logger.error("主动话题：未配置任何可用于生成话题的模型。")
-                             continue
-                        # --- (修复结束) ---
-
-                        if not topic_idea_text: #
-                            logger.info("心流：生成新话题...") #
-                            
-                            # 2. (BUG 12) 构建“思路” Prompt
-                            topic_idea_prompt = self.prompt_builder.build_proactive_idea_prompt(summarized_prompt, int(minutes_silent)) #
- 
-                            # 3. (BUG 12/13 重构) 【弹性调用 LLM 1】获取“思路”
-                            topic_idea_text = await elastic_simple_text_chat(
-                                self.context,
-                                providers_to_try,
-                                topic_idea_prompt,
-                                system_prompt=summarized_prompt # 将人格放入 system_prompt
-                            )
-                            
-                            if not topic_idea_text:
-                                logger.warning(f"主动话题：LLM 1 (思路) 弹性调用列表 {providers_to_try} 均失败。")
-                                continue
-
-                        if topic_idea_text:
-                            # 5. (BUG 12) 构建“开场白” Prompt
-                            opening_line_prompt = self.prompt_builder.build_proactive_opening_prompt(summarized_prompt, topic_idea_text) #
-                            
-                            # 6. (BUG 12/13 重构) 【弹性调用 LLM 2】获取“开场白”
-                            opening_line_text = await elastic_simple_text_chat(
-                                self.context,
-                                providers_to_try,
-                                opening_line_prompt,
-                                system_prompt=summarized_prompt # 将人格放入 system_prompt
-                            )
-
-                            if not opening_line_text:
-                                logger.warning(f"主动话题：LLM 2 (开场白) 弹性调用列表 {providers_to_try} 均失败。")
-                                continue
-
-                            if opening_line_text:
-                                # 7. 发送主动消息
-                                message_chain = MessageChain().message(opening_line_text) #
-                                await self.context.send_message(chat_id, message_chain) #
-                                self.state_manager._consume_energy_for_proactive_reply(chat_id) #
-                                logger.info(f"💖 [群聊] 心流：已向 {chat_id[:20]}... 发送主动话题。") #
-                                await asyncio.sleep(global_cooldown) #
-                        # --- 修复结束 ---
-                
-                # --- ！！！ v4.2 (F1+M2) 新增：更新社交记忆 ！！！ ---
-                self.state_manager._update_relationship_tiers() #
+                # (v11.14) 出堆时再确认一次 (推算与实际的误差 / 配置变化)
+                if not (chat_state.energy > self.config.proactive_energy_threshold and
+                        minutes_silent > self.config.proactive_silence_threshold_minutes):
+                    self._reschedule(chat_id, now, not_before=now + 1)
+                    continue
+
+                # (v11.15) 交给工作协程，循环立即继续处理下一个到期的群聊
+                self._start_worker(chat_id, minutes_silent)
                                 
             except asyncio.CancelledError:
                 logger.info("💖 心流：主动话题任务被取消。") #
+                for task in self._inflight.values():
+                    task.cancel()
                 break
             except Exception as e:
                 logger.error(f"心流：主动话题任务异常: {e}") #
                 import traceback
                 logger.error(traceback.format_exc()) #
 
+    # --- (v11.15) 并发工作协程 & 发送限速 ---
+
+    def _start_worker(self, chat_id: str, minutes_silent: float):
+        if not self._inflight:
+            self._cycle_started = self._cycle_sent = 0 # 从空闲开始新的一轮
+        self._cycle_started += 1
+        self.total_started += 1
+        task = asyncio.create_task(self._run_proactive_for_chat(chat_id, minutes_silent))
+        self._inflight[chat_id] = task
+        task.add_done_callback(lambda t: self._on_worker_done(chat_id, t))
+
+    def _on_worker_done(self, chat_id: str, task: asyncio.Task):
+        self._inflight.pop(chat_id, None)
+        sent = False
+        if not task.cancelled():
+            if task.exception():
+                logger.error(f"心流：主动话题生成异常 ({chat_id[:20]}): {task.exception()}")
+            else:
+                sent = task.result()
+        now = time.time()
+        if sent:
+            self._cycle_sent += 1
+            self.total_sent += 1
+        else:
+            # 生成失败：与旧版轮询节奏一致，一个检查周期后重试
+            self._retry_after[chat_id] = now + max(30, self.config.proactive_check_interval_seconds)
+        self._pending.add(chat_id) # 发送后精力已消耗，重新排期
+        if not self._inflight:
+            logger.info(f"💖 心流：本轮主动话题完成，处理 {self._cycle_started} 个群聊，发送 {self._cycle_sent} 个。")
+        self._wakeup.set()
+
+    async def _wait_send_slot(self, chat_id: str) -> bool:
+        """
+        (v11.15) 全局冷却：任意两次主动发送之间至少间隔 proactive_global_cooldown_seconds
+        (旧版在循环中 sleep，会阻塞其他群聊的生成)
+        取得发送时机后重新确认触发条件，不满足时放弃发送且不占用冷却；返回是否可以发送
+        """
+        async with self._send_lock:
+            delay = self._next_send_time - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if not self._still_eligible(chat_id, time.time()):
+                return False
+            self._next_send_time = time.time() + self.config.proactive_global_cooldown_seconds #
+            return True
+
+    def _still_eligible(self, chat_id: str, now: float) -> bool:
+        """
+        (v11.15 修复) 生成与限速等待期间群聊可能已有新消息 (沉默时间重置、精力变化) 或被删除，
+        按出堆时相同的条件重新判断
+        """
+        chat_state = self.state_manager.get_chat_state_readonly(chat_id)
+        if not chat_state:
+            return False
+        chat_state = self.state_manager.project_chat_state(chat_state, now)
+        minutes_silent = (now - chat_state.last_reply_time) / 60
+        return (chat_state.energy > self.config.proactive_energy_threshold and
+                minutes_silent > self.config.proactive_silence_threshold_minutes)
+
+    def get_stats_str(self) -> str:
+        """供 /heartcore 状态报告使用"""
+        return (
+            f"- 主动话题: 候选 {len(self._due)} 个群聊 | 进行中 {len(self._inflight)} | "
+            f"累计处理 {self.total_started} 个 / 发送 {self.total_sent} 个 | 单次调用回退 {self.single_call_fallbacks} 次\n"
+            f"- 恢复话题判断: 缓存 {len(self._resume_memo)} 个群聊 | 历史未变复用 {self.resume_memo_hits} 次 | 分步 LLM 判断 {self.resume_llm_calls} 次"
+        ) + (f"\n{self.topic_pool.get_stats_str()} | 话题池发送 {self.pool_sends} 次" if self.topic_pool else "")
+
+    async def _run_proactive_for_chat(self, chat_id: str, minutes_silent: float) -> bool:
+        """
+        (v11.14 从 run_task 抽取) 为单个群聊生成并发送主动话题
+        返回是否已发送
+        """
+        logger.info(f"[群聊] 心流：{chat_id[:20]}... 满足主动冒泡条件。") #
+
+        # (v11.18) 同时取得人格 Key (话题池按人格划分) 与摘要
+        persona_key, summarized_prompt = await self.prompt_builder._get_persona_key_and_summary(chat_id) #
+
+        # 1. (BUG 12) 构建弹性模型列表 (Summarize -> General -> Judge)
+        providers_to_try = []
+        if self.config.summarize_provider_name: #
+            providers_to_try.append(self.config.summarize_provider_name)
+        if self.config.general_pool: #
+            providers_to_try.extend(self.config.general_pool)
+        if self.config.judge_provider_names: #
+            providers_to_try.extend(self.config.judge_provider_names)
+
+        if not providers_to_try:
+             logger.error("主动话题：未配置任何可用于生成话题的模型。")
+             return False
+
+        # --- (v11.17) 历史只读取一次；历史未变化时直接复用上次的恢复话题判断 ---
+        history_text = await self.prompt_builder.get_resume_history(chat_id)
+        history_digest = self._history_digest(history_text) if history_text else None
+        has_verdict, resume_topic = self._lookup_resume_memo(chat_id, history_digest)
+
+        # --- (v11.18) 已确认没有可接续的话题时 (无历史，或历史未变且上次判断为无话题)，
+        # 优先使用预生成的开场白 (无需 LLM)；历史有变化时先走下方的恢复话题判断 ---
+        if has_verdict and not resume_topic and self.topic_pool and persona_key != "error":
+            opening_line_text = self.topic_pool.draw(persona_key)
+            if opening_line_text:
+                logger.info(f"心流：使用话题池中预生成的开场白 (人格 {persona_key})。")
+                if not await self._send_opening(chat_id, opening_line_text):
+                    return False
+                self.pool_sends += 1
+                return True
+
+        # --- (v11.16) 单次调用：恢复判断 + 思路 + 开场白 一次生成，解析失败时回退分步流程 ---
+        if self.config.proactive_single_call:
+            combined_prompt = self.prompt_builder.build_proactive_combined_prompt(
+                int(minutes_silent),
+                recent_history_str=None if has_verdict else history_text,
+                resume_topic=resume_topic
+            )
+            result = await self._generate_single_call(combined_prompt, summarized_prompt, providers_to_try)
+            if result:
+                opening_line_text, resumed_topic = result
+                if history_digest and not has_verdict:
+                    self._resume_memo[chat_id] = (history_digest, resumed_topic)
+                if not await self._send_opening(chat_id, opening_line_text):
+                    return False
+                if resumed_topic:
+                    self._mark_resume_topic_used(chat_id, history_digest)
+                return True
+            self.single_call_fallbacks += 1
+            logger.warning("主动话题：单次调用未得到有效 JSON，回退到分步生成。")
+
+        topic_idea_text = None #
+
+        # --- (v3.0) 尝试恢复旧话题 (Feature 5) ---
+        if history_text and not has_verdict:
+            try:
+                resume_prompt = await self.prompt_builder.build_resume_topic_prompt(chat_id, history_text) #
+                resume_topic = await self._ask_resume_topic(resume_prompt)
+                self._resume_memo[chat_id] = (history_digest, resume_topic) # (v11.17) 只缓存成功的判断
+            except Exception as e:
+                logger.warning(f"心流：尝试恢复旧话题失败: {e}，将生成新话题。") #
+
+        if resume_topic:
+            topic_idea_text = f"继续我们之前聊到的 “{resume_topic}”" #
+        # --- 恢复旧话题结束 ---
+
+        opening_line_text = None #
+
+        # --- (BUG 12/13 重构：弹性生成新话题) ---
+
+        if not topic_idea_text: #
+            logger.info("心流：生成新话题...") #
+
+            # 2. (BUG 12) 构建“思路” Prompt
+            topic_idea_prompt = self.prompt_builder.build_proactive_idea_prompt(summarized_prompt, int(minutes_silent)) #
+
+            # 3. (BUG 12/13 重构) 【弹性调用 LLM 1】获取“思路”
+            topic_idea_text = await elastic_simple_text_chat(
+                self.context,
+                providers_to_try,
+                topic_idea_prompt,
+                system_prompt=summarized_prompt # 将人格放入 system_prompt
+            )
+
+            if not topic_idea_text:
+                logger.warning(f"主动话题：LLM 1 (思路) 弹性调用列表 {providers_to_try} 均失败。")
+                return False
+
+        if topic_idea_text:
+            # 5. (BUG 12) 构建“开场白” Prompt
+            opening_line_prompt = self.prompt_builder.build_proactive_opening_prompt(summarized_prompt, topic_idea_text) #
+
+            # 6. (BUG 12/13 重构) 【弹性调用 LLM 2】获取“开场白”
+            opening_line_text = await elastic_simple_text_chat(
+                self.context,
+                providers_to_try,
+                opening_line_prompt,
+                system_prompt=summarized_prompt # 将人格放入 system_prompt
+            )
+
+            if not opening_line_text:
+                logger.warning(f"主动话题：LLM 2 (开场白) 弹性调用列表 {providers_to_try} 均失败。")
+                return False
+
+            if opening_line_text:
+                # 7. 发送主动消息
+                if not await self._send_opening(chat_id, opening_line_text):
+                    return False
+                if resume_topic:
+                    self._mark_resume_topic_used(chat_id, history_digest)
+                return True
+        # --- 修复结束 ---
+        return False
+
+    async def _ask_resume_topic(self, resume_prompt: str) -> str | None:
+        """
+        (v3.0 Feature 5) 询问 LLM 历史中是否有被中断的有趣话题
+        返回话题总结 (没有则为 None)；模型缺失或 JSON 多次解析失败时抛出异常
+        """
+        # (v4.1.1 修复) 获取 Provider
+        provider_name = self.config.summarize_provider_name or \
+                        (self.config.general_pool[0] if self.config.general_pool else \
+                        (self.config.judge_provider_names[0] if self.config.judge_provider_names else None)) #
+
+        if not provider_name:
+            raise Exception("未配置任何可用于恢复话题的模型 (Specific/General/Judge)") #
+
+        provider = self.context.get_provider_by_id(provider_name) #
+        if not provider:
+            raise Exception(f"未找到模型: {provider_name}") #
+
+        self.resume_llm_calls += 1
+        # (v4.1.1 修复) JSON 重试
+        max_retries = 2
+        for attempt in range(max_retries + 1):
+            try:
+                # ！！！ v4.3.8 修复：恢复话题不需要 system_prompt ！！！
+                llm_resp = await provider.text_chat(prompt=resume_prompt, contexts=[], system_prompt="") #
+                content = llm_resp.completion_text.strip()
+                if content.startswith("```json"): content = content[7:-3].strip()
+                elif content.startswith("```"): content = content[3:-3].strip()
+
+                data = json.loads(content) #
+
+                if data.get("is_interesting") and data.get("was_interrupted") and data.get("topic_summary"):
+                    return data.get("topic_summary")
+                return None
+
+            except (json.JSONDecodeError, JSONDecodeError) as e: #
+                logger.warning(f"恢复话题 JSON 解析失败 (尝试 {attempt + 1}/{max_retries + 1}): {e}") #
+                if attempt == max_retries:
+                    raise # 重试失败，抛出异常
+
+    # --- (v11.17) 恢复话题判断缓存 ---
+
+    @staticmethod
+    def _history_digest(history_text: str) -> str:
+        return hashlib.sha1(history_text.encode("utf-8")).hexdigest()
+
+    def _lookup_resume_memo(self, chat_id: str, history_digest: str | None) -> Tuple[bool, str | None]:
+        """
+        返回 (是否已有判断, 要接续的话题)
+        无历史时视为“已判断、无可接续话题”，不需要 LLM
+        """
+        if history_digest is None:
+            return True, None
+        memo = self._resume_memo.get(chat_id)
+        if memo is not None and memo[0] == history_digest:
+            self.resume_memo_hits += 1
+            return True, memo[1]
+        return False, None
+
+    def _mark_resume_topic_used(self, chat_id: str, history_digest: str | None):
+        """话题已接续过：历史不变时不再重复接续同一话题"""
+        if history_digest:
+            self._resume_memo[chat_id] = (history_digest, None)
+
+    async def _generate_single_call(self, combined_prompt: str, summarized_prompt: str, providers_to_try: list) -> Tuple[str, str | None] | None:
+        """
+        (v11.16) 单次 JSON 调用生成 {resumed, topic, opening}
+        返回 (开场白, 接续的旧话题 或 None)；JSON 解析失败或缺少开场白时返回 None (由调用方回退到分步流程)
+        """
+        data = await elastic_json_chat(
+            self.context,
+            providers_to_try,
+            combined_prompt,
+            max_retries=0, # 解析失败直接回退分步流程，不在此重试
+            system_prompt=summarized_prompt # 将人格放入 system_prompt
+        )
+        if not isinstance(data, dict):
+            return None
+        opening = data.get("opening")
+        if not isinstance(opening, str) or not opening.strip():
+            return None
+        topic = data.get("topic")
+        if data.get("resumed"):
+            logger.info(f"心流：单次调用恢复旧话题 “{topic}”。")
+            return opening.strip(), (topic if isinstance(topic, str) and topic else "之前的话题")
+        logger.info(f"心流：单次调用生成新话题 “{topic}”。")
+        return opening.strip(), None
+
+    async def _send_opening(self, chat_id: str, opening_line_text: str) -> bool:
+        """发送主动开场白并消耗精力，返回是否已发送"""
+        if not await self._wait_send_slot(chat_id): # (v11.15) 全局发送限速
+            logger.info(f"心流：{chat_id[:20]}... 生成期间已不满足主动冒泡条件，放弃发送。")
+            return False
+        message_chain = MessageChain().message(opening_line_text) #
+        await self.context.send_message(chat_id, message_chain) #
+        self.state_manager._consume_energy_for_proactive_reply(chat_id) #
+        logger.info(f"💖 [群聊] 心流：已向 {chat_id[:20]}... 发送主动话题。") #
+        return True
+
     # --- (BUG 12/13 重构) 移除 _attempt_simple_text_chat ---
\ No newline at end of file
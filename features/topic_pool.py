@@ -0,0 +1,206 @@
+# heartflow/features/topic_pool.py
+# (新) v11.18 主动话题预生成池
+# 职责：按人格 (persona key) 预先生成若干条可直接发送的主动开场白
+#       - 群聊活动较少时由后台调度器使用通用小模型池补充
+#       - 主动话题触发时直接取用 (不重复)，无需调用 LLM
+#       - 池内容持久化到 data/heartflow_topic_pool.json，重启后继续使用
+import asyncio
+import time
+from typing import TYPE_CHECKING, Any, Dict, List
+from astrbot.api import logger
+from astrbot.api.star import Context
+
+# (使用相对路径导入 v4.0 模块)
+from ..config import HeartflowConfig
+from ..persistence import PersistenceManager
+from ..utils.api_utils import elastic_json_chat
+
+if TYPE_CHECKING:
+    from ..utils.prompt_builder import PromptBuilder
+    from ..utils.scheduler import HousekeepingScheduler
+    from .persona_summarizer import PersonaSummarizer
+
+# 后台检查 (并在空闲时补充) 的间隔
+TOPIC_POOL_REFILL_INTERVAL_SECONDS = 300
+# 池变更后延迟保存的秒数 (期间的多次变更合并为一次写盘)
+TOPIC_POOL_SAVE_DELAY_SECONDS = 10
+# 每个人格记住最近发送过的开场白条数 (补充时去重，并提示模型避开)
+RECENT_OPENERS_MAX = 30
+# 其中写入补充 Prompt 的条数
+RECENT_OPENERS_IN_PROMPT = 10
+
+
+class ProactiveTopicPool:
+    """
+    (v11.18) 主动话题预生成池
+    结构：persona_key -> {"openers": [待发送...], "recent": [最近已发送...]}
+    """
+
+    def __init__(self,
+                 context: Context,
+                 config: HeartflowConfig,
+                 persistence: PersistenceManager,
+                 prompt_builder: "PromptBuilder",
+                 persona_summarizer: "PersonaSummarizer"
+                 ):
+        self.context = context
+        self.config = config
+        self.persistence = persistence
+        self.prompt_builder = prompt_builder
+        self.persona_summarizer = persona_summarizer
+        self.pools: Dict[str, Dict[str, List[str]]] = {}
+        self.scheduler: "HousekeepingScheduler" = None
+
+        # 空闲判断：自上次检查以来收到的群聊消息数
+        self._activity = 0
+        self._activity_since = time.monotonic()
+        self._refilling = False
+
+        # 统计
+        self.drawn = 0
+        self.generated = 0
+        self.duplicates_dropped = 0
+        self.refills_skipped_busy = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.proactive_topic_pool_size > 0
+
+    # --- 生命周期 ---
+
+    def load_dict(self, data: Dict[str, Any]):
+        """由 main.py 在启动时注入磁盘数据"""
+        for persona_key, entry in (data or {}).items():
+            if not isinstance(entry, dict):
+                continue
+            self.pools[persona_key] = {
+                "openers": [o for o in entry.get("openers", []) if isinstance(o, str) and o],
+                "recent": [o for o in entry.get("recent", []) if isinstance(o, str) and o][-RECENT_OPENERS_MAX:],
+            }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: {"openers": list(entry["openers"]), "recent": list(entry["recent"])} for key, entry in self.pools.items()}
+
+    def register(self, scheduler: "HousekeepingScheduler"):
+        """注册后台补充任务 (main.py 在启动完成后调用)"""
+        self.scheduler = scheduler
+        if not self.enabled:
+            return
+        scheduler.schedule_every(
+            "topic_pool_refill", TOPIC_POOL_REFILL_INTERVAL_SECONDS, self.refill,
+            jitter=TOPIC_POOL_REFILL_INTERVAL_SECONDS * 0.1
+        )
+
+    def note_activity(self, chat_id: str):
+        """MessageHandler 每收到一条群聊消息调用一次：记录一次群聊活动"""
+        self._activity += 1
+
+    # --- 取用 ---
+
+    def draw(self, persona_key: str) -> str | None:
+        """
+        取出一条开场白 (取出即移除，并记入最近已发送)
+        池为空时返回 None；同时登记该人格，后台补充时会为其生成
+        """
+        if not self.enabled or not persona_key:
+            return None
+        entry = self.pools.setdefault(persona_key, {"openers": [], "recent": []})
+        if not entry["openers"]:
+            return None
+        opener = entry["openers"].pop(0)
+        entry["recent"].append(opener)
+        del entry["recent"][:-RECENT_OPENERS_MAX]
+        self.drawn += 1
+        self._request_save()
+        return opener
+
+    # --- 补充 ---
+
+    async def refill(self):
+        """调度器回调：仅在群聊活动较少时，为缺额的人格补充开场白"""
+        now = time.monotonic()
+        elapsed_min = max(1e-6, (now - self._activity_since) / 60)
+        rate = self._activity / elapsed_min
+        self._activity = 0
+        self._activity_since = now
+
+        if self._refilling or not self.config.general_pool:
+            return
+        if rate > self.config.proactive_topic_pool_idle_rate:
+            self.refills_skipped_busy += 1
+            logger.debug(f"主动话题池：群聊消息 {rate:.1f} 条/分钟，高于空闲阈值，跳过补充。")
+            return
+
+        self._refilling = True
+        try:
+            for persona_key, entry in list(self.pools.items()):
+                missing = self.config.proactive_topic_pool_size - len(entry["openers"])
+                if missing <= 0:
+                    continue
+                summarized_prompt = self.persona_summarizer.get_cached_summary(persona_key)
+                if not summarized_prompt:
+                    continue # 人格摘要尚未生成 (会在下一次主动话题时生成)
+                await self._fill_persona(persona_key, entry, summarized_prompt, missing)
+        finally:
+            self._refilling = False
+
+    async def _fill_persona(self, persona_key: str, entry: Dict[str, List[str]], summarized_prompt: str, count: int):
+        pool_prompt = self.prompt_builder.build_proactive_pool_prompt(count, entry["recent"][-RECENT_OPENERS_IN_PROMPT:])
+        data = await elastic_json_chat(
+            self.context,
+            self.config.general_pool,
+            pool_prompt,
+            max_retries=1,
+            system_prompt=summarized_prompt # 将人格放入 system_prompt
+        )
+        openers = data.get("openers") if isinstance(data, dict) else None
+        if not isinstance(openers, list):
+            logger.warning(f"主动话题池：人格 {persona_key} 补充失败 (未得到有效 JSON)。")
+            return
+
+        seen = {self._normalize(o) for o in entry["openers"] + entry["recent"]}
+        added = 0
+        for opener in openers:
+            if not isinstance(opener, str) or not opener.strip():
+                continue
+            key = self._normalize(opener)
+            if key in seen:
+                self.duplicates_dropped += 1
+                continue
+            seen.add(key)
+            entry["openers"].append(opener.strip())
+            added += 1
+            if added >= count:
+                break
+
+        if added:
+            self.generated += added
+            self._request_save()
+            logger.info(f"💖 主动话题池：人格 {persona_key} 补充 {added} 条开场白 (现有 {len(entry['openers'])} 条)。")
+
+    @staticmethod
+    def _normalize(opener: str) -> str:
+        """去重用：忽略空白与常见标点差异"""
+        return "".join(ch for ch in opener if ch.isalnum())
+
+    # --- 保存 ---
+
+    def _request_save(self):
+        """延迟合并保存 (调度器未就绪时直接跳过，下次变更时再保存)"""
+        if self.scheduler is None:
+            return
+        self.scheduler.schedule_once("topic_pool_save", TOPIC_POOL_SAVE_DELAY_SECONDS, self._save_async, replace=False)
+
+    async def _save_async(self):
+        snapshot = self.to_dict()
+        await asyncio.to_thread(self.persistence.save_topic_pool, snapshot)
+
+    # --- 统计 ---
+
+    def get_stats_str(self) -> str:
+        """供 /heartcore 状态报告使用"""
+        ready = sum(len(entry["openers"]) for entry in self.pools.values())
+        return (
+            f"- 主动话题池: {len(self.pools)} 个人格 / 待用 {ready} 条 | 已取用 {self.drawn} | "
+            f"已生成 {self.generated} (去重丢弃 {self.duplicates_dropped}) | 繁忙跳过补充 {self.refills_skipped_busy} 次"
+        )
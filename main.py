@@ -1,6 +1,12 @@
 # heartflow/main.py
 # (v4.0 重构 - 瘦身版)
+# (v11.0 性能 - 异步启动：状态/画像/缓存/表情包在线程池中并发加载)
+# (v11.13 性能 - 后台杂务统一由 HousekeepingScheduler 调度)
+# (v11.18 性能 - 主动话题预生成池)
+# (v11.19 性能 - 戳一戳回复池)
 import asyncio
+import time
+from astrbot.api import logger
 from astrbot.api.star import Context, Star, register
 from astrbot.core.config.astrbot_config import AstrBotConfig
 from astrbot.api.event import AstrMessageEvent, filter as event_filter
@@ -9,19 +15,29 @@ from astrbot.api.event import AstrMessageEvent, filter as event_filter
 from .config import HeartflowConfig
 from .datamodels import JudgeResult, ChatState, UserProfile
 from .persistence import PersistenceManager
+from .utils.image_cache import ImageDescriptionCache
 from .utils.prompt_builder import PromptBuilder
 from .utils.pre_filters import PreFilters
+from .utils.scheduler import HousekeepingScheduler
 from .core.state_manager import StateManager
 from .core.decision_engine import DecisionEngine
 from .core.reply_engine import ReplyEngine
 from .core.message_handler import MessageHandler
 from .features.proactive_task import ProactiveTask
+from .features.topic_pool import ProactiveTopicPool
+from .features.poke_pool import PokeReplyPool
 from .features.poke_handler import PokeHandler
 from .features.command_handler import CommandHandler
 from .features.persona_summarizer import PersonaSummarizer
+from .features.persistence_task import PersistenceTask
 # (v4.0) 导入 meme_init (其他 meme 模块在需要时被调用)
 from .meme_engine.meme_init import init_meme_storage
 
+# (v11.13) VL 缓存有变更时的定期保存间隔 (秒)
+VL_CACHE_SAVE_INTERVAL_SECONDS = 300
+# (v11.13) 批量结算驻留画像社交衰减的间隔 (秒)
+SOCIAL_DECAY_SETTLE_INTERVAL_SECONDS = 3600
+
 class HeartflowPlugin(Star):
     """
     (新) v4.0 插件主入口
@@ -41,15 +57,23 @@ class HeartflowPlugin(Star):
         self.persistence = PersistenceManager(context, self.config) #
         
         # (状态层)
-        self.state_manager = StateManager(
-            self.config,
-            self.persistence.load_states(), #
-            self.persistence.load_user_profiles() #
-        ) #
+        # (v11.0) 先以空状态实例化，磁盘数据由 _startup 在后台加载后注入
+        self.state_manager = StateManager(self.config, {}, {}) #
         
+        # (v11.13) 后台杂务调度器 (任务在 _startup 完成后注册并启动)
+        self.scheduler = HousekeepingScheduler()
+
         # (工具层)
         self.prompt_builder = PromptBuilder(context, self.config, self.state_manager) # ！！！v4.1 (Bug 1) 修复：必须先实例化
         self.pre_filters = PreFilters(self.config) #
+        
+        # (v11.1) VL 图片描述缓存 (磁盘数据由 _startup 异步加载)
+        self.image_cache = None
+        if self.config.enable_vl_cache:
+            self.image_cache = ImageDescriptionCache(
+                self.config.vl_cache_max_entries,
+                self.config.vl_cache_phash_max_entries # (v11.2)
+            )
 
         # (功能层)
         self.persona_summarizer = PersonaSummarizer(
@@ -70,10 +94,17 @@ class HeartflowPlugin(Star):
         
         self.message_handler = MessageHandler(
             self.config, self.state_manager, self.decision_engine, 
-            self.reply_engine, self.prompt_builder
+            self.reply_engine, self.prompt_builder,
+            self.image_cache # (v11.1)
         ) #
         
         # (特性处理器)
+        # (v11.18) 主动话题预生成池 (磁盘数据由 _startup 异步加载)
+        self.topic_pool = ProactiveTopicPool(
+            context, self.config, self.persistence,
+            self.prompt_builder, self.persona_summarizer
+        )
+
         self.proactive_task_handler = ProactiveTask(
             context, self.config, self.state_manager, 
             self.prompt_builder, self.persona_summarizer
@@ -84,28 +115,138 @@ class HeartflowPlugin(Star):
             context, self.config, self.state_manager, 
             self.reply_engine, self.persistence
         ) #
+
+        # (v11.19) 戳一戳回复池 (磁盘数据由 _startup 异步加载)
+        self.poke_pool = PokeReplyPool(
+            context, self.config, self.persistence,
+            self.prompt_builder, self.persona_summarizer
+        )
+        
+        # (v11.6) 定期增量刷写状态
+        self.persistence_task_handler = PersistenceTask(
+            self.config, self.state_manager, self.persistence
+        )
         
         self.command_handler = CommandHandler(
             context, self.config, self.state_manager, 
-            self.persona_summarizer, self.decision_engine
+            self.persona_summarizer, self.decision_engine,
+            self.image_cache, # (v11.1)
+            self.reply_engine, # (v11.5) 视觉去重统计
+            self.persistence_task_handler, # (v11.6) 状态刷写统计
+            self.scheduler, # (v11.13) 后台任务统计
+            self.proactive_task_handler, # (v11.15) 主动话题统计
+            self.poke_handler # (v11.19) 戳一戳统计
         ) #
         
         self.prompt_builder.set_persona_summarizer(self.persona_summarizer)
+        self.persona_summarizer.set_scheduler(self.scheduler) # (v11.13)
+        self.decision_engine.set_scheduler(self.scheduler) # (v11.13)
+        self.prompt_builder.set_image_cache(self.image_cache) # (v11.5)
+        self.proactive_task_handler.set_topic_pool(self.topic_pool) # (v11.18)
+        self.message_handler.set_topic_pool(self.topic_pool) # (v11.18) 群聊活动频率
+        self.poke_handler.set_poke_pool(self.poke_pool) # (v11.19)
         # --- 3. 异步启动 & 初始化 ---
         
+        # (v11.0) 就绪闸门：加载完成前到达的事件将等待 (超时则丢弃)
+        self._ready = asyncio.Event()
+        self.startup_timings: dict[str, float] = {}
+        self.proactive_task = None
+        self.scheduler_task = None # (v11.13) 取代 v11.6 的 persistence_flush_task
+        
         # (v4.0) 异步获取 Bot 昵称并注入
         asyncio.create_task(self._initialize_engines())
         
-        # (v4.0) 启动后台任务
-        self.proactive_task = asyncio.create_task(self.proactive_task_handler.run_task())
-
-        # (v2.1) 初始化表情包目录
-        init_meme_storage()
+        # (v11.0) 异步加载状态文件 & 初始化表情包目录，完成后再启动后台任务
+        self.startup_task = asyncio.create_task(self._startup())
 
     async def _initialize_engines(self):
         """(v4.1 修复 Bug 5) 异步初始化需要 API 调用的模块"""
         await self.reply_engine.fetch_bot_name() #
 
+    async def _run_startup_phase(self, name: str, func):
+        """(v11.0) 在线程池中执行一个阻塞的启动阶段，并记录耗时"""
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(func)
+        finally:
+            self.startup_timings[name] = (time.perf_counter() - start) * 1000
+
+    async def _startup(self):
+        """
+        (v11.0) 异步启动序列
+        各阶段互不依赖，并发在线程池中执行，避免阻塞事件循环
+        (v11.6) 存储后端的打开先于状态 / 画像加载单独执行
+        """
+        start = time.perf_counter()
+        try:
+            # (v11.6) 先打开存储后端 (SQLite 连接 / 首次 JSON 迁移)，状态与画像的加载依赖它
+            await self._run_startup_phase("storage", self.persistence.open_storage)
+            states, profiles, _, _, vl_cache_data, topic_pool_data, poke_pool_data = await asyncio.gather(
+                self._run_startup_phase("states", self.persistence.load_states),
+                self._run_startup_phase("user_profiles", self.persistence.load_user_profiles),
+                self._run_startup_phase("persona_cache", self.persona_summarizer.load_cache),
+                self._run_startup_phase("meme_storage", init_meme_storage),
+                self._run_startup_phase("vl_cache", self.persistence.load_vl_cache),
+                self._run_startup_phase("topic_pool", self.persistence.load_topic_pool), # (v11.18)
+                self._run_startup_phase("poke_pool", self.persistence.load_poke_pool), # (v11.19)
+            )
+            self.state_manager.load_initial_data(states, profiles)
+            if self.image_cache:
+                self.image_cache.load_dict(vl_cache_data)
+            self.topic_pool.load_dict(topic_pool_data) # (v11.18)
+            self.poke_pool.load_dict(poke_pool_data) # (v11.19)
+            self.startup_timings["total"] = (time.perf_counter() - start) * 1000
+
+            phases = " | ".join(f"{name}: {ms:.0f}ms" for name, ms in self.startup_timings.items())
+            logger.info(f"💖 心流：异步启动完成。{phases}")
+        except Exception as e:
+            # (v11.0) 加载失败时同样放行，退化为空状态运行 (与旧版 load_* 的容错一致)
+            logger.error(f"💖 心流：异步启动异常: {e}")
+        finally:
+            self._ready.set()
+
+        # (v4.0) 启动后台任务
+        self.proactive_task = asyncio.create_task(self.proactive_task_handler.run_task())
+        # (v11.13) 周期杂务注册到调度器
+        self.persistence_task_handler.register(self.scheduler) # (v11.6)
+        self.topic_pool.register(self.scheduler) # (v11.18)
+        if self.config.enable_poke_response:
+            self.poke_pool.register(self.scheduler) # (v11.19)
+        if self.image_cache:
+            self.scheduler.schedule_every(
+                "vl_cache_save", VL_CACHE_SAVE_INTERVAL_SECONDS, self._save_vl_cache_if_dirty,
+                jitter=VL_CACHE_SAVE_INTERVAL_SECONDS * 0.1
+            )
+        if self.config.social_decay_vectorized and self.config.enable_user_profiles:
+            self.scheduler.schedule_every(
+                "social_decay_settle", SOCIAL_DECAY_SETTLE_INTERVAL_SECONDS, self.state_manager.settle_resident_profiles,
+                jitter=SOCIAL_DECAY_SETTLE_INTERVAL_SECONDS * 0.1
+            ) # (v11.12)
+        self.scheduler_task = asyncio.create_task(self.scheduler.run())
+
+    async def _save_vl_cache_if_dirty(self):
+        """(v11.13) 调度器回调：VL 缓存有变更时在工作线程中保存"""
+        if not self.image_cache.dirty:
+            return
+        data = self.image_cache.to_dict()
+        self.image_cache.dirty = False
+        try:
+            await asyncio.to_thread(self.persistence.save_vl_cache, data)
+        except Exception:
+            self.image_cache.dirty = True
+            raise
+
+    async def _wait_ready(self) -> bool:
+        """(v11.0) 等待启动完成；超时返回 False (调用方应丢弃事件)"""
+        if self._ready.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=self.config.startup_ready_timeout_seconds)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("💖 心流：插件仍在启动中，已丢弃一个事件。")
+            return False
+
     # --- 4. 注册事件监听 (委托) ---
     
     @event_filter.event_message_type(event_filter.EventMessageType.GROUP_MESSAGE, priority=1000)
@@ -115,6 +256,10 @@ class HeartflowPlugin(Star):
         # 1. 预过滤 (v8.1 修复：忽略 @, 标记 Nickname)
         if not self.pre_filters.should_process_message(event):
             return
+
+        # (v11.0) 启动未完成时等待就绪
+        if not await self._wait_ready():
+            return
             
         # -----------------------------------------------
         # --- (BUG 1 修复) 检查过载逻辑必须在 bonus_score 之后 ---
@@ -151,6 +296,10 @@ class HeartflowPlugin(Star):
     async def on_poke(self, event: AstrMessageEvent):
         """(v8.3 修复) 委托给 Poke 处理器，如果未停止，则继续执行标准回复流"""
         
+        # (v11.0) 启动未完成时等待就绪 (未启用戳一戳时无需等待)
+        if self.config.enable_poke_response and not await self._wait_ready():
+            return
+
         # --- 1. 委托给 Poke 处理器 ---
         await self.poke_handler.on_poke(event)
         
@@ -187,29 +336,55 @@ class HeartflowPlugin(Star):
 
     @event_filter.command("heartflow")
     async def heartflow_status(self, event: AstrMessageEvent):
+        if not await self._wait_ready():
+            return
         await self.command_handler.heartflow_status(event)
 
     @event_filter.command("重载心流")
     async def heartflow_reset(self, event: AstrMessageEvent):
+        if not await self._wait_ready():
+            return
         await self.command_handler.heartflow_reset(event)
 
     @event_filter.command("查看缓存")
     async def heartflow_cache_status(self, event: AstrMessageEvent):
+        if not await self._wait_ready():
+            return
         await self.command_handler.heartflow_cache_status(event)
 
     @event_filter.command("清除缓存")
     async def heartflow_cache_clear(self, event: AstrMessageEvent):
+        if not await self._wait_ready():
+            return
         await self.command_handler.heartflow_cache_clear(event)
 
     # --- 6. 终止 (委托) ---
     
     async def terminate(self):
         """(v4.0) 委托所有模块进行保存和关闭"""
-        self.persistence.save_states(self.state_manager.get_all_states()) #
-        if self.config.enable_user_profiles:
-            self.persistence.save_user_profiles(self.state_manager.get_all_user_profiles()) #
+        if not self._ready.is_set():
+            # (v11.0) 启动尚未完成：内存中没有完整数据，绝不能用空状态覆盖磁盘文件
+            logger.warning("💖 心流：插件在启动完成前被终止，跳过保存。")
+            self.startup_task.cancel()
+            return
+
+        # (v11.6) 停止定期刷写，并写入剩余的脏行
+        # (v11.13) 停止调度器 (未执行的延迟保存由下方的最终保存覆盖)
+        if self.scheduler_task:
+            self.scheduler_task.cancel()
+        await self.persistence_task_handler.flush()
+        self.persistence.close()
         
         self.persona_summarizer.save_cache() #
         
+        if self.image_cache and self.image_cache.dirty:
+            self.persistence.save_vl_cache(self.image_cache.to_dict()) # (v11.1)
+
+        if self.topic_pool.pools:
+            self.persistence.save_topic_pool(self.topic_pool.to_dict()) # (v11.18)
+
+        if self.poke_pool.pools:
+            self.persistence.save_poke_pool(self.poke_pool.to_dict()) # (v11.19)
+        
         if self.proactive_task:
             self.proactive_task.cancel() #
\ No newline at end of file
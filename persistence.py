@@ -2,9 +2,16 @@
 # (v4.0 重构 - 新文件)
 # (v5.1 修复：修正 v5 引入的 NameError)
 # (BUG 5 修复：使用 config 动态截断)
+# (v11.6 性能 - ChatState/UserProfile 改由可插拔存储后端读写 (JSON / SQLite WAL))
+# (v11.7 性能 - 检查点：快照在工作线程中序列化)
+# (v11.9 性能 - SQLite 后端下可使用懒加载画像库)
+# (v11.10 性能 - 使用 slots 数据类的 to_dict / from_dict，加载时驻留键字符串)
+# (v11.18 性能 - 主动话题预生成池的读写)
+# (v11.19 性能 - 戳一戳回复池的读写)
+# (v11.6 修复 - 存储后端改为在启动阶段 (工作线程) 中打开，不再阻塞插件实例化)
 import os
+import sys
 import json
-from dataclasses import asdict
 from typing import Dict, Any
 from astrbot.api import logger
 from astrbot.api.star import Context
@@ -12,6 +19,10 @@ from astrbot.api.star import Context
 # (使用相对路径导入 v4.0 模块)
 from .datamodels import ChatState, UserProfile
 from .config import HeartflowConfig # (BUG 5 修复) 导入 Config
+from .storage.base import StorageBackend, StorageChanges
+from .storage.json_backend import JsonStorageBackend
+from .storage.sqlite_backend import SqliteStorageBackend
+from .core.profile_store import LazyProfileStore
 
 class PersistenceManager:
     """
@@ -28,6 +39,34 @@ class PersistenceManager:
         self.states_file_path = os.path.join("data", "heartflow_states.json")
         self.user_profiles_file_path = os.path.join("data", "heartflow_user_profiles.json")
         self.persona_cache_file = os.path.join("data", "persona_cache.json")
+        self.vl_cache_file = os.path.join("data", "heartflow_vl_cache.json") # (v11.1)
+        self.topic_pool_file = os.path.join("data", "heartflow_topic_pool.json") # (v11.18)
+        self.poke_pool_file = os.path.join("data", "heartflow_poke_pool.json") # (v11.19)
+        self.storage_db_path = os.path.join("data", "heartflow_storage.db") # (v11.6)
+
+        # (v11.6) ChatState / UserProfile 存储后端
+        # 打开数据库 / 迁移旧 JSON 均为阻塞 I/O，由 main._startup 在工作线程中调用 open_storage
+        self.storage: StorageBackend | None = None
+
+    def open_storage(self):
+        """(v11.6) 打开存储后端 (阻塞，应在工作线程中调用；须先于 load_states / load_user_profiles)"""
+        if self.storage is None:
+            self.storage = self._create_storage_backend()
+
+    def _create_storage_backend(self) -> StorageBackend:
+        """(v11.6) 按配置创建存储后端，SQLite 初始化失败时回退到 JSON"""
+        if self.config.storage_backend == "sqlite":
+            try:
+                backend = SqliteStorageBackend(
+                    self.storage_db_path,
+                    legacy_states_file=self.states_file_path,
+                    legacy_profiles_file=self.user_profiles_file_path
+                )
+                logger.info(f"💖 心流：使用 SQLite (WAL) 存储后端: {self.storage_db_path}")
+                return backend
+            except Exception as e:
+                logger.error(f"💖 心流：初始化 SQLite 存储后端失败，回退到 JSON: {e}")
+        return JsonStorageBackend(self.states_file_path, self.user_profiles_file_path)
 
     # --- 1. History (Bug 2 & 3 修复) ---
     async def save_history_message(self, chat_id: str, role: str, content: str, bot_name: str, sender_name: str = None):
@@ -81,85 +120,109 @@ class PersistenceManager:
     # --- 2. ChatState ---
     def load_states(self) -> Dict[str, ChatState]:
         """
-        (v5.1 修复) 从 data/heartflow_states.json 加载状态
+        (v5.1 修复) 加载群聊状态
+        (v11.6) 委托给存储后端，逐行流式读取
         """
         chat_states = {}
         try:
-            if os.path.exists(self.states_file_path):
-                # ！！！ v5.1 修复：恢复 json.load ！！！
-                with open(self.states_file_path, 'r', encoding='utf-8') as f:
-                    states_data = json.load(f)
-                
-                for chat_id, state_dict in states_data.items():
-                    # 使用 **kwargs 从字典重新实例化 dataclass
-                    chat_states[chat_id] = ChatState(**state_dict)
-                logger.info(f"💖 心流：成功加载 {len(chat_states)} 个群聊状态。")
-            else:
-                logger.info("💖 心流：未找到状态文件，将创建新状态文件。")
-                # (v5) 立即保存一个空状态
-                self.save_states({}) 
+            for chat_id, state_dict in self.storage.iter_states():
+                # (v11.10) from_dict 重新实例化 dataclass
+                chat_states[sys.intern(chat_id)] = ChatState.from_dict(state_dict)
+            logger.info(f"💖 心流：成功加载 {len(chat_states)} 个群聊状态。")
         except Exception as e:
-            # (v5.1) 此处会捕获 NameError (line 80)
             logger.error(f"💖 心流：加载状态文件失败: {e}")
         return chat_states
 
     def save_states(self, chat_states: Dict[str, ChatState]):
         """
-        (迁移) 保存状态到 data/heartflow_states.json
+        (迁移) 全量保存群聊状态
         来源: main.py -> _save_states
         """
         try:
-            # 使用 asdict 将 ChatState 对象转换为可序列化的字典
-            serializable_states = {chat_id: asdict(state) for chat_id, state in chat_states.items()}
-            
-            os.makedirs(os.path.dirname(self.states_file_path), exist_ok=True)
-            
-            with open(self.states_file_path, 'w', encoding='utf-8') as f:
-                json.dump(serializable_states, f, ensure_ascii=False, indent=4)
-            logger.info(f"💖 心流：成功保存 {len(chat_states)} 个群聊状态。")
+            # 使用 to_dict 将 ChatState 对象转换为可序列化的字典
+            serializable_states = {chat_id: state.to_dict() for chat_id, state in chat_states.items()}
+            self.storage.write(StorageChanges(full=True, states=serializable_states))
         except Exception as e:
             logger.error(f"💖 心流：保存状态文件失败: {e}")
 
     # --- 3. UserProfile (v3.0) ---
     def load_user_profiles(self) -> Dict[str, UserProfile]:
         """
-        (v5.1 修复) 从 data/heartflow_user_profiles.json 加载用户画像
+        (v5.1 修复) 加载用户画像
+        (v11.6) 委托给存储后端，逐行流式读取
+        (v11.9) 启用懒加载时只读取主键索引，返回 LazyProfileStore
         """
+        if self.config.profile_store_lazy:
+            if self.storage.supports_random_access:
+                try:
+                    store = LazyProfileStore(
+                        self._load_single_profile,
+                        self.storage.iter_user_profile_ids(),
+                        self.config.profile_store_idle_seconds
+                    )
+                    logger.info(f"💖 心流：懒加载画像库已就绪，索引 {len(store)} 个用户画像。")
+                    return store
+                except Exception as e:
+                    logger.error(f"💖 心流：建立画像索引失败，回退到全量加载: {e}")
+            else:
+                logger.warning(f"💖 心流：懒加载画像库需要 SQLite 存储后端 (当前: {self.storage.name})，已回退到全量加载。")
+
         user_profiles = {}
         try:
-            if os.path.exists(self.user_profiles_file_path):
-                # ！！！ v5.1 修复：恢复 json.load ！！！
-                with open(self.user_profiles_file_path, 'r', encoding='utf-8') as f:
-                    profiles_data = json.load(f)
-                
-                for user_id, profile_dict in profiles_data.items():
-                    user_profiles[user_id] = UserProfile(**profile_dict)
-                logger.info(f"💖 心流：成功加载 {len(user_profiles)} 个用户画像。")
-            else:
-                logger.info("💖 心流：未找到用户画像文件，将创建新画像文件。")
-                # (v5) 立即保存一个空画像
-                self.save_user_profiles({})
+            for user_id, profile_dict in self.storage.iter_user_profiles():
+                profile = UserProfile.from_dict(profile_dict)
+                user_profiles[profile.user_id] = profile # (v11.10) 键与 profile.user_id 为同一驻留字符串
+            logger.info(f"💖 心流：成功加载 {len(user_profiles)} 个用户画像。")
         except Exception as e:
-            # (v5.1) 此处会捕获 NameError (line 123)
             logger.error(f"💖 心流：加载用户画像文件失败: {e}")
         return user_profiles
         
+    def _load_single_profile(self, user_id: str) -> UserProfile | None:
+        """(v11.9) 懒加载画像库的 loader"""
+        row = self.storage.get_user_profile(user_id)
+        return UserProfile.from_dict(row) if row is not None else None
+        
     def save_user_profiles(self, user_profiles: Dict[str, UserProfile]):
         """
-        (迁移) 保存用户画像到 data/heartflow_user_profiles.json
+        (迁移) 全量保存用户画像
         来源: main.py -> _save_user_profiles
         """
         try:
-            serializable_profiles = {user_id: asdict(profile) for user_id, profile in user_profiles.items()}
-            
-            os.makedirs(os.path.dirname(self.user_profiles_file_path), exist_ok=True)
-            
-            with open(self.user_profiles_file_path, 'w', encoding='utf-8') as f:
-                json.dump(serializable_profiles, f, ensure_ascii=False, indent=4)
-            logger.info(f"💖 心流：成功保存 {len(user_profiles)} 个用户画像。")
+            serializable_profiles = {user_id: profile.to_dict() for user_id, profile in user_profiles.items()}
+            self.storage.write(StorageChanges(full=True, profiles=serializable_profiles))
         except Exception as e:
             logger.error(f"💖 心流：保存用户画像文件失败: {e}")
 
+    # --- (v11.6) 增量写入 ---
+    def write_changes(self, changes: StorageChanges):
+        """
+        (v11.6) 写入 StateManager 收集的变更集 (阻塞，应在工作线程中调用)
+        (v11.7) dataclass 快照在此 (工作线程中) 转换为 dict
+        异常向上抛出，由调用方重新标记脏数据
+        """
+        self.storage.write(StorageChanges(
+            full=changes.full,
+            states=self._to_rows(changes.states),
+            deleted_states=changes.deleted_states,
+            profiles=self._to_rows(changes.profiles),
+            deleted_profiles=changes.deleted_profiles,
+        ))
+
+    @staticmethod
+    def _to_rows(rows: Dict[str, Any]) -> Dict[str, dict] | None:
+        if rows is None:
+            return None
+        return {key: (row if isinstance(row, dict) else row.to_dict()) for key, row in rows.items()}
+
+    def close(self):
+        """(v11.6) 关闭存储后端"""
+        if self.storage is None:
+            return
+        try:
+            self.storage.close()
+        except Exception as e:
+            logger.error(f"💖 心流：关闭存储后端失败: {e}")
+
     # --- 4. PersonaCache (v2.1) ---
     def load_persona_cache(self) -> Dict[str, Any]:
         """
@@ -190,4 +253,83 @@ class PersistenceManager:
             with open(self.persona_cache_file, 'w', encoding='utf-8') as f:
                 json.dump(cache, f, ensure_ascii=False, indent=4)
         except Exception as e:
-            logger.error(f"💖 心流：保存人格缓存文件失败: {e}")
\ No newline at end of file
+            logger.error(f"💖 心流：保存人格缓存文件失败: {e}")
+
+    # --- 5. VL 图片描述缓存 (v11.1) ---
+    def load_vl_cache(self) -> Dict[str, Any]:
+        """
+        (v11.1) 从 data/heartflow_vl_cache.json 加载图片描述缓存
+        """
+        data = {}
+        try:
+            if os.path.exists(self.vl_cache_file):
+                with open(self.vl_cache_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                logger.info(f"💖 心流：成功加载 {len(data.get('entries', []))} 条图片描述缓存。")
+        except Exception as e:
+            logger.error(f"💖 心流：加载图片描述缓存失败: {e}")
+        return data
+
+    def save_vl_cache(self, data: Dict[str, Any]):
+        """
+        (v11.1) 保存图片描述缓存到 data/heartflow_vl_cache.json
+        (条目可能很多，使用紧凑格式)
+        """
+        try:
+            os.makedirs(os.path.dirname(self.vl_cache_file), exist_ok=True)
+            with open(self.vl_cache_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        except Exception as e:
+            logger.error(f"💖 心流：保存图片描述缓存失败: {e}")
+
+    # --- 6. 主动话题预生成池 (v11.18) ---
+    def load_topic_pool(self) -> Dict[str, Any]:
+        """
+        (v11.18) 从 data/heartflow_topic_pool.json 加载预生成的主动开场白
+        """
+        data = {}
+        try:
+            if os.path.exists(self.topic_pool_file):
+                with open(self.topic_pool_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                logger.info(f"💖 心流：成功加载 {len(data)} 个人格的主动话题池。")
+        except Exception as e:
+            logger.error(f"💖 心流：加载主动话题池失败: {e}")
+        return data
+
+    def save_topic_pool(self, data: Dict[str, Any]):
+        """
+        (v11.18) 保存主动话题池到 data/heartflow_topic_pool.json
+        """
+        try:
+            os.makedirs(os.path.dirname(self.topic_pool_file), exist_ok=True)
+            with open(self.topic_pool_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.error(f"💖 心流：保存主动话题池失败: {e}")
+
+    # --- 7. 戳一戳回复池 (v11.19) ---
+    def load_poke_pool(self) -> Dict[str, Any]:
+        """
+        (v11.19) 从 data/heartflow_poke_pool.json 加载预生成的戳一戳回复
+        """
+        data = {}
+        try:
+            if os.path.exists(self.poke_pool_file):
+                with open(self.poke_pool_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                logger.info(f"💖 心流：成功加载 {len(data)} 个人格的戳一戳回复池。")
+        except Exception as e:
+            logger.error(f"💖 心流：加载戳一戳回复池失败: {e}")
+        return data
+
+    def save_poke_pool(self, data: Dict[str, Any]):
+        """
+        (v11.19) 保存戳一戳回复池到 data/heartflow_poke_pool.json
+        """
+        try:
+            os.makedirs(os.path.dirname(self.poke_pool_file), exist_ok=True)
+            with open(self.poke_pool_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.error(f"💖 心流：保存戳一戳回复池失败: {e}")
@@ -0,0 +1,69 @@
+# heartflow/storage/base.py
+# (新) v11.6 可插拔存储后端
+# 职责：定义 ChatState / UserProfile 行存储的统一接口
+# (后端只处理 dict 行，dataclass 的转换由 PersistenceManager 负责)
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Tuple
+
+
+@dataclass
+class StorageChanges:
+    """
+    (v11.6) 一次写入的变更集
+    - full=True: states/profiles 为全量行 (None 表示该实体无变更，无需写入)
+    - full=False: states/profiles 仅包含脏行，deleted_* 为需删除的主键
+    - (v11.7) 行的值可以是 dict，也可以是 dataclass 快照 (由 PersistenceManager 在工作线程中转换)
+    """
+    full: bool = False
+    states: Dict[str, dict] = None
+    deleted_states: set = field(default_factory=set)
+    profiles: Dict[str, dict] = None
+    deleted_profiles: set = field(default_factory=set)
+
+    def is_empty(self) -> bool:
+        return (not self.states and not self.deleted_states and
+                not self.profiles and not self.deleted_profiles)
+
+    @property
+    def row_count(self) -> int:
+        return (len(self.states or {}) + len(self.deleted_states) +
+                len(self.profiles or {}) + len(self.deleted_profiles))
+
+
+class StorageBackend:
+    """
+    (v11.6) 存储后端基类
+    - iter_*: 逐行产出 (主键, dict)，供启动时流式加载
+    - write: 写入一个变更集 (在工作线程中调用，实现需自行保证线程安全)
+    """
+
+    name: str = "base"
+    # 是否支持只写脏行；不支持时 (如 JSON) 调用方需提供全量行
+    supports_partial_writes: bool = False
+    # (v11.9) 是否支持按主键读取单个画像 (懒加载画像库需要)
+    supports_random_access: bool = False
+
+    def iter_states(self) -> Iterator[Tuple[str, dict]]:
+        raise NotImplementedError
+
+    def iter_user_profiles(self) -> Iterator[Tuple[str, dict]]:
+        raise NotImplementedError
+
+    def write(self, changes: StorageChanges):
+        raise NotImplementedError
+
+    def iter_user_profile_ids(self) -> Iterator[str]:
+        """(v11.9) 逐个产出所有画像主键 (仅 supports_random_access 的后端)"""
+        raise NotImplementedError
+
+    def get_user_profile(self, user_id: str) -> dict | None:
+        """(v11.9) 按主键读取单个画像 (仅 supports_random_access 的后端)"""
+        raise NotImplementedError
+
+    def get_size_bytes(self) -> int:
+        """(v11.7) 存储在磁盘上的总大小 (字节)"""
+        return 0
+
+    def close(self):
+        """释放资源 (默认无操作)"""
+        pass
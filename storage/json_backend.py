@@ -0,0 +1,71 @@
+# heartflow/storage/json_backend.py
+# (新) v11.6 JSON 存储后端 (迁移自 persistence.py 的 v5.1 实现)
+# 职责：以整文件 JSON 保存 ChatState / UserProfile (不支持部分写入)
+# (v11.7) 紧凑格式 + 临时文件/fsync/rename 原子写入
+import os
+import json
+from typing import Dict, Iterator, Tuple
+from astrbot.api import logger
+
+from .base import StorageBackend, StorageChanges
+
+
+class JsonStorageBackend(StorageBackend):
+    """(v11.6) data/heartflow_states.json + data/heartflow_user_profiles.json"""
+
+    name = "json"
+    supports_partial_writes = False
+
+    def __init__(self, states_file_path: str, user_profiles_file_path: str):
+        self.states_file_path = states_file_path
+        self.user_profiles_file_path = user_profiles_file_path
+
+    def iter_states(self) -> Iterator[Tuple[str, dict]]:
+        """(v5.1 修复) 从 data/heartflow_states.json 加载状态"""
+        if not os.path.exists(self.states_file_path):
+            logger.info("💖 心流：未找到状态文件，将创建新状态文件。")
+            # (v5) 立即保存一个空状态
+            self._write_file(self.states_file_path, {})
+            return
+        with open(self.states_file_path, 'r', encoding='utf-8') as f:
+            states_data = json.load(f)
+        yield from states_data.items()
+
+    def iter_user_profiles(self) -> Iterator[Tuple[str, dict]]:
+        """(v5.1 修复) 从 data/heartflow_user_profiles.json 加载用户画像"""
+        if not os.path.exists(self.user_profiles_file_path):
+            logger.info("💖 心流：未找到用户画像文件，将创建新画像文件。")
+            # (v5) 立即保存一个空画像
+            self._write_file(self.user_profiles_file_path, {})
+            return
+        with open(self.user_profiles_file_path, 'r', encoding='utf-8') as f:
+            profiles_data = json.load(f)
+        yield from profiles_data.items()
+
+    def write(self, changes: StorageChanges):
+        """JSON 只能整文件重写，因此要求全量变更集"""
+        if not changes.full:
+            raise ValueError("JsonStorageBackend 仅支持全量写入 (full=True)")
+        if changes.states is not None:
+            self._write_file(self.states_file_path, changes.states)
+            logger.debug(f"💖 心流：成功保存 {len(changes.states)} 个群聊状态。")
+        if changes.profiles is not None:
+            self._write_file(self.user_profiles_file_path, changes.profiles)
+            logger.debug(f"💖 心流：成功保存 {len(changes.profiles)} 个用户画像。")
+
+    def get_size_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.states_file_path, self.user_profiles_file_path)
+                   if os.path.exists(p))
+
+    def _write_file(self, path: str, data: Dict[str, dict]):
+        """
+        (v11.7) 原子写入：先写临时文件并 fsync，再 os.replace 覆盖
+        (写入中途崩溃不会留下半个 JSON 文件)
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
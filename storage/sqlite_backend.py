@@ -0,0 +1,166 @@
+# heartflow/storage/sqlite_backend.py
+# (新) v11.6 SQLite (WAL) 存储后端
+# 职责：每个实体一张表，按行 upsert 脏数据；启动时流式读取；首次使用时从 JSON 文件迁移
+# (v11.6 修复 - 迁移数据与迁移标记在同一事务中提交)
+# (v11.6 修复 - 旧版 JSON 读取失败时不写迁移标记，打开失败以回退到 JSON 后端，下次启动重试迁移)
+import os
+import json
+import sqlite3
+import threading
+from typing import Iterator, Tuple
+from astrbot.api import logger
+
+from .base import StorageBackend, StorageChanges
+
+# 实体 -> 表名
+STATES_TABLE = "chat_states"
+PROFILES_TABLE = "user_profiles"
+
+# 流式读取时每批拉取的行数
+FETCH_BATCH_SIZE = 500
+
+
+class SqliteStorageBackend(StorageBackend):
+    """
+    (v11.6) data/heartflow_storage.db
+    - 表结构：(id TEXT PRIMARY KEY, data TEXT)，data 为该行 dataclass 的 JSON
+      (新增字段无需迁移表结构，与 JSON 后端的兼容方式一致)
+    - 每次 write 在单个事务中完成所有 upsert / delete
+    - 连接跨线程共享 (check_same_thread=False)，由锁串行化
+    """
+
+    name = "sqlite"
+    supports_partial_writes = True
+    supports_random_access = True # (v11.9)
+
+    def __init__(self, db_path: str, legacy_states_file: str = None, legacy_profiles_file: str = None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # WAL 模式下 NORMAL 已能保证崩溃后一致
+        for table in (STATES_TABLE, PROFILES_TABLE):
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+        try:
+            self._migrate_from_json(legacy_states_file, legacy_profiles_file)
+        except Exception:
+            self._conn.close()
+            raise
+
+    # --- 读取 (流式) ---
+
+    def iter_states(self) -> Iterator[Tuple[str, dict]]:
+        yield from self._iter_table(STATES_TABLE)
+
+    def iter_user_profiles(self) -> Iterator[Tuple[str, dict]]:
+        yield from self._iter_table(PROFILES_TABLE)
+
+    def iter_user_profile_ids(self) -> Iterator[str]:
+        """(v11.9) 只读取主键列，供懒加载画像库建立索引"""
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT id FROM {PROFILES_TABLE}")
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            for (row_id,) in rows:
+                yield row_id
+
+    def get_user_profile(self, user_id: str) -> dict | None:
+        """(v11.9) 按主键读取单个画像 (主键索引查询，微秒级)"""
+        with self._lock:
+            row = self._conn.execute(f"SELECT data FROM {PROFILES_TABLE} WHERE id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _iter_table(self, table: str) -> Iterator[Tuple[str, dict]]:
+        """分批 fetchmany，避免一次性把整张表读入内存"""
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT id, data FROM {table}")
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            for row_id, data in rows:
+                yield row_id, json.loads(data)
+
+    # --- 写入 ---
+
+    def write(self, changes: StorageChanges):
+        """在单个事务中写入全部脏行与删除"""
+        self._write(changes)
+
+    def _write(self, changes: StorageChanges, meta: dict = None):
+        """单个事务：写入变更集，以及 (可选) meta 表的键值 (迁移标记与数据同时提交或同时回滚)"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._apply(STATES_TABLE, changes.states, changes.deleted_states, changes.full)
+                self._apply(PROFILES_TABLE, changes.profiles, changes.deleted_profiles, changes.full)
+                if meta:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items()
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _apply(self, table: str, rows: dict, deleted: set, full: bool):
+        if rows is None:
+            return
+        if full:
+            # 全量写入：表内容以本次行集合为准
+            self._conn.execute(f"DELETE FROM {table}")
+        if rows:
+            self._conn.executemany(
+                f"INSERT INTO {table} (id, data) VALUES (?, ?) "
+                f"ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                ((row_id, json.dumps(row, ensure_ascii=False, separators=(',', ':'))) for row_id, row in rows.items())
+            )
+        if deleted:
+            self._conn.executemany(f"DELETE FROM {table} WHERE id = ?", ((row_id,) for row_id in deleted))
+
+    def get_size_bytes(self) -> int:
+        """(v11.7) 数据库文件 + WAL 文件大小"""
+        return sum(os.path.getsize(p) for p in (self.db_path, f"{self.db_path}-wal") if os.path.exists(p))
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error:
+                pass
+            self._conn.close()
+
+    # --- JSON 迁移 ---
+
+    def _migrate_from_json(self, states_file: str, profiles_file: str):
+        """
+        首次启用 SQLite 时，从旧版 JSON 文件导入数据 (仅执行一次，记录在 meta 表中)
+        旧 JSON 文件保持原样，便于切回 JSON 后端
+        旧文件读取失败时抛出异常且不写迁移标记：本次回退到 JSON 后端，下次启动重试迁移
+        """
+        with self._lock:
+            migrated = self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+        if migrated:
+            return
+
+        changes = StorageChanges(full=False, states={}, profiles={})
+        for path, rows in ((states_file, changes.states), (profiles_file, changes.profiles)):
+            if path and os.path.exists(path):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        rows.update(json.load(f))
+                except Exception as e:
+                    logger.error(f"💖 心流：读取旧版 JSON 文件 {path} 失败，暂不迁移: {e}")
+                    raise
+
+        self._write(changes, meta={"migrated_from_json": "1"})
+        if changes.states or changes.profiles:
+            logger.info(f"💖 心流：已从 JSON 迁移 {len(changes.states)} 个群聊状态、{len(changes.profiles)} 个用户画像到 SQLite。")
@@ -0,0 +1,47 @@
+# heartflow/tests/conftest.py
+# 插件目录本身不是包 (由 AstrBot 按目录加载)，测试时把仓库根目录注册为 heartflow 包，
+# 以便按 heartflow.core.xxx 导入并保留模块内的相对导入
+# 未安装 astrbot 时注册最小替身模块：被测模块只在导入时用到 logger 与少量类型名
+import importlib.util
+import logging
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "heartflow" not in sys.modules:
+    _package = types.ModuleType("heartflow")
+    _package.__path__ = [ROOT]
+    sys.modules["heartflow"] = _package
+
+
+def _stub_module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def _stub_class(name: str) -> type:
+    return type(name, (), {"__init__": lambda self, *args, **kwargs: None})
+
+
+def _install_astrbot_stub():
+    _stub_module("astrbot", __path__=[])
+    _stub_module("astrbot.api", __path__=[], logger=logging.getLogger("astrbot"))
+    _stub_module("astrbot.api.event", AstrMessageEvent=_stub_class("AstrMessageEvent"),
+                 MessageChain=_stub_class("MessageChain"))
+    _stub_module("astrbot.api.star", Context=_stub_class("Context"))
+    _stub_module("astrbot.api.provider", LLMResponse=_stub_class("LLMResponse"))
+    _stub_module("astrbot.api.message_components", Image=_stub_class("Image"))
+    _stub_module("astrbot.core", __path__=[])
+    _stub_module("astrbot.core.config", __path__=[])
+    _stub_module("astrbot.core.config.astrbot_config", AstrBotConfig=dict)
+
+
+if importlib.util.find_spec("astrbot") is None:
+    _install_astrbot_stub()
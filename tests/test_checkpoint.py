@@ -0,0 +1,146 @@
+# heartflow/tests/test_checkpoint.py
+# (v11.7) 检查点：脏行收集 -> 工作线程写入 -> 重新加载 的往返一致性，以及写入失败时的原子性与重试
+import asyncio
+import json
+import os
+from dataclasses import asdict
+
+import pytest
+
+from heartflow.config import HeartflowConfig
+from heartflow.core.state_manager import StateManager
+from heartflow.features.persistence_task import PersistenceTask
+from heartflow.persistence import PersistenceManager
+from heartflow.storage import json_backend
+
+
+def make_stack(backend: str):
+    config = HeartflowConfig({"storage_backend": backend, "enable_user_profiles": True})
+    persistence = PersistenceManager(None, config)
+    persistence.open_storage()
+    state_manager = StateManager(config, {}, {})
+    return config, persistence, state_manager, PersistenceTask(config, state_manager, persistence)
+
+
+def reload(backend: str):
+    config = HeartflowConfig({"storage_backend": backend, "enable_user_profiles": True})
+    persistence = PersistenceManager(None, config)
+    persistence.open_storage()
+    try:
+        return persistence.load_states(), persistence.load_user_profiles()
+    finally:
+        persistence.close()
+
+
+def populate(state_manager: StateManager):
+    state = state_manager._get_chat_state("group:1")
+    state.energy = 0.42
+    state.total_messages = 7
+    state_manager.mark_state_dirty("group:1")
+    state_manager._get_chat_state("group:2")
+    profile = state_manager._get_user_profile("10001")
+    profile.name = "小明"
+    profile.social_score = 12.5
+    state_manager._recalculate_tier(profile)
+    state_manager.mark_profile_dirty("10001")
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_checkpoint_round_trip(backend):
+    _, persistence, state_manager, task = make_stack(backend)
+    populate(state_manager)
+
+    assert asyncio.run(task.flush()) > 0
+    assert asyncio.run(task.flush()) == 0 # 没有新的变更
+    persistence.close()
+
+    states, profiles = reload(backend)
+    assert {k: asdict(v) for k, v in states.items()} == \
+        {k: asdict(v) for k, v in state_manager.chat_states.items()}
+    assert asdict(profiles["10001"]) == asdict(state_manager.user_profiles["10001"])
+    assert profiles["10001"].relationship_tier == "acquaintance"
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_checkpoint_writes_deletions(backend):
+    _, persistence, state_manager, task = make_stack(backend)
+    populate(state_manager)
+    asyncio.run(task.flush())
+
+    state_manager.reset_chat_state("group:2")
+    assert asyncio.run(task.flush()) > 0
+    persistence.close()
+
+    states, _ = reload(backend)
+    assert set(states) == {"group:1"}
+
+
+def test_json_checkpoint_is_atomic_and_retried(monkeypatch):
+    _, persistence, state_manager, task = make_stack("json")
+    populate(state_manager)
+    asyncio.run(task.flush())
+    states_path = persistence.states_file_path
+    with open(states_path, encoding="utf-8") as f:
+        before = f.read()
+
+    state = state_manager._get_chat_state("group:1")
+    state.energy = 0.9
+    state_manager.mark_state_dirty("group:1")
+
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(json_backend.os, "replace", failing_replace)
+        assert asyncio.run(task.flush()) == 0
+    # 目标文件保持上一次完整写入的内容，变更重新标记为脏
+    with open(states_path, encoding="utf-8") as f:
+        assert f.read() == before
+    assert state_manager.has_pending_changes()
+
+    assert asyncio.run(task.flush()) > 0
+    with open(states_path, encoding="utf-8") as f:
+        assert json.load(f)["group:1"]["energy"] == 0.9
+
+
+def test_sqlite_migrates_legacy_json_once():
+    os.makedirs("data")
+    with open(os.path.join("data", "heartflow_states.json"), "w", encoding="utf-8") as f:
+        json.dump({"group:legacy": {"energy": 0.3}}, f)
+
+    states, _ = reload("sqlite")
+    assert states["group:legacy"].energy == 0.3
+
+    # 迁移标记与数据同一事务提交：再次打开不会重复导入已删除的行
+    _, persistence, state_manager, task = make_stack("sqlite")
+    state_manager.load_initial_data(persistence.load_states(), {})
+    state_manager.reset_chat_state("group:legacy")
+    asyncio.run(task.flush())
+    persistence.close()
+    states, _ = reload("sqlite")
+    assert "group:legacy" not in states
+
+
+def test_sqlite_falls_back_when_legacy_json_is_unreadable():
+    os.makedirs("data")
+    states_path = os.path.join("data", "heartflow_states.json")
+    with open(states_path, "w", encoding="utf-8") as f:
+        f.write("{broken")
+
+    # 旧文件读取失败：不写迁移标记，本次回退到 JSON 后端
+    _, persistence, _, _ = make_stack("sqlite")
+    assert persistence.storage.name == "json"
+    persistence.close()
+
+    # 旧文件修复后，下次启动照常迁移
+    with open(states_path, "w", encoding="utf-8") as f:
+        json.dump({"group:legacy": {"energy": 0.3}}, f)
+    _, persistence, _, _ = make_stack("sqlite")
+    assert persistence.storage.name == "sqlite"
+    assert persistence.load_states()["group:legacy"].energy == 0.3
+    persistence.close()
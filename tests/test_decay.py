@@ -0,0 +1,184 @@
+# heartflow/tests/test_decay.py
+# (v11.12) 闭式衰减与逐次 tick 的后台循环结果一致，且分段结算与一次结算一致
+import random
+
+import pytest
+
+from heartflow.core.decay import (
+    DAY_SECONDS,
+    PASSIVE_ENERGY_CAP,
+    PASSIVE_ENERGY_SILENCE_SECONDS,
+    decay_mood,
+    decay_social_score,
+    recover_energy,
+)
+
+NOW = 1_800_000_000.0
+HOUR = 3600
+
+
+def _toward_zero(value: float, amount: float) -> float:
+    if value > amount:
+        return value - amount
+    if value < -amount:
+        return value + amount
+    return 0.0
+
+
+def tick_social(score, last_seen, last_check, now, grace_sec, step):
+    """旧版每日检查的逐次模拟：每到一次检查时间，若已超过宽限期则衰减一步"""
+    if last_check <= 0:
+        return (_toward_zero(score, step) if now - last_seen > grace_sec else score), now
+    check = last_check
+    while check + DAY_SECONDS <= now:
+        check += DAY_SECONDS
+        if check - last_seen > grace_sec:
+            score = _toward_zero(score, step)
+    return score, check
+
+
+def tick_mood(mood, last_decay_time, now, interval_sec, step, tick_sec=60):
+    """每 tick_sec 唤醒一次的后台任务，每满一个周期平复一步"""
+    t = last_decay_time
+    while t + tick_sec <= now:
+        t += tick_sec
+        while t - last_decay_time >= interval_sec:
+            last_decay_time += interval_sec
+            mood = _toward_zero(mood, step)
+    return mood, last_decay_time
+
+
+def tick_energy(energy, last_reply_time, start, now, rate_per_sec, tick_sec=60):
+    """每 tick_sec 唤醒一次，沉默期满后按速率恢复，最多到上限"""
+    t = start
+    while t + tick_sec <= now:
+        t += tick_sec
+        if last_reply_time != 0 and energy < PASSIVE_ENERGY_CAP:
+            recover_from = max(t - tick_sec, last_reply_time + PASSIVE_ENERGY_SILENCE_SECONDS)
+            if t > recover_from:
+                energy = min(PASSIVE_ENERGY_CAP, energy + (t - recover_from) * rate_per_sec)
+    return energy
+
+
+# --- 社交分 ---
+
+@pytest.mark.parametrize("seed", range(5))
+def test_social_closed_form_matches_daily_loop(seed):
+    rng = random.Random(seed)
+    grace, step = 3 * DAY_SECONDS, 0.5
+    for _ in range(500):
+        score = rng.choice([0.0, 0.3, -0.3, round(rng.uniform(-60, 60), 1)])
+        last_seen = NOW - rng.uniform(0, 30 * DAY_SECONDS)
+        last_check = rng.choice([0.0, NOW - rng.uniform(0, 2 * DAY_SECONDS), NOW - rng.uniform(0, 40 * DAY_SECONDS)])
+
+        got_score, got_check = decay_social_score(score, last_seen, last_check, NOW, grace, step)
+        want_score, want_check = tick_social(score, last_seen, last_check, NOW, grace, step)
+
+        assert got_score == pytest.approx(want_score, abs=1e-9)
+        assert got_check == want_check
+
+
+def test_social_first_check_decays_at_most_one_step():
+    grace = 3 * DAY_SECONDS
+    assert decay_social_score(10.0, NOW - 30 * DAY_SECONDS, 0.0, NOW, grace, 0.5) == (9.5, NOW)
+    assert decay_social_score(10.0, NOW - DAY_SECONDS, 0.0, NOW, grace, 0.5) == (10.0, NOW)
+
+
+def test_social_grace_boundary_and_zero_crossing():
+    grace = 3 * DAY_SECONDS
+    last_check = NOW - 10 * DAY_SECONDS
+    # 最后发言恰在第一次检查时：宽限期为严格大于，第 5 次检查起才衰减，共 6 天
+    assert decay_social_score(20.0, last_check + DAY_SECONDS, last_check, NOW, grace, 1.0) == (14.0, NOW)
+    # 衰减量超过分数时停在 0，不越过
+    assert decay_social_score(-2.0, 0.0, last_check, NOW, grace, 1.0) == (0.0, NOW)
+
+
+def test_social_split_settlement_matches_single():
+    rng = random.Random(11)
+    grace, step = 3 * DAY_SECONDS, 0.5
+    start = NOW - 20 * DAY_SECONDS
+    score, check = 40.0, start
+    last_seen = start - DAY_SECONDS
+    for t in sorted(rng.uniform(start, NOW) for _ in range(50)) + [NOW]:
+        score, check = decay_social_score(score, last_seen, check, t, grace, step)
+
+    assert (score, check) == decay_social_score(40.0, last_seen, start, NOW, grace, step)
+
+
+# --- 心情 ---
+
+@pytest.mark.parametrize("seed", range(5))
+def test_mood_closed_form_matches_tick_loop(seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        mood = rng.uniform(-1, 1)
+        interval = rng.choice([HOUR, 2 * HOUR, 1800])
+        last = NOW - rng.uniform(0, 12 * HOUR)
+        now = last + rng.randrange(0, 12 * HOUR, 60)
+
+        got_mood, got_time = decay_mood(mood, last, now, interval, 0.1)
+        want_mood, want_time = tick_mood(mood, last, now, interval, 0.1)
+
+        assert got_mood == pytest.approx(want_mood, abs=1e-9)
+        assert got_time == want_time
+
+
+def test_mood_keeps_partial_period():
+    mood, settled = decay_mood(0.5, NOW, NOW + 2.5 * HOUR, HOUR, 0.1)
+    assert mood == pytest.approx(0.3)
+    assert settled == NOW + 2 * HOUR
+    # 剩余的半个周期在下一次结算时计入
+    mood, settled = decay_mood(mood, settled, NOW + 3 * HOUR, HOUR, 0.1)
+    assert mood == pytest.approx(0.2)
+    assert settled == NOW + 3 * HOUR
+
+
+def test_mood_split_settlement_matches_single():
+    rng = random.Random(3)
+    mood, settled = -0.9, NOW
+    end = NOW + 10 * HOUR
+    for t in sorted(rng.uniform(NOW, end) for _ in range(40)) + [end]:
+        mood, settled = decay_mood(mood, settled, t, HOUR, 0.1)
+
+    single_mood, single_settled = decay_mood(-0.9, NOW, end, HOUR, 0.1)
+    assert mood == pytest.approx(single_mood)
+    assert settled == single_settled
+
+
+@pytest.mark.parametrize("interval", [0, -1])
+def test_mood_disabled_interval_keeps_mood(interval):
+    assert decay_mood(0.7, NOW - 10 * HOUR, NOW, interval, 0.1) == (0.7, NOW)
+
+
+# --- 精力 ---
+
+@pytest.mark.parametrize("seed", range(5))
+def test_energy_closed_form_matches_tick_loop(seed):
+    rng = random.Random(seed)
+    rate = 0.1 / HOUR
+    for _ in range(50):
+        energy = rng.uniform(0, 1)
+        last_update = NOW - rng.randrange(0, 6 * HOUR, 60)
+        last_reply = rng.choice([0.0, last_update - rng.randrange(0, 3 * HOUR, 60)])
+
+        got = recover_energy(energy, last_reply, last_update, NOW, rate)
+        want = tick_energy(energy, last_reply, last_update, NOW, rate)
+
+        assert got == pytest.approx(want, abs=1e-9)
+
+
+def test_energy_waits_for_silence_and_caps():
+    rate = 0.1 / HOUR
+    last_reply = NOW - HOUR / 2
+    # 沉默未满 1 小时：不恢复
+    assert recover_energy(0.2, last_reply, last_reply, NOW, rate) == 0.2
+    # 沉默期满后只计算期满之后的部分
+    later = last_reply + PASSIVE_ENERGY_SILENCE_SECONDS + 2 * HOUR
+    assert recover_energy(0.2, last_reply, last_reply, later, rate) == pytest.approx(0.4)
+    # 最多恢复到上限；已高于上限的保持不变
+    assert recover_energy(0.2, last_reply, last_reply, later + 100 * HOUR, rate) == PASSIVE_ENERGY_CAP
+    assert recover_energy(0.95, last_reply, last_reply, later, rate) == 0.95
+
+
+def test_energy_never_replied_does_not_recover():
+    assert recover_energy(0.1, 0, NOW - 10 * HOUR, NOW, 1.0) == 0.1
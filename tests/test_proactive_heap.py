@@ -0,0 +1,139 @@
+# heartflow/tests/test_proactive_heap.py
+# (v11.14) 主动话题调度堆：按最早可触发时间出堆、跳过过期条目、状态变化后重新排期
+# (v11.15 修复) 取得发送时机后重新确认触发条件
+import asyncio
+
+import pytest
+
+from heartflow.config import HeartflowConfig
+from heartflow.core.state_manager import StateManager
+from heartflow.datamodels import ChatState
+from heartflow.features import proactive_task as proactive_task_module
+from heartflow.features.proactive_task import ProactiveTask
+
+NOW = 1_800_000_000.0
+SILENCE_SEC = 60 * 60
+
+
+def make_task(states: dict, **overrides):
+    config = HeartflowConfig(dict({
+        "proactive_energy_threshold": 0.5,
+        "proactive_silence_threshold_minutes": SILENCE_SEC // 60,
+        "energy_passive_recovery_per_hour": 0.6,
+    }, **overrides))
+    state_manager = StateManager(config, states, {})
+    task = ProactiveTask(None, config, state_manager, None, None)
+    for chat_id in states:
+        task.on_state_changed(chat_id)
+    task._drain_pending(NOW)
+    return task, state_manager
+
+
+def silent_until(offset: float, energy: float = 1.0) -> ChatState:
+    """沉默条件在 NOW + offset 时满足的群聊"""
+    return ChatState(energy=energy, last_reply_time=NOW + offset - SILENCE_SEC, last_energy_update_time=NOW)
+
+
+def test_pop_due_in_due_order():
+    task, _ = make_task({
+        "a": silent_until(30),
+        "b": silent_until(10),
+        "c": silent_until(20),
+        "never": ChatState(), # 从未回复过：不参与主动话题
+    })
+
+    assert "never" not in task._due
+    assert task._pop_due(NOW) is None
+    assert task._seconds_until_next(NOW) == 10
+
+    assert task._pop_due(NOW + 25) == "b"
+    assert task._pop_due(NOW + 25) == "c"
+    assert task._pop_due(NOW + 25) is None
+    assert task._pop_due(NOW + 30) == "a"
+    assert task._pop_due(NOW + 30) is None
+    assert task._seconds_until_next(NOW + 30) is None
+
+
+def test_state_change_reschedules_and_skips_stale_entry():
+    task, state_manager = make_task({"a": silent_until(10)})
+
+    state_manager.chat_states["a"].last_reply_time += 100 # 又回复了一次
+    state_manager.mark_state_dirty("a")
+    task._drain_pending(NOW)
+
+    assert len(task._heap) == 2 # 旧条目惰性删除
+    assert task._pop_due(NOW + 50) is None
+    assert len(task._heap) == 1
+    assert task._pop_due(NOW + 110) == "a"
+    assert task._pop_due(NOW + 1000) is None
+
+
+def test_deleted_chat_is_dropped():
+    task, state_manager = make_task({"a": silent_until(10), "b": silent_until(20)})
+
+    state_manager.reset_chat_state("a")
+    task._drain_pending(NOW)
+
+    assert "a" not in task._due
+    assert task._pop_due(NOW + 100) == "b"
+    assert task._pop_due(NOW + 100) is None
+
+
+def test_due_waits_for_passive_energy_recovery():
+    # 已沉默 2 小时，精力 0.2 需要按 0.6/小时 恢复到阈值 0.5 以上
+    task, _ = make_task({"low": ChatState(energy=0.2, last_reply_time=NOW - 2 * 3600, last_energy_update_time=NOW)})
+    assert task._due["low"] == pytest.approx(NOW + 1800 + 1)
+
+    # 阈值高于被动恢复上限：只凭时间流逝永远不会满足
+    task, _ = make_task({"low": ChatState(energy=0.2, last_reply_time=NOW - 2 * 3600)}, proactive_energy_threshold=0.9)
+    assert "low" not in task._due
+
+
+def test_not_before_and_retry_after():
+    task, _ = make_task({"a": silent_until(10)})
+
+    task._reschedule("a", NOW, not_before=NOW + 500)
+    assert task._pop_due(NOW + 100) is None
+    assert task._pop_due(NOW + 500) == "a"
+
+    task._retry_after["a"] = NOW + 900
+    task._reschedule("a", NOW)
+    assert task._pop_due(NOW + 800) is None
+    assert task._pop_due(NOW + 900) == "a"
+    assert "a" not in task._retry_after # 出堆时清除
+
+
+def test_whitelist_excludes_chat():
+    task, _ = make_task({"a": silent_until(10), "b": silent_until(10)},
+                        whitelist_enabled=True, chat_whitelist=["b"])
+    assert set(task._due) == {"b"}
+
+
+class FakeChain:
+    def message(self, text: str):
+        self.text = text
+        return self
+
+
+class FakeContext:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id: str, message_chain: FakeChain):
+        self.sent.append((chat_id, message_chain.text))
+
+
+def test_send_rechecks_state_after_send_slot(monkeypatch):
+    monkeypatch.setattr(proactive_task_module, "MessageChain", FakeChain)
+    monkeypatch.setattr(proactive_task_module.time, "time", lambda: NOW + 20)
+    task, state_manager = make_task({"a": silent_until(10), "b": silent_until(10), "gone": silent_until(10)})
+    task.context = FakeContext()
+
+    state_manager.chat_states["b"].last_reply_time = NOW + 15 # 生成期间又回复过
+    state_manager.reset_chat_state("gone")
+    assert asyncio.run(task._send_opening("b", "你好")) is False
+    assert asyncio.run(task._send_opening("gone", "你好")) is False
+    assert task._next_send_time == 0.0 # 放弃发送不占用全局冷却
+
+    assert asyncio.run(task._send_opening("a", "你好")) is True
+    assert task.context.sent == [("a", "你好")]
@@ -0,0 +1,113 @@
+# heartflow/tests/test_profile_columns.py
+# (v11.12) 列存储批量结算与逐个闭式结算 (decay_social_score) 逐行一致
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from heartflow.core.decay import DAY_SECONDS, decay_social_score
+from heartflow.core.profile_columns import ProfileColumnStore, decay_social_score_columns
+from heartflow.datamodels import UserProfile
+
+GRACE = 3 * DAY_SECONDS
+STEP = 0.5
+AVOID, FRIEND, ACQ = -20.0, 50.0, 10.0
+NOW = 1_800_000_000.0
+
+
+def random_rows(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        score = rng.choice([0.0, 0.25, -0.25, round(rng.uniform(-60, 60), 1)])
+        last_seen = rng.choice([0.0, NOW - rng.uniform(0, 20 * DAY_SECONDS)])
+        last_check = rng.choice([0.0, NOW - rng.uniform(0, DAY_SECONDS), NOW - rng.uniform(0, 15 * DAY_SECONDS)])
+        rows.append((score, last_seen, last_check))
+    return rows
+
+
+def test_columns_match_scalar_closed_form():
+    rows = random_rows(5000)
+    score, last_seen, last_check = (np.array(column, dtype=np.float64) for column in zip(*rows))
+
+    new_score, new_check = decay_social_score_columns(score, last_seen, last_check, NOW, GRACE, STEP)
+
+    expected = [decay_social_score(s, seen, check, NOW, GRACE, STEP) for s, seen, check in rows]
+    assert new_score.tolist() == [s for s, _ in expected]
+    assert new_check.tolist() == [c for _, c in expected]
+
+
+def scalar_settle(profile: UserProfile):
+    """StateManager._materialize_profile 的等价逐个结算"""
+    profile.social_score, profile.last_decay_check_time = decay_social_score(
+        profile.social_score, profile.last_seen, profile.last_decay_check_time, NOW, GRACE, STEP
+    )
+    score = profile.social_score
+    if score <= AVOID:
+        profile.relationship_tier = "avoiding"
+    elif score >= FRIEND:
+        profile.relationship_tier = "friend"
+    elif score >= ACQ:
+        profile.relationship_tier = "acquaintance"
+    else:
+        profile.relationship_tier = "stranger"
+
+
+def make_profiles(rows):
+    return [UserProfile(user_id=str(i), name="", social_score=s, last_seen=seen, last_decay_check_time=check)
+            for i, (s, seen, check) in enumerate(rows)]
+
+
+def state_of(profiles):
+    return [(p.social_score, p.tier_code, p.last_decay_check_time) for p in profiles]
+
+
+def test_store_settle_matches_per_profile_settle():
+    rows = random_rows(3000, seed=11)
+    expected, actual = make_profiles(rows), make_profiles(rows)
+    for profile in expected:
+        scalar_settle(profile)
+
+    store = ProfileColumnStore()
+    store.extend(actual)
+    written, _ = store.settle(NOW, GRACE, STEP, AVOID, FRIEND, ACQ)
+
+    assert state_of(actual) == state_of(expected)
+    assert len(written) == len({p.user_id for p in written})
+    # 结算后再结算一次不再有变化
+    assert store.settle(NOW, GRACE, STEP, AVOID, FRIEND, ACQ) == ([], 0)
+
+
+def test_store_remove_keeps_rows_aligned():
+    profiles = make_profiles(random_rows(10, seed=3))
+    store = ProfileColumnStore()
+    store.extend(profiles)
+    store.remove("0")
+    store.remove("missing")
+    assert len(store) == 9 and "0" not in store
+
+    profiles[9].social_score = 99.0 # 被移动到第 0 行
+    store.upsert(profiles[9])
+    store.settle(NOW, GRACE, STEP, AVOID, FRIEND, ACQ)
+    assert profiles[9].relationship_tier == "friend"
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_state_manager_batch_settle_matches_reads(vectorized, monkeypatch):
+    from heartflow.config import HeartflowConfig
+    from heartflow.core import state_manager as state_manager_module
+
+    monkeypatch.setattr(state_manager_module.time, "time", lambda: NOW)
+    config = HeartflowConfig({"enable_user_profiles": True, "social_decay_vectorized": vectorized})
+    rows = random_rows(500, seed=5)
+    batch = state_manager_module.StateManager(config, {}, {p.user_id: p for p in make_profiles(rows)})
+    lazy = state_manager_module.StateManager(config, {}, {p.user_id: p for p in make_profiles(rows)})
+
+    written = batch.settle_resident_profiles()
+    for user_id in lazy.user_profiles:
+        lazy._get_user_profile(user_id) # 读取时逐个结算
+
+    assert state_of(batch.user_profiles.values()) == state_of(lazy.user_profiles.values())
+    assert written == len(batch._dirty_profiles)
+    assert batch.settle_resident_profiles() == 0
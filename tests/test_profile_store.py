@@ -0,0 +1,70 @@
+# heartflow/tests/test_profile_store.py
+# (v11.9) 懒加载画像库：按需加载、空闲移出、受保护画像保留
+import copy
+
+from heartflow.core.profile_store import LazyProfileStore
+from heartflow.datamodels import UserProfile
+
+
+def make_store(idle_seconds: float, user_ids=("1", "2", "3")):
+    disk = {user_id: UserProfile(user_id=user_id, name=f"用户{user_id}") for user_id in user_ids}
+    loaded = []
+
+    def loader(user_id):
+        loaded.append(user_id)
+        profile = disk.get(user_id)
+        return copy.copy(profile) if profile else None
+
+    return LazyProfileStore(loader, list(disk), idle_seconds), loaded
+
+
+def test_index_queries_do_not_load():
+    store, loaded = make_store(idle_seconds=3600)
+    assert len(store) == 3
+    assert "2" in store and "9" not in store
+    assert sorted(store) == ["1", "2", "3"]
+    assert store.resident_count == 0
+    assert loaded == []
+
+
+def test_loads_on_first_access_and_calls_on_load():
+    store, loaded = make_store(idle_seconds=3600)
+    seen = []
+    store.on_load = seen.append
+
+    profile = store["2"]
+    assert store["2"] is profile # 已驻留，不再读取
+    assert loaded == ["2"]
+    assert [p.user_id for p in seen] == ["2"]
+    assert store.loads == 1 and store.resident_count == 1
+    assert store.peek("3") is None # peek 不触发加载
+
+
+def test_evict_idle_keeps_recent_and_protected():
+    store, loaded = make_store(idle_seconds=0)
+    for user_id in ("1", "2", "3"):
+        store[user_id]
+
+    evicted = store.evict_idle(protected={"2"})
+    assert sorted(evicted) == ["1", "3"]
+    assert [user_id for user_id, _ in store.resident_items()] == ["2"]
+    assert store.evictions == 2
+    assert len(store) == 3 # 索引保留，数据仍在磁盘
+
+    store["1"] # 移出后再次访问会重新加载
+    assert loaded.count("1") == 2
+
+    store.idle_seconds = 3600
+    assert store.evict_idle() == [] # 最近访问过的画像不会移出
+
+
+def test_new_profiles_and_missing_rows():
+    store, loaded = make_store(idle_seconds=3600)
+    store["9"] = UserProfile(user_id="9", name="新用户")
+    assert "9" in store and len(store) == 4
+    assert store["9"].name == "新用户"
+    assert loaded == []
+
+    store._index.add("404") # 索引与磁盘不一致
+    assert store.get("404") is None
+    assert "404" not in store
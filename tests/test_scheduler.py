@@ -0,0 +1,111 @@
+# heartflow/tests/test_scheduler.py
+# (v11.13) 后台调度器：按到期时间执行、取消、同名替换、周期任务
+import asyncio
+
+from heartflow.utils.scheduler import HousekeepingScheduler
+
+
+async def run_for(scheduler: HousekeepingScheduler, seconds: float):
+    task = asyncio.create_task(scheduler.run())
+    await asyncio.sleep(seconds)
+    task.cancel()
+    await task
+
+
+def test_jobs_run_in_due_order():
+    scheduler = HousekeepingScheduler()
+    order = []
+    for name, delay in (("c", 0.06), ("a", 0.02), ("b", 0.04)):
+        scheduler.schedule_once(name, delay, lambda name=name: order.append(name))
+
+    asyncio.run(run_for(scheduler, 0.2))
+
+    assert order == ["a", "b", "c"]
+    assert scheduler.finished_once_jobs == 3
+    assert scheduler.get_job("a") is None
+
+
+def test_earlier_job_wakes_sleeping_scheduler():
+    ran = []
+
+    async def scenario():
+        scheduler = HousekeepingScheduler()
+        scheduler.schedule_once("late", 60, lambda: ran.append("late"))
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.02)
+        scheduler.schedule_once("early", 0.01, lambda: ran.append("early"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await task
+
+    asyncio.run(scenario())
+    assert ran == ["early"]
+
+
+def test_cancel_skips_job():
+    scheduler = HousekeepingScheduler()
+    ran = []
+    cancelled = scheduler.schedule_once("drop", 0.01, lambda: ran.append("drop"))
+    scheduler.schedule_once("keep", 0.02, lambda: ran.append("keep"))
+
+    assert scheduler.cancel("drop") is True
+    assert scheduler.cancel("drop") is False
+    assert scheduler.cancel("missing") is False
+    assert cancelled.cancelled
+
+    asyncio.run(run_for(scheduler, 0.1))
+    assert ran == ["keep"]
+    assert cancelled.runs == 0
+
+
+def test_same_name_replaces_or_keeps_existing():
+    scheduler = HousekeepingScheduler()
+    ran = []
+    first = scheduler.schedule_once("save", 0.01, lambda: ran.append("first"))
+    second = scheduler.schedule_once("save", 0.02, lambda: ran.append("second"))
+    assert first.cancelled and scheduler.get_job("save") is second
+
+    # replace=False：同名任务尚未执行时保留原任务 (防抖)
+    kept = scheduler.schedule_once("save", 0.01, lambda: ran.append("third"), replace=False)
+    assert kept is second
+
+    asyncio.run(run_for(scheduler, 0.1))
+    assert ran == ["second"]
+
+
+def test_periodic_job_repeats_until_cancelled():
+    ran = []
+
+    async def tick():
+        ran.append(1)
+
+    async def scenario():
+        scheduler = HousekeepingScheduler()
+        job = scheduler.schedule_every("tick", 0.01, tick, first_delay=0)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.15)
+        scheduler.cancel("tick")
+        runs = job.runs
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await task
+        return job, runs
+
+    job, runs_at_cancel = asyncio.run(scenario())
+    assert runs_at_cancel >= 3
+    assert job.runs == runs_at_cancel == len(ran)
+
+
+def test_failing_job_does_not_stop_scheduler():
+    scheduler = HousekeepingScheduler()
+    ran = []
+
+    def boom():
+        raise RuntimeError("boom")
+
+    failing = scheduler.schedule_once("boom", 0.01, boom)
+    scheduler.schedule_once("after", 0.02, lambda: ran.append("after"))
+
+    asyncio.run(run_for(scheduler, 0.1))
+    assert failing.failures == 1 and failing.runs == 1
+    assert ran == ["after"]
@@ -0,0 +1,92 @@
+# heartflow/tests/test_state_snapshots.py
+# (v11.8) 写时复制快照与脏行收集：collect_changes / restore_changes，只读访问不产生变更
+import pytest
+
+from heartflow.config import HeartflowConfig
+from heartflow.core.state_manager import StateManager
+
+
+@pytest.fixture
+def state_manager():
+    manager = StateManager(HeartflowConfig({"enable_user_profiles": True}), {}, {})
+    manager._get_chat_state("group:1")
+    manager._get_user_profile("10001")
+    manager.collect_changes() # 清空新建条目产生的变更
+    return manager
+
+
+def test_reads_do_not_mark_dirty(state_manager):
+    version = state_manager._version
+    state_manager._get_chat_state("group:1")
+    state_manager._get_user_profile("10001")
+    assert state_manager._version == version
+    assert not state_manager.has_pending_changes()
+    assert state_manager.collect_changes() is None
+
+
+def test_collect_changes_partial_and_full(state_manager):
+    state_manager._get_chat_state("group:2") # 新建即为变更
+    state = state_manager._get_chat_state("group:1")
+    state.total_messages += 1
+    state_manager.mark_state_dirty("group:1")
+
+    partial = state_manager.collect_changes(full=False)
+    assert set(partial.states) == {"group:1", "group:2"}
+    assert partial.profiles == {}
+    assert not state_manager.has_pending_changes()
+
+    state_manager.reset_chat_state("group:2")
+    full = state_manager.collect_changes(full=True)
+    assert set(full.states) == {"group:1"} # 全量：实体的全部现存行
+    assert full.profiles is None           # 画像无变更，不重写
+
+
+def test_collected_rows_are_snapshots(state_manager):
+    state = state_manager._get_chat_state("group:1")
+    state.total_messages = 5
+    state_manager.mark_state_dirty("group:1")
+    changes = state_manager.collect_changes()
+
+    state.total_messages = 6 # 写入期间继续修改实时状态
+    assert changes.states["group:1"].total_messages == 5
+
+
+def test_restore_changes_remarks_rows(state_manager):
+    state_manager._get_chat_state("group:2")
+    profile = state_manager._get_user_profile("10001")
+    profile.social_score = 3.0
+    state_manager.mark_profile_dirty("10001")
+    state_manager.reset_chat_state("group:1")
+    changes = state_manager.collect_changes()
+    assert not state_manager.has_pending_changes()
+
+    state_manager.restore_changes(changes) # 模拟写入失败
+    retried = state_manager.collect_changes()
+    assert set(retried.states) == {"group:2"}
+    assert retried.deleted_states == {"group:1"}
+    assert set(retried.profiles) == {"10001"}
+
+
+def test_restore_changes_skips_recreated_chats(state_manager):
+    state_manager.reset_chat_state("group:1")
+    changes = state_manager.collect_changes()
+
+    state_manager._get_chat_state("group:1") # 写入期间重新创建
+    state_manager.restore_changes(changes) # 模拟写入失败
+    retried = state_manager.collect_changes()
+    assert set(retried.states) == {"group:1"}
+    assert not retried.deleted_states
+
+
+def test_snapshot_shares_unchanged_entries(state_manager):
+    first = state_manager.snapshot()
+    assert state_manager.snapshot() is first # 版本未变时复用
+
+    state = state_manager._get_chat_state("group:1")
+    state.energy = 0.1
+    state_manager.mark_state_dirty("group:1")
+    second = state_manager.snapshot()
+    assert second.changed_states == {"group:1"}
+    assert second.states["group:1"].energy == 0.1
+    assert first.states["group:1"].energy != 0.1
+    assert second.profiles["10001"] is first.profiles["10001"]
@@ -0,0 +1,139 @@
+# heartflow/utils/image_cache.py
+# (新) v11.1 VL 图片描述缓存
+# 职责：按图片 Ref (及可选的内容哈希) 缓存 VL 描述，命中时跳过 VL 调用
+# (v11.2) 新增感知哈希索引：相似图片 (汉明距离足够小) 复用已有描述
+from collections import OrderedDict
+from typing import Dict, Any
+
+from .image_utils import hamming_distance
+
+class ImageDescriptionCache:
+    """
+    (v11.1) LRU 图片描述缓存
+    - 键：图片 Ref (完整 md5) 或 内容哈希 (sha1)，多图消息使用 "|" 拼接
+    - 值：VL 模型返回的描述文本
+    - 持久化由 PersistenceManager 负责 (to_dict / load_dict)
+    """
+
+    def __init__(self, max_entries: int = 2000, max_phash_entries: int = 4096):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.dirty = False # 自上次保存后是否有变更
+
+        # (v11.2) 感知哈希索引 (dHash -> 描述)，有界，按 LRU 淘汰
+        self.max_phash_entries = max(1, max_phash_entries)
+        self._phash_index: "OrderedDict[int, str]" = OrderedDict()
+
+        # (v11.1) 统计
+        self.hits = 0
+        self.misses = 0
+        self.phash_hits = 0 # (v11.2) 其中由感知哈希命中的次数
+
+    def get(self, key: str) -> str | None:
+        """查询缓存 (不计入统计，由调用方 record)，命中时刷新 LRU 顺序"""
+        if not key:
+            return None
+        description = self._entries.get(key)
+        if description is not None:
+            self._entries.move_to_end(key)
+        return description
+
+    def record(self, hit: bool):
+        """记录一次缓存查询结果 (一次查询可能依次尝试 Ref 与内容哈希两个键)"""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def put(self, description: str, *keys: str):
+        """以一个或多个键写入描述，超出容量时淘汰最久未使用的条目"""
+        if not description:
+            return
+        for key in keys:
+            if not key:
+                continue
+            self._entries[key] = description
+            self._entries.move_to_end(key)
+            self.dirty = True
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # --- (v11.2) 感知哈希 ---
+
+    def find_similar(self, phash: int, max_distance: int) -> str | None:
+        """
+        在感知哈希索引中查找汉明距离 <= max_distance 的最相似图片描述
+        (索引有界，线性扫描即可)
+        """
+        best_hash, best_distance = None, max_distance + 1
+        for known_hash in self._phash_index:
+            distance = hamming_distance(phash, known_hash)
+            if distance < best_distance:
+                best_hash, best_distance = known_hash, distance
+                if distance == 0:
+                    break
+
+        if best_hash is None:
+            return None
+        self._phash_index.move_to_end(best_hash)
+        self.phash_hits += 1
+        return self._phash_index[best_hash]
+
+    def put_phash(self, phash: int, description: str):
+        """写入感知哈希索引，超出容量时淘汰最久未使用的条目"""
+        if phash is None or not description:
+            return
+        self._phash_index[phash] = description
+        self._phash_index.move_to_end(phash)
+        self.dirty = True
+        while len(self._phash_index) > self.max_phash_entries:
+            self._phash_index.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # --- 持久化 ---
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为可写入磁盘的字典 (按 LRU 顺序，最近使用的在后)"""
+        return {
+            "entries": list(self._entries.items()),
+            "phash": [[f"{h:x}", d] for h, d in self._phash_index.items()], # (v11.2) 十六进制保存
+        }
+
+    def load_dict(self, data: Dict[str, Any]):
+        """从磁盘数据恢复 (保留当前内存中较新的条目)"""
+        current = self._entries
+        self._entries = OrderedDict()
+        for key, description in data.get("entries", []):
+            self._entries[key] = description
+        for key, description in current.items():
+            self._entries[key] = description
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        # (v11.2) 感知哈希索引
+        current_phash = self._phash_index
+        self._phash_index = OrderedDict()
+        for hex_hash, description in data.get("phash", []):
+            self._phash_index[int(hex_hash, 16)] = description
+        for phash, description in current_phash.items():
+            self._phash_index[phash] = description
+        while len(self._phash_index) > self.max_phash_entries:
+            self._phash_index.popitem(last=False)
+
+    # --- 统计 ---
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats_str(self) -> str:
+        """供 /heartcore 状态报告使用"""
+        return (
+            f"- VL 缓存: {len(self._entries)}/{self.max_entries} 条 | "
+            f"命中率: {self.hit_rate * 100:.1f}% ({self.hits}/{self.hits + self.misses}) | "
+            f"已节省 VL 调用: {self.hits} 次 (感知哈希: {self.phash_hits}, 索引 {len(self._phash_index)} 条)"
+        )
@@ -0,0 +1,88 @@
+# heartflow/utils/image_utils.py
+# (新) v11.1 图片辅助函数
+# 职责：下载图片原始字节并计算内容哈希 (供 VL 描述缓存使用)
+# (v11.2) 新增感知哈希 (dHash)，用于识别重新编码过的相同表情包
+import io
+import os
+import base64
+import asyncio
+import hashlib
+import aiohttp
+from astrbot.api import logger
+
+# (v11.2) Pillow 为可选依赖，未安装时感知哈希功能自动关闭
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+async def fetch_image_bytes(source: str, timeout: float = 10.0) -> bytes | None:
+    """
+    (v11.1) 获取图片原始字节
+    - 支持 http(s) URL、base64:// 和本地文件路径
+    - 失败时返回 None (调用方应退化为仅使用 Ref 作为缓存键)
+    """
+    if not source:
+        return None
+
+    try:
+        if source.startswith("http://") or source.startswith("https://"):
+            client_timeout = aiohttp.ClientTimeout(total=timeout)
+            async with aiohttp.ClientSession(timeout=client_timeout) as session:
+                async with session.get(source) as resp:
+                    if resp.status != 200:
+                        logger.debug(f"ImageUtils: 下载图片失败 (HTTP {resp.status})")
+                        return None
+                    return await resp.read()
+
+        if source.startswith("base64://"):
+            return base64.b64decode(source[len("base64://"):])
+
+        path = source[len("file:///"):] if source.startswith("file:///") else source
+        if os.path.isfile(path):
+            return await asyncio.to_thread(_read_file, path)
+
+    except Exception as e:
+        logger.debug(f"ImageUtils: 获取图片字节失败: {e}")
+    return None
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def content_hash(data: bytes) -> str:
+    """(v11.1) 图片内容哈希 (sha1，完全相同的字节才会命中)"""
+    return hashlib.sha1(data).hexdigest()
+
+def is_phash_available() -> bool:
+    """(v11.2) 是否可以计算感知哈希 (需要 Pillow)"""
+    return PILImage is not None
+
+def compute_dhash(data: bytes, hash_size: int = 8) -> int | None:
+    """
+    (v11.2) 计算图片的差异哈希 (dHash)
+    - 缩放为 (hash_size+1) x hash_size 的灰度缩略图，比较相邻像素明暗
+    - 重新编码/压缩/轻微缩放后哈希基本不变，可用汉明距离判断相似
+    - CPU 密集，应通过 asyncio.to_thread 在工作线程中调用
+    """
+    if PILImage is None or not data:
+        return None
+    try:
+        with PILImage.open(io.BytesIO(data)) as img:
+            # GIF 等多帧图片只取第一帧
+            thumb = img.convert("L").resize((hash_size + 1, hash_size), PILImage.LANCZOS)
+            pixels = list(thumb.getdata())
+    except Exception as e:
+        logger.debug(f"ImageUtils: 计算感知哈希失败: {e}")
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming_distance(a: int, b: int) -> int:
+    """(v11.2) 两个哈希之间的汉明距离"""
+    return (a ^ b).bit_count()
@@ -0,0 +1,61 @@
+# heartflow/utils/judge_format.py
+# (新) v11.24 判断模型输出解析
+# 职责：解析判断模型的两种输出格式
+#       - JSON:   {"relevance": 7, ..., "inferred_mood": "positive", "reasoning": "..."}
+#       - 紧凑行: "7,5,6,8,3,p" (各维度分数 + 心情代码，无 reasoning)
+# (不依赖 astrbot，基准脚本可直接按文件加载)
+import json
+import re
+
+# 判断模型评分的全部维度 (顺序即紧凑格式中的顺序)
+JUDGE_SCORE_FIELDS = ("relevance", "willingness", "social", "timing", "continuity")
+# (v11.23) timing / continuity 本地计算时，模型只评这三项
+JUDGE_LLM_SCORE_FIELDS = ("relevance", "willingness", "social")
+# 紧凑格式的心情代码
+MOOD_CODES = {"p": "positive", "n": "negative", "o": "neutral"}
+
+_SCORE_PATTERN = re.compile(r"(?:10|\d)(?:\.\d+)?")
+
+
+def score_fields(local_features: bool) -> tuple:
+    """判断模型需要输出的分数维度"""
+    return JUDGE_LLM_SCORE_FIELDS if local_features else JUDGE_SCORE_FIELDS
+
+
+def parse_json_judge(content: str) -> dict:
+    """解析 JSON 输出 (允许 ``` 代码块包裹)；格式错误时抛出 ValueError (json.JSONDecodeError)"""
+    content = content.strip()
+    if content.startswith("```json"): content = content[7:-3].strip()
+    elif content.startswith("```"): content = content[3:-3].strip()
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError(f"判断输出不是 JSON 对象: {type(data).__name__}")
+    return data
+
+
+def parse_compact_judge(content: str, fields: tuple) -> dict:
+    """
+    严格解析紧凑输出：恰好一行，len(fields) 个 0-10 的分数 + 一个心情代码，以逗号分隔
+    (只容忍首尾 / 逗号两侧的空白与全角逗号)；任何偏差都抛出 ValueError
+    """
+    line = content.strip()
+    if "\n" in line:
+        raise ValueError("紧凑输出包含多行")
+    parts = [part.strip() for part in line.replace("，", ",").split(",")]
+    if len(parts) != len(fields) + 1:
+        raise ValueError(f"紧凑输出字段数错误: 期望 {len(fields) + 1}，实际 {len(parts)}")
+
+    result = {}
+    for field, part in zip(fields, parts):
+        if not _SCORE_PATTERN.fullmatch(part):
+            raise ValueError(f"紧凑输出 {field} 不是 0-10 的分数: {part!r}")
+        score = float(part)
+        if score > 10:
+            raise ValueError(f"紧凑输出 {field} 超出范围: {part!r}")
+        result[field] = int(score) if score.is_integer() else score
+
+    mood = parts[-1].lower()
+    if mood not in MOOD_CODES:
+        raise ValueError(f"紧凑输出心情代码无效: {parts[-1]!r}")
+    result["inferred_mood"] = MOOD_CODES[mood]
+    return result
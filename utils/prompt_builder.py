@@ -1,5 +1,11 @@
 # heartflow/utils/prompt_builder.py
 # (v10.12 修复 - 移除 v4 人格查找，并从主LLM提示词中移除 energy 和 tier)
+# (v11.3 性能 - 并发预取引用/@ 信息，支持使用预取的历史快照构建判断 Prompt)
+# (v11.4 性能 - 多模态判断：判断 Prompt 可同时要求输出图片描述)
+# (v11.5 性能 - 引用图片复用 VL 缓存描述，供主 LLM 视觉去重使用)
+# (v11.23 性能 - timing / continuity 本地计算时，判断 Prompt 省略相关信息与维度)
+# (v11.24 性能 - 判断 Prompt 支持紧凑单行输出格式)
+import asyncio
 import datetime
 import json
 import time
@@ -15,11 +21,21 @@ import astrbot.api.message_components as Comp
 from ..datamodels import JudgeResult, ChatState, UserProfile
 from ..config import HeartflowConfig
 from ..core.state_manager import StateManager
+from .judge_format import score_fields
 
+# (v11.24) 紧凑判断输出中各分数维度的中文名 (顺序与 judge_format.JUDGE_SCORE_FIELDS 一致)
+COMPACT_FIELD_LABELS = {
+    "relevance": "内容相关度",
+    "willingness": "回复意愿",
+    "social": "社交适宜性",
+    "timing": "时机恰当性",
+    "continuity": "对话连贯性",
+}
 
 # (v5) 解决循环依赖
 if TYPE_CHECKING:
     from ..features.persona_summarizer import PersonaSummarizer
+    from .image_cache import ImageDescriptionCache
 
 
 class PromptBuilder:
@@ -35,11 +51,13 @@ class PromptBuilder:
         self.state_manager = state_manager # <-- 接收并保存
         self.bot_name: str = None # 将由 main.py 异步注入
         self.persona_summarizer: "PersonaSummarizer" = None # (v5) 占位符
+        self.image_cache: "ImageDescriptionCache" = None # (v11.5) 由 main.py 注入 (未启用时为 None)
 
-    def _get_image_ref(self, component: Comp.Image) -> str:
+    def _get_image_ref(self, component: Comp.Image, length: int = 6) -> str:
         """
         (优化建议 2) 
         为 Comp.Image 生成一个简短、唯一的引用 ID
+        (v11.1) length 可调：Prompt 中使用 6 位短 ID，VL 缓存使用完整 md5 作为键
         """
         try:
             # 优先使用 URL，其次是 file 路径
@@ -47,8 +65,8 @@ class PromptBuilder:
             if not source_str:
                 return "img_unknown"
             
-            # 使用 md5 哈希的前 6 位作为唯一 ID
-            return "img_" + hashlib.md5(source_str.encode()).hexdigest()[:6]
+            # 使用 md5 哈希的前 length 位作为唯一 ID
+            return "img_" + hashlib.md5(source_str.encode()).hexdigest()[:length]
         except Exception:
             return "img_error"
 
@@ -56,7 +74,12 @@ class PromptBuilder:
         """
         (我们之前的修复) 
         三级查找逻辑，用于获取 @ 用户的昵称
+        (v11.3) 优先使用 prefetch_rich_lookups 预取的结果
         """
+        prefetch = event.get_extra("heartflow_rich_prefetch")
+        if prefetch and at_user_id in prefetch["at_names"]:
+            return prefetch["at_names"][at_user_id]
+
         at_name = None
         
         # 级别 1: 从 StateManager 缓存获取
@@ -88,27 +111,133 @@ class PromptBuilder:
 
         return at_name
 
+    async def _get_replied_msg(self, event: AstrMessageEvent, msg_id: str) -> dict | None:
+        """
+        (v11.3) 获取被引用的原消息 (OneBot get_msg)
+        优先使用 prefetch_rich_lookups 预取的结果
+        """
+        prefetch = event.get_extra("heartflow_rich_prefetch")
+        if prefetch and msg_id in prefetch["replies"]:
+            return prefetch["replies"][msg_id]
+
+        if (event.get_platform_name() != "aiocqhttp" or 
+            not hasattr(event, 'bot')):
+            return None
+        try:
+            return await event.bot.api.call_action('get_msg', message_id=int(msg_id))
+        except Exception as e:
+            logger.debug(f"PromptBuilder: 获取引用消息失败: {e}。")
+            return None
+
+    async def prefetch_rich_lookups(self, event: AstrMessageEvent):
+        """
+        (v11.3) 并发预取消息链中所有引用消息和 @ 昵称
+        结果存入 event extra，后续 _build_rich_content_string 不再逐个串行调用 API
+        """
+        if not event.message_obj or not event.message_obj.message:
+            return
+
+        reply_ids, at_ids = [], []
+        for component in event.message_obj.message:
+            if isinstance(component, Comp.Reply) and getattr(component, 'id', None):
+                reply_ids.append(str(component.id))
+            elif isinstance(component, Comp.At):
+                at_ids.append(str(component.qq))
+        reply_ids = list(dict.fromkeys(reply_ids))
+        at_ids = list(dict.fromkeys(at_ids))
+
+        if not reply_ids and not at_ids:
+            return
+
+        results = await asyncio.gather(
+            *(self._get_replied_msg(event, msg_id) for msg_id in reply_ids),
+            *(self._get_at_name(event, at_id) for at_id in at_ids),
+            return_exceptions=True
+        )
+        replies = {
+            msg_id: (result if not isinstance(result, BaseException) else None)
+            for msg_id, result in zip(reply_ids, results[:len(reply_ids)])
+        }
+        at_names = {
+            at_id: result
+            for at_id, result in zip(at_ids, results[len(reply_ids):])
+            if not isinstance(result, BaseException)
+        }
+        event.set_extra("heartflow_rich_prefetch", {"replies": replies, "at_names": at_names})
+
     def set_persona_summarizer(self, summarizer: "PersonaSummarizer"):
         """(v5) 注入 PersonaSummarizer 以解决循环依赖"""
         self.persona_summarizer = summarizer
         logger.info("💖 PromptBuilder：已成功注入 PersonaSummarizer。")
 
+    def set_image_cache(self, image_cache: "ImageDescriptionCache"):
+        """(v11.5) 注入 VL 描述缓存 (用于引用图片的描述查询)"""
+        self.image_cache = image_cache
+
+    def get_cached_image_description(self, component: Comp.Image) -> str | None:
+        """(v11.5) 按图片 Ref 查询 VL 缓存中已有的描述 (不触发 VL 调用)"""
+        if not self.image_cache:
+            return None
+        return self.image_cache.get(self._get_image_ref(component, length=32))
+
+    def _images_from_raw_chain(self, raw_message_chain) -> list:
+        """(v11.5) 从 OneBot 原始消息段中提取图片，构造为 Comp.Image"""
+        images = []
+        if isinstance(raw_message_chain, list):
+            for seg in raw_message_chain:
+                if isinstance(seg, dict) and seg.get('type') == 'image':
+                    img_data = seg.get('data', {})
+                    images.append(Comp.Image(file=img_data.get('file', ''), url=img_data.get('url', '')))
+        return images
+
+    async def get_quoted_images(self, event: AstrMessageEvent) -> list:
+        """(v11.5) 获取消息中引用 (Reply) 的原消息里的图片 (优先使用预取结果)"""
+        images = []
+        if not event.message_obj or not event.message_obj.message:
+            return images
+        for component in event.message_obj.message:
+            if isinstance(component, Comp.Reply) and getattr(component, 'id', None):
+                replied_msg_data = await self._get_replied_msg(event, str(component.id))
+                if replied_msg_data:
+                    images.extend(self._images_from_raw_chain(replied_msg_data.get('message', [])))
+        return images
+
     # --- 1. 主判断 Prompt ---
 
-    async def build_judge_prompt(self, event: AstrMessageEvent, chat_state: ChatState, user_profile: UserProfile) -> str:
+    async def build_judge_prompt(self, event: AstrMessageEvent, chat_state: ChatState, user_profile: UserProfile, 
+                                 request_image_description: bool = False) -> str:
         """
         (v10.0) 构建“判断模型”的完整 Prompt
         (v10.0: 使用新的 _get_persona_key_and_summary 辅助函数)
+        (v11.4: request_image_description=True 时，图片随判断请求一同发送，并要求模型顺带输出图片描述)
+        (v11.23: judge_local_features 开启时 timing / continuity 由本地计算，Prompt 中省略相关信息与维度)
+        (v11.24: judge_compact_output 开启且无需图片描述时，要求单行紧凑输出，如 "7,5,6,p")
         """
+        local_features = self.config.judge_local_features
+        compact = self.config.judge_compact_output and not request_image_description # (v11.24)
         
         # 1. 获取所有组件
-        # ！！！ (v10.0 修复) 此调用现在确保 *所有* 缓存（包括风格）都已生成
-        _persona_key, persona_prompt = await self._get_persona_key_and_summary(event.unified_msg_origin)
-        
         rich_content = await self._build_rich_content_string(event)
-        recent_messages = await self._get_recent_messages(event.unified_msg_origin, self.config.context_messages_count)
         chat_context = self._build_chat_context(chat_state)
-        last_reply = await self._get_last_bot_reply(event)
+
+        # (v11.3) 优先使用 MessageHandler 富化阶段并发预取的人格与历史快照
+        enrichment = event.get_extra("heartflow_enrichment")
+
+        if enrichment and enrichment.persona_key:
+            persona_prompt = enrichment.persona_prompt
+        else:
+            # ！！！ (v10.0 修复) 此调用现在确保 *所有* 缓存（包括风格）都已生成
+            _persona_key, persona_prompt = await self._get_persona_key_and_summary(event.unified_msg_origin)
+
+        if enrichment and enrichment.history is not None:
+            # (快照在保存当前消息之前获取，此处补上当前消息，与旧流程看到的历史一致)
+            sender_name = event.get_extra("heartflow_poke_sender_name") or event.get_sender_name()
+            history = enrichment.history + [{"role": "user", "content": f"{sender_name or '用户'}: {rich_content}"}]
+            recent_messages = self._format_recent_messages(history, self.config.context_messages_count)
+            last_reply = None if local_features else self._find_last_bot_reply(history)
+        else:
+            recent_messages = await self._get_recent_messages(event.unified_msg_origin, self.config.context_messages_count)
+            last_reply = None if local_features else await self._get_last_bot_reply(event)
         
         # 2. 解析 @/Reply/Profile
         reply_info, at_info = self._build_perception_info(event)
@@ -121,6 +250,8 @@ class PromptBuilder:
         image_desc = event.get_extra("image_description") #
         if image_desc:
             image_desc_str = f"\n[图片描述]: {image_desc}"
+        elif request_image_description:
+            image_desc_str = "\n[附带图片]: 见随本请求发送的图片"
             
         # 4. 获取心情
         mood_float = chat_state.mood
@@ -134,6 +265,32 @@ class PromptBuilder:
             reasoning_part = ',\n    "reasoning": "详细分析原因..."'
         else:
             reasoning_part = ''
+
+        # (v11.4) 多模态判断：在同一个 JSON 中顺带输出图片描述
+        image_part = ""
+        image_requirement = ""
+        if request_image_description:
+            image_part = ',\n    "image_description": "图片描述"'
+            image_requirement = f"\n- **图片描述**：请同时查看随附的图片，并在 image_description 字段中给出描述。要求：{self.config.image_recognition_prompt}"
+
+        # (v11.23) 时机 / 连贯性相关的信息与维度 (本地计算时省略)
+        last_speak_line = ""
+        last_reply_section = ""
+        local_dimensions = ""
+        local_fields = ""
+        if not local_features:
+            last_speak_line = f"\n- 上次发言: {int((time.time() - chat_state.last_reply_time) / 60)}分钟前"
+            last_reply_section = f"""
+## 上次机器人回复
+{last_reply if last_reply else "暂无上次回复记录"}
+"""
+            local_dimensions = """
+4. **时机恰当性**(0-10)：回复时机是否恰当
+5. **对话连贯性**(0-10)：当前消息与上次机器人回复的关联程度"""
+            local_fields = """
+    "timing": 分数,
+    "continuity": 分数,"""
+        output_requirement = self._build_judge_output_requirement(compact, local_fields, reasoning_part, image_part) # (v11.24)
             
         base_judge_prompt = f"""
 你是群聊机器ンの决策系统，需要判断是否应该主动回复以下消息。
@@ -144,8 +301,7 @@ class PromptBuilder:
 ## 当前群聊情况
 - 群聊ID: {event.unified_msg_origin}
 - 我的精力水平: {chat_state.energy:.1f}/1.0
-- 我的心情: {mood_str} (数值: {mood_float:.2f})
-- 上次发言: {int((time.time() - chat_state.last_reply_time) / 60)}分钟前
+- 我的心情: {mood_str} (数值: {mood_float:.2f}){last_speak_line}
 
 {user_profile_info}
 
@@ -154,10 +310,7 @@ class PromptBuilder:
 
 ## 最近{self.config.context_messages_count}条对话历史
 {recent_messages}
-
-## 上次机器人回复
-{last_reply if last_reply else "暂无上次回复记录"}
-
+{last_reply_section}
 ## 待判断消息
 发送者: {event.get_sender_name()}
 消息结构: {reply_info}{at_info}
@@ -166,38 +319,49 @@ class PromptBuilder:
 时间: {datetime.datetime.now().strftime('%H:%M:%S')}
 
 ## 评估要求
-- **(v9.0) 社交规则：基于[我对TA的熟悉程度]调整你的回复意愿。如果关系是 'avoiding'，[willingness] 必须是 0-1 分。**
+- **(v9.0) 社交规则：基于[我对TA的熟悉程度]调整你的回复意愿。如果关系是 'avoiding'，[willingness] 必须是 0-1 分。**{image_requirement}
 请从以下维度评估（0-10分），**重要提醒：基于上述机器人角色设定和【我的心情】来判断是否适合回复**：
 
 1. **内容相关度**(0-10)：消息是否有趣、有价值、适合我回复
 2. **回复意愿**(0-10)：基于当前状态，我回复此消息的意愿（受心情和关系影响）
-3. **社交适宜性**(0-10)：在当前群聊氛围下回复是否合适
-4. **时机恰当性**(0-10)：回复时机是否恰当
-5. **对话连贯性**(0-10)：当前消息与上次机器人回复的关联程度
+3. **社交适宜性**(0-10)：在当前群聊氛围下回复是否合适{local_dimensions}
 
 **回复阈值**: {self.config.reply_threshold} (综合评分达到此分数才回复)
+{output_requirement}"""
+        
+        complete_prompt = "你是一个专业的群聊回复决策系统，能够准确判断消息价值和回复时机。"
+        if persona_prompt: complete_prompt += f"\n\n决策角色：\n{persona_prompt}"
+        complete_prompt += f"\n\n**重要提醒：{'必须严格按指定的单行格式返回' if compact else '必须严格JSON格式返回'}！**\n\n"
+        complete_prompt += base_judge_prompt
+        return complete_prompt
 
+    def _build_judge_output_requirement(self, compact: bool, local_fields: str, reasoning_part: str, image_part: str) -> str:
+        """(v11.24) 判断 Prompt 的输出格式要求 (JSON / 紧凑单行)"""
+        if compact:
+            fields = score_fields(self.config.judge_local_features)
+            header = ",".join(COMPACT_FIELD_LABELS[field] for field in fields) + ",心情"
+            example = ",".join(str(score) for score in (7, 5, 6, 4, 3)[:len(fields)]) + ",p"
+            return f"""
+**重要！！！请只输出一行，用英文逗号分隔，不要添加任何其他内容：**
+{header}
+(分数为 0-10 的整数；心情为 p=积极 / n=消极 / o=中性)
+
+示例：{example}
+"""
+        return f"""
 **重要！！！请严格按照以下JSON格式回复，不要添加任何其他内容：**
 
 请以JSON格式回复：
 {{
     "relevance": 分数,
     "willingness": 分数,
-    "social": 分数,
-    "timing": 分数,
-    "continuity": 分数,
+    "social": 分数,{local_fields}
     "inferred_mood": "positive/negative/neutral"
-    {reasoning_part}
+    {reasoning_part}{image_part}
 }}
 
 **注意：你的回复必须是完整的JSON对象，不要包含任何解释性文字或其他内容！**
 """
-        
-        complete_prompt = "你是一个专业的群聊回复决策系统，能够准确判断消息价值和回复时机。"
-        if persona_prompt: complete_prompt += f"\n\n决策角色：\n{persona_prompt}"
-        complete_prompt += "\n\n**重要提醒：必须严格JSON格式返回！**\n\n"
-        complete_prompt += base_judge_prompt
-        return complete_prompt
 
     # --- 2. 主回复 Prompt ---
 
@@ -378,14 +542,26 @@ class PromptBuilder:
 """
         return opening_prompt
     
-    async def build_resume_topic_prompt(self, umo: str) -> str:
+    async def get_resume_history(self, umo: str) -> str | None:
         """
-        (新) 构建“恢复话题”的 Prompt
-        来源: main.py -> _proactive_topic_task
+        (v11.17) 读取“恢复话题”分析所用的最近 100 条历史文本，无历史时返回 None
+        (供调用方计算哈希、判断历史是否有变化)
         """
         recent_history_str = await self._get_recent_messages(umo, count=100)
         if not recent_history_str or recent_history_str == "暂无对话历史":
             return None
+        return recent_history_str
+
+    async def build_resume_topic_prompt(self, umo: str, recent_history_str: str = None) -> str:
+        """
+        (新) 构建“恢复话题”的 Prompt
+        来源: main.py -> _proactive_topic_task
+        (v11.17) 可传入已读取的历史文本，避免重复读取
+        """
+        if recent_history_str is None:
+            recent_history_str = await self.get_resume_history(umo)
+        if not recent_history_str:
+            return None
             
         resume_prompt = f"""
 分析以下聊天记录：
@@ -399,8 +575,96 @@ class PromptBuilder:
 }}"""
         return resume_prompt
 
+    def build_proactive_combined_prompt(self, minutes_silent: int, recent_history_str: str = None, resume_topic: str = None) -> str:
+        """
+        (v11.16) 构建“主动话题-单次调用”的 Prompt
+        将“恢复旧话题判断”、“话题思路”、“开场白”合并为一次 JSON 输出 (人格放在 system_prompt)
+        有历史记录时才附带恢复旧话题的判断
+        (v11.17) 已有恢复判断结论时不再附带历史：resume_topic 为要接续的话题，
+                 两者都为 None 表示直接生成新话题
+        """
+        if resume_topic:
+            topic_task = f"""
+1. 你打算接续之前群里聊到一半的话题：“{resume_topic}”。"resumed" 设为 true，"topic" 写这个话题。"""
+        elif recent_history_str:
+            topic_task = f"""
+以下是群里之前的聊天记录：
+{recent_history_str}
+
+1. 先判断记录中是否存在一个有趣但被意外中断的话题。
+   - 如果有，把 "resumed" 设为 true，"topic" 写该话题的总结（20字以内），开场白要自然地接续这个话题。
+   - 如果没有，把 "resumed" 设为 false，基于你的角色想出一个简短的、适合发起的新话题。"""
+        else:
+            topic_task = """
+1. 基于你的角色，想出一个简短的、适合发起的新话题，"resumed" 设为 false。"""
+
+        combined_prompt = f"""
+你正在一个群聊中，群聊已经沉寂了{minutes_silent}分钟，你决定主动发起话题。
+{topic_task}
+2. 基于该话题写一句自然的、符合你人设的开场白，就像一个真实群友的“冒泡”，不要暴露你是机器人，也不要提及“话题”这个词。
+
+请严格按JSON格式回复，不要添加任何其他内容：
+{{
+    "resumed": true/false,
+    "topic": "话题（20字以内）",
+    "opening": "你的开场白"
+}}"""
+        return combined_prompt
+
+    def build_proactive_pool_prompt(self, count: int, avoid_openers: list) -> str:
+        """
+        (v11.18) 构建“主动话题池-批量开场白”的 Prompt (人格放在 system_prompt)
+        生成的开场白会在之后任意群聊、任意时刻发送，因此不能依赖具体的聊天记录或时间
+        """
+        avoid_text = ""
+        if avoid_openers:
+            avoid_lines = "\n".join(f"- {opener}" for opener in avoid_openers)
+            avoid_text = f"\n以下是你最近已经用过的开场白，新的开场白不要与它们重复或相似：\n{avoid_lines}\n"
+
+        pool_prompt = f"""
+你经常在安静了很久的群聊里主动冒泡，发起新话题。
+请基于你的角色，提前准备 {count} 条互不相同的开场白，每条围绕一个不同的话题。
+{avoid_text}
+要求：
+1. 每条都自然、简短，就像一个真实群友的“冒泡”，不要暴露你是机器人，也不要提及“话题”这个词。
+2. 不要提及具体的时间、日期、群友名字或之前的聊天内容（这些开场白会在之后的任意时刻使用）。
+
+请严格按JSON格式回复，不要添加任何其他内容：
+{{
+    "openers": ["开场白1", "开场白2"]
+}}"""
+        return pool_prompt
+
+    def build_poke_pool_prompt(self, count: int, avoid_replies: list) -> str:
+        """
+        (v11.19) 构建“戳一戳回复池-批量回复”的 Prompt (人格放在 system_prompt)
+        回复中用 {name} 指代戳你的人，发送时替换为对方昵称
+        """
+        avoid_text = ""
+        if avoid_replies:
+            avoid_lines = "\n".join(f"- {reply}" for reply in avoid_replies)
+            avoid_text = f"\n以下是你已经准备好的回复，新的回复不要与它们重复或相似：\n{avoid_lines}\n"
+
+        pool_prompt = f"""
+群里经常有人戳你（戳一戳）。请提前准备 {count} 条被戳时的回应，风格和内容要各不相同。
+{avoid_text}
+要求：
+1. 每条都用符合人设的、元气的、简短的（1-2句话）方式回应。
+2. 需要称呼对方时写 {{name}}，不要编造具体的名字；不要提及具体的时间或聊天内容。
+
+请严格按JSON格式回复，不要添加任何其他内容：
+{{
+    "replies": ["回应1", "回应2"]
+}}"""
+        return pool_prompt
+
     # --- 4. 辅助函数 (迁移) ---
 
+    @staticmethod
+    def format_poke_action(count: int = 1) -> str:
+        """(v11.20) 戳一戳动作描述，合并后的多次戳一戳显示为“戳了你N下”"""
+        return "戳了你一下" if count <= 1 else f"戳了你{count}下"
+
     async def _fetch_bot_name_from_context(self):
         """
         (新) 内部函数，确保 self.bot_name 被设置
@@ -445,7 +709,8 @@ class PromptBuilder:
         if event.get_extra("heartflow_is_poke_event"):
             sender_name = event.get_extra("heartflow_poke_sender_name") or "用户"
             bot_name = self.bot_name or '我'
-            return f"[{sender_name} 戳了你一下] (Interaction: {sender_name} -> {bot_name})"
+            poke_action = self.format_poke_action(event.get_extra("heartflow_poke_count") or 1) # (v11.20)
+            return f"[{sender_name} {poke_action}] (Interaction: {sender_name} -> {bot_name})"
 
         if not event.message_obj or not event.message_obj.message:
             return event.message_str
@@ -463,12 +728,10 @@ class PromptBuilder:
                     reply_text = "[回复楼上]"
                     replied_sender_name = "未知"
                     try:
-                        if (event.get_platform_name() == "aiocqhttp" and 
-                            hasattr(event, 'bot') and 
-                            hasattr(component, 'id')):
+                        if getattr(component, 'id', None):
 
-                            msg_id = int(component.id)
-                            replied_msg_data = await event.bot.api.call_action('get_msg', message_id=msg_id)
+                            # (v11.3) 优先使用预取结果
+                            replied_msg_data = await self._get_replied_msg(event, str(component.id))
                             
                             if replied_msg_data:
                                 replied_sender_name = replied_msg_data.get('sender', {}).get('card') or \
@@ -481,22 +744,20 @@ class PromptBuilder:
 
                                 has_image_in_reply = False
                                 image_ref_in_reply = None
-                                if isinstance(raw_message_chain, list):
-                                    for seg in raw_message_chain:
-                                        if seg.get('type') == 'image':
-                                            has_image_in_reply = True
-                                            # (建议 2) 构造一个临时的 Comp.Image 来获取 Ref
-                                            fake_img_data = seg.get('data', {})
-                                            fake_comp = Comp.Image(
-                                                file=fake_img_data.get('file', ''), 
-                                                url=fake_img_data.get('url', '')
-                                            )
-                                            image_ref_in_reply = self._get_image_ref(fake_comp)
-                                            break
+                                image_desc_in_reply = None
+                                # (建议 2) 构造临时的 Comp.Image 来获取 Ref (v11.5 抽取为 _images_from_raw_chain)
+                                reply_images = self._images_from_raw_chain(raw_message_chain)
+                                if reply_images:
+                                    has_image_in_reply = True
+                                    image_ref_in_reply = self._get_image_ref(reply_images[0])
+                                    image_desc_in_reply = self.get_cached_image_description(reply_images[0]) # (v11.5)
                                 
                                 if has_image_in_reply and not replied_content_str.strip():
                                     # (建议 2) 格式 1: 回复图片
-                                    reply_text = f"[回复图片(来自:{replied_sender_name}, Ref:{image_ref_in_reply})]"
+                                    if image_desc_in_reply:
+                                        reply_text = f"[回复图片(来自:{replied_sender_name}, 描述: {image_desc_in_reply}, Ref:{image_ref_in_reply})]"
+                                    else:
+                                        reply_text = f"[回复图片(来自:{replied_sender_name}, Ref:{image_ref_in_reply})]"
                                 else:
                                     # (我们之前的修复) 格式 2: 回复文字
                                     preview_text = replied_content_str.strip() or "一条消息"
@@ -577,30 +838,49 @@ class PromptBuilder:
 """
         return user_profile_info
 
-    async def _get_recent_messages(self, umo: str, count: int) -> str:
+    async def get_history_snapshot(self, umo: str) -> list:
         """
-        (迁移) 获取最近的消息历史 (v3.5 修复版)
-        来源: decision_engine.py -> _get_recent_messages
+        (v11.3) 读取一次完整的对话历史 (供富化阶段并发预取)
         """
         try:
             curr_cid = await self.context.conversation_manager.get_curr_conversation_id(umo)
-            if not curr_cid: return "暂无对话历史"
+            if not curr_cid: return []
 
             conversation = await self.context.conversation_manager.get_conversation(umo, curr_cid)
-            if not conversation or not conversation.history: return "暂无对话历史"
-
-            context = json.loads(conversation.history)
-            recent_context = context[-count:] if len(context) > count else context
+            if not conversation or not conversation.history: return []
 
-            messages_text = [
-                msg.get("content", "") 
-                for msg in recent_context 
-                if msg.get("content")
-            ]
-            return "\n".join(messages_text) if messages_text else "暂无对话历史"
+            return json.loads(conversation.history)
         except Exception as e:
             logger.debug(f"获取消息历史失败: {e}")
-            return "暂无对话历史"
+            return []
+
+    def _format_recent_messages(self, history: list, count: int) -> str:
+        """(v11.3) 将历史列表格式化为最近 count 条消息文本"""
+        recent_context = history[-count:] if len(history) > count else history
+
+        messages_text = [
+            msg.get("content", "") 
+            for msg in recent_context 
+            if msg.get("content")
+        ]
+        return "\n".join(messages_text) if messages_text else "暂无对话历史"
+
+    def _find_last_bot_reply(self, history: list) -> str:
+        """(v11.3) 从历史列表中查找上次机器人的回复"""
+        for msg in reversed(history):
+            role = msg.get("role", "unknown")
+            content = msg.get("content", "")
+            if role == "assistant" and content.strip():
+                return content
+        return None
+
+    async def _get_recent_messages(self, umo: str, count: int) -> str:
+        """
+        (迁移) 获取最近的消息历史 (v3.5 修复版)
+        来源: decision_engine.py -> _get_recent_messages
+        """
+        history = await self.get_history_snapshot(umo)
+        return self._format_recent_messages(history, count)
 
     def _build_chat_context(self, chat_state: ChatState) -> str:
         """
@@ -617,24 +897,8 @@ class PromptBuilder:
         (迁移) 获取上次机器人的回复消息
         来源: decision_engine.py -> _get_last_bot_reply
         """
-        try:
-            curr_cid = await self.context.conversation_manager.get_curr_conversation_id(event.unified_msg_origin)
-            if not curr_cid: return None
-
-            conversation = await self.context.conversation_manager.get_conversation(event.unified_msg_origin, curr_cid)
-            if not conversation or not conversation.history: return None
-
-            context = json.loads(conversation.history)
-
-            for msg in reversed(context):
-                role = msg.get("role", "unknown")
-                content = msg.get("content", "")
-                if role == "assistant" and content.strip():
-                    return content
-            return None
-        except Exception as e:
-            logger.debug(f"获取上次bot回复失败: {e}")
-            return None
+        history = await self.get_history_snapshot(event.unified_msg_origin)
+        return self._find_last_bot_reply(history)
             
     # --- (v10.8) 移除 _get_persona_id_by_umo ---
             
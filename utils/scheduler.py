@@ -0,0 +1,181 @@
+# heartflow/utils/scheduler.py
+# (新) v11.13 后台杂务调度器
+# 职责：以单个最小堆统一调度所有周期性 / 一次性的后台杂务 (状态刷写、缓存保存、过载冷却到期...)
+#       没有到期任务时整个调度器处于休眠，不轮询、不扫描
+import asyncio
+import heapq
+import inspect
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Union
+from astrbot.api import logger
+
+JobFunc = Callable[[], Union[None, Awaitable[None]]]
+
+
+@dataclass(eq=False)
+class ScheduledJob:
+    """(v11.13) 调度任务 (interval 为 None 表示一次性任务)"""
+    name: str
+    func: JobFunc
+    interval: float = None
+    jitter: float = 0.0              # 每次触发时间的随机偏移上限 (秒)，避免多个任务同时唤醒
+    next_run: float = 0.0            # time.monotonic() 时间
+    cancelled: bool = False
+
+    # --- 统计 ---
+    runs: int = 0
+    failures: int = 0
+    total_ms: float = 0.0
+    last_ms: float = 0.0
+    last_run: float = 0.0            # time.time() 时间戳
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.runs if self.runs else 0.0
+
+
+@dataclass(order=True)
+class _HeapEntry:
+    due: float
+    seq: int
+    job: ScheduledJob = field(compare=False)
+
+
+class HousekeepingScheduler:
+    """
+    (v11.13) 基于最小堆的调度器
+    - schedule_once / schedule_every 注册任务，同名任务互相替换 (或保留已有的，见 replace 参数)
+    - cancel(name) 取消任务 (惰性删除：堆中条目在弹出时跳过)
+    - 任务函数可以是同步函数或协程函数，在调度协程中依次执行；阻塞 I/O 应自行 to_thread
+    - run() 由 main.py 作为后台任务启动
+    """
+
+    def __init__(self):
+        self._heap: List[_HeapEntry] = []
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+
+        # 统计
+        self.finished_once_jobs = 0
+
+    # --- 注册 / 取消 ---
+
+    def schedule_once(self, name: str, delay: float, func: JobFunc, jitter: float = 0.0, replace: bool = True) -> ScheduledJob:
+        """
+        一次性任务，delay 秒后执行
+        replace=False 时若同名任务尚未执行，则保留原任务 (用于“防抖”式的延迟保存)
+        """
+        if not replace:
+            existing = self._jobs.get(name)
+            if existing and not existing.cancelled:
+                return existing
+        return self._add(ScheduledJob(name=name, func=func, jitter=jitter), delay)
+
+    def schedule_every(self, name: str, interval: float, func: JobFunc, jitter: float = 0.0, first_delay: float = None) -> ScheduledJob:
+        """周期任务，每 interval 秒执行一次 (首次在 first_delay 秒后，默认等于 interval)"""
+        job = ScheduledJob(name=name, func=func, interval=interval, jitter=jitter)
+        return self._add(job, interval if first_delay is None else first_delay)
+
+    def cancel(self, name: str) -> bool:
+        job = self._jobs.pop(name, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    def get_job(self, name: str) -> "ScheduledJob | None":
+        return self._jobs.get(name)
+
+    def _add(self, job: ScheduledJob, delay: float) -> ScheduledJob:
+        self.cancel(job.name)
+        self._jobs[job.name] = job
+        self._push(job, time.monotonic() + max(0.0, delay))
+        return job
+
+    def _push(self, job: ScheduledJob, due: float):
+        if job.jitter:
+            due += random.uniform(0, job.jitter)
+        job.next_run = due
+        self._seq += 1
+        # 新任务比当前最早的任务更早到期时唤醒调度协程
+        if not self._heap or due < self._heap[0].due:
+            self._wakeup.set()
+        heapq.heappush(self._heap, _HeapEntry(due, self._seq, job))
+
+    # --- 调度循环 ---
+
+    async def run(self):
+        logger.info("💖 心流：后台调度器已启动。")
+        while True:
+            try:
+                self._discard_cancelled()
+                if self._heap:
+                    timeout = self._heap[0].due - time.monotonic()
+                    if timeout > 0:
+                        await self._sleep(timeout)
+                        continue
+                    entry = heapq.heappop(self._heap)
+                    await self._run_job(entry.job)
+                else:
+                    await self._sleep(None)
+            except asyncio.CancelledError:
+                logger.info("💖 心流：后台调度器被取消。")
+                break
+            except Exception as e:
+                logger.error(f"心流：后台调度器异常: {e}")
+
+    async def _sleep(self, timeout: "float | None"):
+        """休眠到超时或有更早的任务加入"""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _discard_cancelled(self):
+        while self._heap and self._heap[0].job.cancelled:
+            heapq.heappop(self._heap)
+
+    async def _run_job(self, job: ScheduledJob):
+        if job.interval is not None:
+            # 先排下一次，任务执行期间的 cancel / 替换依然有效
+            self._push(job, time.monotonic() + job.interval)
+        else:
+            self._jobs.pop(job.name, None)
+            job.cancelled = True # 已执行，防止同名任务被误判为仍在等待
+
+        start = time.perf_counter()
+        try:
+            result = job.func()
+            if inspect.isawaitable(result):
+                await result
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.failures += 1
+            logger.error(f"心流：后台任务 {job.name} 执行失败: {e}")
+        finally:
+            job.last_ms = (time.perf_counter() - start) * 1000
+            job.total_ms += job.last_ms
+            job.runs += 1
+            job.last_run = time.time()
+            if job.interval is None:
+                self.finished_once_jobs += 1
+
+    # --- 统计 ---
+
+    def get_stats_str(self) -> str:
+        """供 /heartcore 状态报告使用 (只列出周期任务，一次性任务汇总计数)"""
+        lines = [f"- 后台调度器: 等待中 {len(self._jobs)} 个任务 | 已完成一次性任务 {self.finished_once_jobs} 个"]
+        now = time.monotonic()
+        for job in self._jobs.values():
+            if job.interval is None:
+                continue
+            lines.append(
+                f"  · {job.name}: 每 {job.interval:.0f}s | 已执行 {job.runs} 次 (失败 {job.failures}) | "
+                f"平均 {job.avg_ms:.1f}ms | {max(0, job.next_run - now):.0f}s 后"
+            )
+        return "\n".join(lines)